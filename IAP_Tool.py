@@ -1,10 +1,15 @@
 # iap_tool.py
 
+import argparse
 import time
 import os
 import binascii
 import struct 
+import logging
 from zlgcan import * 
+from zcan_log import setup_logging, hexdump, EVENT_BUFFER_SIZE
+
+log = logging.getLogger("iap")
 # 1. 协议常量定义
 
 # --- 上位机 -> MCU 的CAN ID ---
@@ -12,9 +17,11 @@ HOST_REQUEST_ID_APP_RESET = 0xC0
 HOST_REQUEST_ID_METADATA = 0xC1 
 HOST_REQUEST_ID_DATA = 0xC2 
 HOST_REQUEST_ID_EOT = 0xC3 
+HOST_REQUEST_ID_APP_INFO = 0xC4 # 查询已安装程序 (App 不支持时没有响应)
 
 # MCU -> 上位机 的CAN ID
 MCU_RESPONSE_ID_APP_ACK = 0xA0 
+MCU_RESPONSE_ID_APP_INFO = 0xA1 # 已安装程序的 [大小 4B][CRC32 4B] (小端，与元数据报文相同)
 MCU_RESPONSE_ID_BL_READY = 0xB0 
 MCU_RESPONSE_ID_ERASE_OK = 0xB1 
 MCU_RESPONSE_ID_DATA_ACK = 0xB2 
@@ -23,6 +30,7 @@ MCU_RESPONSE_ID_ERROR = 0xB4
 
 # 协议中约定的特定数据
 APP_RESET_DATA = (c_ubyte * 8)(0x11, 0x11, 0x11, 0x11, 0x11, 0x11, 0x11, 0x11)
+APP_INFO_DATA = (c_ubyte * 8)(0x44, 0x44, 0x44, 0x44, 0x44, 0x44, 0x44, 0x44)
 BL_READY_DATA = (c_ubyte * 8)(0x22, 0x22, 0x22, 0x22, 0x22, 0x22, 0x22, 0x22)
 BL_ERASE_OK_DATA = (c_ubyte * 8)(0x33, 0x33, 0x33, 0x33, 0x33, 0x33, 0x33, 0x33)
 
@@ -44,6 +52,11 @@ PACKET_PAYLOAD_SIZE = 6 # 每包传输6字节固件
 DATA_ACK_TIMEOUT_S = 0.5 # 等待数据包ACK的超时时间 (500ms)
 VERIFY_TIMEOUT_S = 10.0 # 等待MCU校验固件的长超时时间 (10s)
 MAX_RETRIES = 3 # 最大重传次数
+APP_INFO_TIMEOUT_S = 0.3 # 等待App回复已安装程序信息的时间
+# True: 更新前先查询App上已安装的程序 (0xC4)，与本地固件相同时跳过更新 (命令行 --check)
+# 不支持该查询的App没有响应，每次都要多等 APP_INFO_TIMEOUT_S，所以默认关闭
+APP_INFO_QUERY = False
+FORCE_FLASH = False # True: 不检查已安装程序，总是更新 (命令行 --force)
 
 # 2. 辅助函数
 
@@ -60,46 +73,68 @@ def connect_can_bus(zcan, dev_handle):
     ret = zcan.ZCAN_SetValue(dev_handle, "0/canfd_abit_baud_rate", "1000000")
 
     if ret != ZCAN_STATUS_OK:
-        print(f"错误: 设置波特率(1Mbps)失败!")
+        log.error("错误: 设置波特率(1Mbps)失败!")
         return INVALID_CHANNEL_HANDLE
     
     chn_cfg.config.can.mode = 0
 
+    # 只接收 MCU 的应答 ID (0xA0~0xA1, 0xB0~0xB4)，硬件无法精确表达时由 ZCAN 在主机侧过滤
+    rx_filter = ChannelFilter(ids=[MCU_RESPONSE_ID_APP_ACK, MCU_RESPONSE_ID_APP_INFO],
+                              ranges=[(MCU_RESPONSE_ID_BL_READY, MCU_RESPONSE_ID_ERROR)])
+    rx_filter.apply_to_init_config(chn_cfg)
+
     chn_handle = zcan.InitCAN(dev_handle, CHANNEL_INDEX, chn_cfg)
 
     if chn_handle == INVALID_CHANNEL_HANDLE:
-        print(f"错误: 初始化CAN通道 {CHANNEL_INDEX} 失败!")
+        log.error("错误: 初始化CAN通道 %d 失败!", CHANNEL_INDEX)
         return INVALID_CHANNEL_HANDLE
+
+    zcan.set_channel_filter(dev_handle, CHANNEL_INDEX, chn_handle, rx_filter)
     
     ret = zcan.StartCAN(chn_handle)
 
     if ret != ZCAN_STATUS_OK:
-        print(f"错误: 启动CAN通道 {CHANNEL_INDEX} 失败!")
+        log.error("错误: 启动CAN通道 %d 失败!", CHANNEL_INDEX)
         return INVALID_CHANNEL_HANDLE
-    print(f"CAN通道 {CHANNEL_INDEX} 已启动 (1Mbps)")
+    log.info("CAN通道 %d 已启动 (1Mbps)", CHANNEL_INDEX)
     return chn_handle
 
+# 计算距离截止时间的剩余毫秒数，作为阻塞接收的 wait_time
+def wait_time_ms(deadline):
+    return max(0, int((deadline - time.time()) * 1000))
+
 # 发送CAN报文的函数
 def send_can_message(zcan, chn_handle, can_id, data, dlc):
-    msg = ZCAN_Transmit_Data()
-    msg.transmit_type = 0
-    msg.frame.eff = 0
-    msg.frame.rtr = 0
-    msg.frame.can_id = can_id
-    msg.frame.can_dlc = dlc
-    for i in range(dlc):
-        msg.frame.data[i] = data[i]
-    ret = zcan.Transmit(chn_handle, msg, 1)
+    ret = zcan.transmit_many(chn_handle, ((can_id, bytes(data[:dlc])),))
     if ret == 1:
         return True
     else:
-        print(f" > 发送 ID: 0x{can_id:X} 失败!")
+        log.error(" > 发送 ID: 0x%X 失败!", can_id)
         return False
 
 
 # --- 3. IAP主逻辑 ---
 
-def main_iap_flow():
+# 查询App上已安装程序的大小和CRC，App不支持查询(超时)时返回 None
+def query_app_info(zcan, chn_handle, rcv_msgs):
+    if not send_can_message(zcan, chn_handle, HOST_REQUEST_ID_APP_INFO, APP_INFO_DATA, 8):
+        return None
+    deadline = time.time() + APP_INFO_TIMEOUT_S
+    while time.time() < deadline:
+        act_num = zcan.receive_into(chn_handle, rcv_msgs, wait_time_ms(deadline))
+        for i in range(act_num):
+            msg = rcv_msgs[i].frame
+            if msg.can_id == MCU_RESPONSE_ID_APP_INFO and msg.can_dlc == 8:
+                return struct.unpack('<II', bytes(msg.data[:8]))
+    return None
+
+
+def main_iap_flow(events=None, force=FORCE_FLASH, check=APP_INFO_QUERY):
+    """
+    :param events: TransferEventBuffer，失败时输出其中最近的传输事件
+    :param force: True 时不检查App上已安装的程序，总是更新
+    :param check: True 时先查询App上已安装的程序，相同则跳过 (App需支持 0xC4 查询)
+    """
 
     # 加载ZCAN库
     zcan = ZCAN() 
@@ -108,10 +143,10 @@ def main_iap_flow():
     handle = zcan.OpenDevice(DEVICE_TYPE, DEVICE_INDEX, 0)
 
     if handle == INVALID_DEVICE_HANDLE:
-        print("错误: 打开设备失败!")
+        log.error("错误: 打开设备失败!")
         return
 
-    print(f"设备已打开, 句柄: {handle}")
+    log.info("设备已打开, 句柄: %d", handle)
 
     # 连接并启动CAN通道，配置CAN模式、波特率等
     chn_handle = connect_can_bus(zcan, handle)
@@ -120,22 +155,70 @@ def main_iap_flow():
         zcan.CloseDevice(handle)
         return
 
-    rcv_msgs = (ZCAN_Receive_Data * 10)() # 创建一个10帧的接收缓冲区
+    rcv_msgs = (ZCAN_Receive_Data * 10)() # 创建一个10帧的接收缓冲区 (复用，避免每次接收都重新分配)
     ack_num = 0
 
     # 以下是IAP协议的主要流程，按照顺序执行
     try:
+        # -----------------------------------------------------------------
+        # --- 准备：读取文件, 计算CRC ---
+        # -----------------------------------------------------------------
+        log.info("--- 准备: 读取固件文件 ---")
+        
+        try:
+            log.info(" > 正在读取文件: %s", FIRMWARE_FILE_PATH)
+
+            with open(FIRMWARE_FILE_PATH, 'rb') as f:
+                firmware_data = f.read() # firmware_data 是一个 bytes 对象
+            
+            # 1. 检查原始大小
+            original_size = len(firmware_data)
+
+            log.info(" > 原始文件大小: %d 字节", original_size)
+
+            if original_size == 0 or original_size > APP_MAX_SIZE_BYTES:
+                raise Exception(f"固件大小无效 ({original_size} 字节).")
+
+            # 2. 对齐到4字节 (用 0xFF 填充)
+            total_size = original_size # 先设为原始大小
+
+            if total_size % 4 != 0:
+                padding_needed = 4 - (total_size % 4)
+                firmware_data += b'\xFF' * padding_needed # 在末尾添加 0xFF
+                total_size = len(firmware_data) # 更新 total_size 为对齐后的大小
+                log.info(" > (已填充 %d 字节 0xFF 以对齐到4字节)", padding_needed)
+            
+            log.info(" > 最终发送大小: %d 字节", total_size)
+
+        except FileNotFoundError:
+            raise Exception(f"固件文件 '{FIRMWARE_FILE_PATH}' 未找到!")
+        
+        crc_value = binascii.crc32(firmware_data) & 0xFFFFFFFF
+        
+        log.info(" > 文件 CRC32 (基于 %d 字节): 0x%08X", total_size, crc_value)
+
+        # --- 预检：App上已是相同固件时不再擦除和下载 ---
+        if check and not force:
+            app_info = query_app_info(zcan, chn_handle, rcv_msgs)
+            if app_info is None:
+                log.info(" > App未回复已安装程序信息 (ID: 0x%X)，继续更新", MCU_RESPONSE_ID_APP_INFO)
+            else:
+                log.info(" > 已安装程序: %d 字节, CRC32 0x%08X", app_info[0], app_info[1])
+                if app_info == (total_size, crc_value):
+                    log.info("*** App已是相同固件，跳过更新 (使用 --force 强制更新) ***")
+                    return
+
         # --- 协议第1步：发送“重启”指令给App ---
-        print(f"\n--- 步骤 1: 请求App重启进入Bootloader (发送 ID: 0x{HOST_REQUEST_ID_APP_RESET:X}) ---")
+        log.info("--- 步骤 1: 请求App重启进入Bootloader (发送 ID: 0x%X) ---", HOST_REQUEST_ID_APP_RESET)
 
         if not send_can_message(zcan, chn_handle, HOST_REQUEST_ID_APP_RESET, APP_RESET_DATA, 8):
              raise Exception("发送重启指令失败")
         
-        print(f" > 已发送“重启”指令 (ID: 0x{HOST_REQUEST_ID_APP_RESET:X})")
+        log.info(" > 已发送“重启”指令 (ID: 0x%X)", HOST_REQUEST_ID_APP_RESET)
 
 
         # --- 协议第2步：等待Bootloader“就绪”响应 ---
-        print(f"\n--- 步骤 2: 等待Bootloader就绪 (监听 ID: 0x{MCU_RESPONSE_ID_BL_READY:X}) ---")
+        log.info("--- 步骤 2: 等待Bootloader就绪 (监听 ID: 0x%X) ---", MCU_RESPONSE_ID_BL_READY)
 
         timeout = 5.0 # 5秒总超时
 
@@ -146,75 +229,40 @@ def main_iap_flow():
 
         # 给Bootloader一些时间来重启，等待时间为5s
         while time.time() - start_time < timeout:
-            rcv_num = zcan.GetReceiveNum(chn_handle, ZCAN_TYPE_CAN)
-            
-            if rcv_num > 0:
-                rcv_msgs, act_num = zcan.Receive(chn_handle, rcv_num if rcv_num < 10 else 10)
+            # 阻塞接收: 驱动内等待直到有报文或本阶段超时
+            act_num = zcan.receive_into(chn_handle, rcv_msgs, wait_time_ms(start_time + timeout))
+            if act_num > 0:
                 
                 for i in range(act_num):
                     msg = rcv_msgs[i].frame
-                    print(f" < 收到报文 ID: 0x{msg.can_id:X}") 
+                    log.debug(" < 收到报文 ID: 0x%X", msg.can_id)
 
                     if msg.can_id == MCU_RESPONSE_ID_APP_ACK and not app_ack_received:
-                        print(" > 收到App确认(0xA0)，MCU正在重启...")
+                        log.info(" > 收到App确认(0xA0)，MCU正在重启...")
                         app_ack_received = True
 
                     if msg.can_id == MCU_RESPONSE_ID_BL_READY and msg.can_dlc == 8:
                         if all(msg.data[j] == BL_READY_DATA[j] for j in range(8)):
-                            print("\n*** 成功！Bootloader已就绪 (收到 0xB0 + 0x22...)！ ***")
+                            log.info("*** 成功！Bootloader已就绪 (收到 0xB0 + 0x22...)！ ***")
                             bootloader_ready = True
                             break 
                     
                     elif msg.can_id == 0xB0 and msg.data[0] == 0x00:
-                         print("\n*** 警告：Bootloader已正常启动 (收到 0xB0 + 0x00...) ***")
-                         print("   更新请求可能未收到。")
+                         log.warning("*** 警告：Bootloader已正常启动 (收到 0xB0 + 0x00...) ***")
+                         log.warning("   更新请求可能未收到。")
             
             if bootloader_ready:
                 break 
-            
-            time.sleep(0.01) 
 
         if not bootloader_ready:
-            print(f"\n*** 失败：等待Bootloader就绪响应(0x{MCU_RESPONSE_ID_BL_READY:X})超时 (5秒) ***")
+            log.error("*** 失败：等待Bootloader就绪响应(0x%X)超时 (5秒) ***", MCU_RESPONSE_ID_BL_READY)
             raise Exception("等待Bootloader就绪超时")
             
         
         # -----------------------------------------------------------------
-        # --- 协议第3步：读取文件, 计算CRC, 并发送元数据 ---
+        # --- 协议第3步：发送元数据 ---
         # -----------------------------------------------------------------
-        print(f"\n--- 步骤 3: 发送固件元数据 (ID: 0x{HOST_REQUEST_ID_METADATA:X}) ---")
-        
-        try:
-            print(f" > 正在读取文件: {FIRMWARE_FILE_PATH}")
-
-            with open(FIRMWARE_FILE_PATH, 'rb') as f:
-                firmware_data = f.read() # firmware_data 是一个 bytes 对象
-            
-            # 1. 检查原始大小
-            original_size = len(firmware_data)
-
-            print(f" > 原始文件大小: {original_size} 字节")
-
-            if original_size == 0 or original_size > APP_MAX_SIZE_BYTES:
-                raise Exception(f"固件大小无效 ({original_size} 字节).")
-
-            # 2. 对齐到4字节 (用 0xFF 填充)
-            total_size = original_size # 先设为原始大小
-
-            if total_size % 4 != 0:
-                padding_needed = 4 - (total_size % 4)
-                firmware_data += b'\xFF' * padding_needed # 在末尾添加 0xFF
-                total_size = len(firmware_data) # 更新 total_size 为对齐后的大小
-                print(f" > (已填充 {padding_needed} 字节 0xFF 以对齐到4字节)")
-            
-            print(f" > 最终发送大小: {total_size} 字节")
-
-        except FileNotFoundError:
-            raise Exception(f"固件文件 '{FIRMWARE_FILE_PATH}' 未找到!")
-        
-        crc_value = binascii.crc32(firmware_data) & 0xFFFFFFFF
-        
-        print(f" > 文件 CRC32 (基于 {total_size} 字节): 0x{crc_value:08X}")
+        log.info("--- 步骤 3: 发送固件元数据 (ID: 0x%X) ---", HOST_REQUEST_ID_METADATA)
 
         # 4. 打包 *填充后* 的大小和CRC
         payload_bytes = struct.pack('<II', total_size, crc_value)
@@ -222,47 +270,44 @@ def main_iap_flow():
         if not send_can_message(zcan, chn_handle, HOST_REQUEST_ID_METADATA, payload_bytes, 8):
              raise Exception("发送元数据报文失败!")
         
-        print(f" > 已发送元数据。")
+        log.info(" > 已发送元数据。")
 
         # -----------------------------------------------------------------
         # --- 协议第4步：等待Bootloader“擦除完毕”响应 ---
         # -----------------------------------------------------------------
-        print(f"\n--- 步骤 4: 等待Flash擦除完毕 (监听 ID: 0x{MCU_RESPONSE_ID_ERASE_OK:X}) ---")
+        log.info("--- 步骤 4: 等待Flash擦除完毕 (监听 ID: 0x%X) ---", MCU_RESPONSE_ID_ERASE_OK)
         
         erase_timeout = 15.0 # Flash擦除慢，给15秒长超时
         start_time = time.time()
         erase_complete = False
 
         while time.time() - start_time < erase_timeout:
-            rcv_num = zcan.GetReceiveNum(chn_handle, ZCAN_TYPE_CAN)
-            
-            if rcv_num > 0:
-                rcv_msgs, act_num = zcan.Receive(chn_handle, rcv_num if rcv_num < 10 else 10)
+            # 阻塞接收: 驱动内等待直到有报文或本阶段超时
+            act_num = zcan.receive_into(chn_handle, rcv_msgs, wait_time_ms(start_time + erase_timeout))
+            if act_num > 0:
                 
                 for i in range(act_num):
                     msg = rcv_msgs[i].frame
-                    print(f" < 收到报文 ID: 0x{msg.can_id:X}") 
+                    log.debug(" < 收到报文 ID: 0x%X", msg.can_id)
 
                     # 检查是否是“擦除完毕”报文
                     if msg.can_id == MCU_RESPONSE_ID_ERASE_OK and msg.can_dlc == 8:
                         if all(msg.data[j] == BL_ERASE_OK_DATA[j] for j in range(8)):
-                            print("\n*** 成功！Bootloader已擦除Flash (收到 0xB1 + 0x33...)！ ***")
+                            log.info("*** 成功！Bootloader已擦除Flash (收到 0xB1 + 0x33...)！ ***")
                             erase_complete = True
                             break 
             
             if erase_complete:
                 break 
-            
-            time.sleep(0.01)
 
         if not erase_complete:
-            print(f"\n*** 失败：等待擦除完毕响应(0x{MCU_RESPONSE_ID_ERASE_OK:X})超时 ({erase_timeout}秒) ***")
+            log.error("*** 失败：等待擦除完毕响应(0x%X)超时 (%.0f秒) ***", MCU_RESPONSE_ID_ERASE_OK, erase_timeout)
             raise Exception("擦除超时")
 
         # -----------------------------------------------------------------
         # --- 协议第5、6、7步数据传输循环 ---
         # -----------------------------------------------------------------
-        print(f"\n--- 步骤 5/6/7: 开始数据传输循环 ---")
+        log.info("--- 步骤 5/6/7: 开始数据传输循环 ---")
 
         bytes_sent = 0
         sequence_num = 0
@@ -288,10 +333,10 @@ def main_iap_flow():
             
             while retry_count <= MAX_RETRIES and not ack_received:
                 if retry_count > 0:
-                    print(f" > (重传 {retry_count}/{MAX_RETRIES}) 正在发送数据包 {sequence_num}...")
+                    log.warning(" > (重传 %d/%d) 正在发送数据包 %d...", retry_count, MAX_RETRIES, sequence_num)
                 else:
-                    # 打印进度
-                    print(f" > 正在发送数据包 {sequence_num} ({bytes_sent + len(chunk)} / {total_size} 字节)...")
+                    # 进度 (DEBUG，默认不格式化)
+                    log.debug(" > 正在发送数据包 %d (%d / %d 字节)...", sequence_num, bytes_sent + len(chunk), total_size)
 
                 if not send_can_message(zcan, chn_handle, HOST_REQUEST_ID_DATA, payload, 8):
                     raise Exception(f"发送数据包 {sequence_num} 失败!")
@@ -299,9 +344,9 @@ def main_iap_flow():
                 # e. 启动短超时, 等待ACK
                 wait_start_time = time.time()
                 while time.time() - wait_start_time < DATA_ACK_TIMEOUT_S:
-                    rcv_num = zcan.GetReceiveNum(chn_handle, ZCAN_TYPE_CAN)
-                    if rcv_num > 0:
-                        rcv_msgs, act_num = zcan.Receive(chn_handle, rcv_num if rcv_num < 10 else 10)
+                    # 阻塞接收: 驱动内等待直到有报文或本阶段超时
+                    act_num = zcan.receive_into(chn_handle, rcv_msgs, wait_time_ms(wait_start_time + DATA_ACK_TIMEOUT_S))
+                    if act_num > 0:
                         for i in range(act_num):
                             msg = rcv_msgs[i].frame
                             
@@ -312,7 +357,6 @@ def main_iap_flow():
 
                     if ack_received:
                         break
-                    time.sleep(0.005) # 5ms轮询
                 
                 if ack_received:
                     break # 成功，跳出重传循环
@@ -328,36 +372,36 @@ def main_iap_flow():
             bytes_sent += PACKET_PAYLOAD_SIZE
             sequence_num = (sequence_num + 1) % 256 # 序列号 (0-255) 自动回绕
         
-        print("\n*** 成功！所有数据包发送完毕。 ***")
+        log.info("*** 成功！所有数据包发送完毕。 ***")
     
         # -----------------------------------------------------------------
         # --- 【新增】协议第8步：发送传输结束 (EOT) ---
         # -----------------------------------------------------------------
-        print(f"\n--- 步骤 8: 发送传输结束 (EOT) (ID: 0x{HOST_REQUEST_ID_EOT:X}) ---")
+        log.info("--- 步骤 8: 发送传输结束 (EOT) (ID: 0x%X) ---", HOST_REQUEST_ID_EOT)
 
         eot_payload = (c_ubyte * 8)(EOT_PACKET_ED, 0, 0, 0, 0, 0, 0, 0)
 
         if not send_can_message(zcan, chn_handle, HOST_REQUEST_ID_EOT, eot_payload, 8):
              raise Exception("发送EOT报文失败!")
         
-        print(f" > 已发送EOT。")
+        log.info(" > 已发送EOT。")
         
         # -----------------------------------------------------------------
         # --- 【新增】协议第9步：等待最终校验结果 ---
         # -----------------------------------------------------------------
-        print(f"\n--- 步骤 9: 等待MCU最终校验... (监听 0x{MCU_RESPONSE_ID_VERIFY_OK:X} / 0x{MCU_RESPONSE_ID_ERROR:X}) ---")
+        log.info("--- 步骤 9: 等待MCU最终校验... (监听 0x%X / 0x%X) ---", MCU_RESPONSE_ID_VERIFY_OK, MCU_RESPONSE_ID_ERROR)
         
         verify_timeout = VERIFY_TIMEOUT_S
         start_time = time.time()
         final_result = None # None: 等待, True: 成功, False: 失败
 
         while time.time() - start_time < verify_timeout:
-            rcv_num = zcan.GetReceiveNum(chn_handle, ZCAN_TYPE_CAN)
-            if rcv_num > 0:
-                rcv_msgs, act_num = zcan.Receive(chn_handle, rcv_num if rcv_num < 10 else 10)
+            # 阻塞接收: 驱动内等待直到有报文或本阶段超时
+            act_num = zcan.receive_into(chn_handle, rcv_msgs, wait_time_ms(start_time + verify_timeout))
+            if act_num > 0:
                 for i in range(act_num):
                     msg = rcv_msgs[i].frame
-                    print(f" < 收到报文 ID: 0x{msg.can_id:X}, 报文内容: {[msg.data[j] for j in range(msg.can_dlc)]}")
+                    log.info(" < 收到报文 ID: 0x%X, 报文内容: %s", msg.can_id, hexdump(msg.data[:msg.can_dlc]))
                     
                     # 检查是否是“校验成功”报文
                     if msg.can_id == MCU_RESPONSE_ID_VERIFY_OK:
@@ -370,14 +414,13 @@ def main_iap_flow():
                         break
             if final_result is not None:
                 break
-            time.sleep(0.01)
 
         # 最终裁决
         if final_result == True:
-            print("\n==============================================")
-            print("  *** 固件更新成功! ***")
-            print("  MCU正在重启进入新App...")
-            print("==============================================")
+            log.info("==============================================")
+            log.info("  *** 固件更新成功! ***")
+            log.info("  MCU正在重启进入新App...")
+            log.info("==============================================")
         elif final_result == False:
             raise Exception("更新失败：MCU校验CRC不匹配，或报告了0xB4错误。")
         else: # final_result is None
@@ -385,15 +428,17 @@ def main_iap_flow():
 
 
     except Exception as e:
-        print(f"\n--- IAP流程因错误而终止: {e} ---")
+        log.error("--- IAP流程因错误而终止: %s ---", e)
+        if events is not None:
+            events.dump()
     finally:
         # --- 清理工作 ---
-        print("\n正在关闭CAN通道和设备...")
+        log.info("正在关闭CAN通道和设备...")
         if chn_handle != INVALID_CHANNEL_HANDLE:
             zcan.ResetCAN(chn_handle)
         if handle != INVALID_DEVICE_HANDLE:
             zcan.CloseDevice(handle)
-        print("清理完毕。")
+        log.info("清理完毕。")
 
 
 # ==============================================================================
@@ -401,6 +446,12 @@ def main_iap_flow():
 # ==============================================================================
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="IAP 固件更新工具")
+    parser.add_argument("--force", action="store_true", help="不检查App上已安装的程序，总是更新")
+    parser.add_argument("--check", action="store_true", help="先查询App上已安装的程序，相同则跳过更新 (App需支持)")
+    parser.add_argument("--trace", action="store_true", help="在内存中记录传输事件，失败时输出 (降低传输速度)")
+    args = parser.parse_args()
+
     print("===== IAP 固件更新工具 (命令行版 v0.3) =====")
     print("本脚本将执行IAP握手流程的第1-4步。")
     print("请确保：")
@@ -410,4 +461,5 @@ if __name__ == "__main__":
     print(" 4. App正在运行。")
     input(f"\n按回车键(Enter)开始发送“重启”指令 (ID: 0x{HOST_REQUEST_ID_APP_RESET:X})...")
     
-    main_iap_flow()
\ No newline at end of file
+    events = setup_logging(logging.INFO, EVENT_BUFFER_SIZE if args.trace else 0)
+    main_iap_flow(events, force=FORCE_FLASH or args.force, check=APP_INFO_QUERY or args.check)
\ No newline at end of file
@@ -1,6 +1,7 @@
 # -*- coding:utf-8 -*-
 
 from zlgcan import *
+from zcan_dispatch import get_dispatcher
 import tkinter as tk
 from tkinter import ttk
 from tkinter import messagebox
@@ -31,6 +32,7 @@ WIDGHT_HEIGHT   = 500 + 60
 
 MAX_DISPLAY     = 1000
 MAX_RCV_NUM     = 10
+RCV_WAIT_S      = 0.05 # 接收线程单次阻塞等待的最长时间
 
 # (USBCANFD_TYPE, USBCAN_XE_U_TYPE, USBCAN_I_II_TYPE 常量被保留，因为 ChnInfoUpdate 中可能使用)
 USBCANFD_TYPE    = (41, 42, 43)
@@ -88,6 +90,8 @@ class IAP_Tool_V1(tk.Tk):
         # 保留后台接收线程相关的变量
         self._read_thread = None
         self._terminated = False
+        self._dispatcher = None # 通道接收分发器
+        self._rx_sub = None     # 监视界面在分发器上的订阅
         self._lock = threading.RLock() # 线程锁，用于安全更新UI
 
         self._tx_cnt = 0
@@ -369,26 +373,15 @@ class IAP_Tool_V1(tk.Tk):
         """
         try:
             while not self._terminated:
-                # 1. 仅查询标准CAN报文
-                can_num = self._zcan.GetReceiveNum(self._can_handle, ZCAN_TYPE_CAN)
+                # 从分发器的监视订阅取报文，最多等待 RCV_WAIT_S 以便及时响应关闭通道
+                can_msgs = self._rx_sub.get_many(MAX_RCV_NUM, RCV_WAIT_S)
+                act_num = len(can_msgs)
                 
-                if not can_num:
-                    time.sleep(0.005) # 休眠5ms
-                    continue
-
-                # 2. 循环排空缓冲区
-                while can_num and not self._terminated:
-                    read_cnt = MAX_RCV_NUM if can_num >= MAX_RCV_NUM else can_num
-                    can_msgs, act_num = self._zcan.Receive(self._can_handle, read_cnt, MAX_RCV_NUM)
-                    
-                    if act_num: 
-                        # 3. 更新UI
-                        self._rx_cnt += act_num 
-                        self.strvRxCnt.set(str(self._rx_cnt))
-                        self.ViewDataUpdate(can_msgs, act_num, False, False)
-                    else:
-                        break # 读取失败或超时，退出内循环
-                    can_num -= act_num
+                if act_num: 
+                    # 更新UI
+                    self._rx_cnt += act_num 
+                    self.strvRxCnt.set(str(self._rx_cnt))
+                    self.ViewDataUpdate(can_msgs, act_num, False, False)
         except:
             if not self._terminated:
                 print("Error occurred while read CAN data!")
@@ -539,6 +532,8 @@ class IAP_Tool_V1(tk.Tk):
             # 1. 通知后台接收线程停止
             self._terminated = True
             self._read_thread.join(0.1) # 等待线程退出 (最多0.1秒)
+            self._rx_sub.close()
+            self._dispatcher.release()
             self._zcan.ResetCAN(self._can_handle)
             self.strvCANCtrl.set("打开")
             self._isChnOpen = False
@@ -585,6 +580,9 @@ class IAP_Tool_V1(tk.Tk):
             # (启动发送线程的逻辑已被移除)
 
             # 4. 启动后台接收线程
+            # 通道接收由分发器统一读取，监视界面订阅全部报文，可与刷写任务同时运行
+            self._dispatcher = get_dispatcher(self._zcan, self._can_handle)
+            self._rx_sub = self._dispatcher.subscribe()
             self._terminated = False
             self._read_thread = threading.Thread(None, target=self.MsgReadThreadFunc)
             self._read_thread.start()
@@ -617,41 +615,33 @@ class IAP_Tool_V1(tk.Tk):
             messagebox.showwarning(title="发送错误", message="请先打开CAN通道！")
             return
 
-        # 2. 创建标准CAN报文结构体
-        msg = ZCAN_Transmit_Data()
-        msg.transmit_type = 0 # 0: 正常发送
-        msg.frame.eff = 0 # 0: 标准帧
-        msg.frame.rtr = 0 # 0: 数据帧
-
-        # 3. 从GUI读取并填充参数 (带错误处理)
+        # 2. 从GUI读取并解析参数 (带错误处理)
         try:
-            msg.frame.can_id = int(self.entrySendID.get(), 16)
+            can_id = int(self.entrySendID.get(), 16)
         except:
             messagebox.showerror(title="输入错误", message="帧ID必须是一个有效的十六进制数！")
             return
             
-        msg.frame.can_dlc = self.cmbSendLen.current() # 获取 0-8
-        msg_len = msg.frame.can_dlc
+        msg_len = self.cmbSendLen.current() # 获取 0-8
         
         try:
-            data_str_list = self.entrySendData.get().split(' ')
-            for i in range(msg_len):
-                if i < len(data_str_list) and data_str_list[i] != '':
-                    msg.frame.data[i] = int(data_str_list[i], 16)
-                else:
-                    msg.frame.data[i] = 0
+            data_str_list = [s for s in self.entrySendData.get().split(' ') if s != '']
+            payload = bytes(int(s, 16) for s in data_str_list[:msg_len]).ljust(msg_len, b'\x00')
         except Exception as e:
             messagebox.showerror(title="数据错误", message=f"数据格式错误，请使用空格分隔的十六进制数。\n错误: {e}")
             return
 
+        # 3. 一次性构造发送数组 (0: 正常发送, 标准数据帧)
+        msgs = build_transmit_data(((can_id, payload),))
+
         # 4. 调用底层发送函数，只发送1帧
-        ret = self._zcan.Transmit(self._can_handle, msg, 1)
+        ret = self._zcan.Transmit(self._can_handle, msgs, 1)
 
         # 5. 提供反馈
         if ret == 1: # 假设1为ZCAN_STATUS_OK
             self._tx_cnt += 1
             self.strvTxCnt.set(str(self._tx_cnt))
-            self.ViewDataUpdate( [msg] , 1, is_canfd=False, is_send=True)
+            self.ViewDataUpdate(msgs, 1, is_canfd=False, is_send=True)
         else:
             messagebox.showerror(title="发送失败", message=f"发送CAN报文失败！错误码: {ret}")
 
@@ -0,0 +1,93 @@
+# bench_isotp_segment.py
+#
+# ISO-TP 多帧报文的分段开销 (每 KB 耗时): 旧实现 "list 拼接 CF + 逐帧逐字节填 ZCAN_Transmit_Data"
+# (照搬 IsoTpLayer.send/_send_raw_frame 原来的循环，去掉驱动调用和流控等待)
+# 与 IsoTpLayer.segment() "一次性写入预分配数组" 对比；另测 TransferData 请求的构造 + 分段:
+# 旧写法 [0x36, seq] + list(block) 与分散/聚集 (头, 镜像 memoryview 切片)。
+# 只测分段，不调用驱动，可在任意平台运行。
+import time
+from zlgcan import *
+from isotp import IsoTpLayer, ISOTP_FRAME_FF, ISOTP_FRAME_CF
+
+ROUNDS = 500
+PAYLOAD_SIZES = (256, 1024, 4092)
+TX_ID = 0x7E0
+
+
+def legacy_raw_frame(data_bytes):
+    """旧实现 IsoTpLayer._send_raw_frame 中构造发送结构体的部分 (不调用 Transmit)"""
+    # ISO-TP 规定不足 8 字节补 0x00
+    pad_len = 8 - len(data_bytes)
+    if pad_len > 0:
+        data_bytes += [0x00] * pad_len
+
+    # 构造 ZLG 发送结构体
+    msg = ZCAN_Transmit_Data()
+    msg.transmit_type = 0 # 正常发送
+    msg.frame.eff = 0     # 标准帧 (0)
+    msg.frame.rtr = 0     # 数据帧
+    msg.frame.can_id = TX_ID
+    msg.frame.can_dlc = 8
+
+    for i in range(8):
+        msg.frame.data[i] = data_bytes[i]
+    return msg
+
+
+def legacy_segment(data):
+    """旧实现 IsoTpLayer.send 的分段循环: 转 list，FF + 逐个 CF 拼接 list，每帧逐字节填一个 ZCAN_Transmit_Data"""
+    if isinstance(data, bytes):
+        data = list(data)
+    length = len(data)
+    frames = []
+    len_high = (length >> 8) & 0x0F
+    len_low  = length & 0xFF
+    frame_data = [ISOTP_FRAME_FF | len_high, len_low] + data[0:6]
+    frames.append(legacy_raw_frame(frame_data))
+
+    offset = 6 # 已经发了6个
+    sn = 1     # 序列号从1开始
+    while offset < length:
+        # 截取最多 7 个字节
+        chunk = data[offset : offset + 7]
+        # 构造 CF: [PCI(2)|SN] + Data
+        frame_data = [ISOTP_FRAME_CF | sn] + chunk
+        frames.append(legacy_raw_frame(frame_data))
+        offset += len(chunk)
+        sn = (sn + 1) & 0x0F # 0-15 循环
+    return frames
+
+
+def legacy_transfer(block):
+    return legacy_segment([0x36, 0x01] + list(block))
+
+
+def bench(label, func, data):
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        func(data)
+    elapsed = time.perf_counter() - start
+    per_kb = elapsed / ROUNDS / (len(data) / 1024.0)
+    print(f"{label:<22s} {len(data):5d} B  {per_kb * 1e6:9.1f} us/KB")
+    return per_kb
+
+
+def run_bench():
+    tp = IsoTpLayer(None, 0, TX_ID, 0x7E8)
+    tp_fd = IsoTpLayer(None, 0, TX_ID, 0x7E8, fd=True)
+    for size in PAYLOAD_SIZES:
+        data = bytes(i & 0xFF for i in range(size))
+        old = bench("legacy (list)", legacy_segment, data)
+        new = bench("segment()", tp.segment, data)
+        bench("segment() CAN-FD 64", tp_fd.segment, data)
+        print(f"{'':<22s} speedup x{old / new:.1f}\n")
+
+    image = memoryview(bytes(i & 0xFF for i in range(PAYLOAD_SIZES[-1] * 4)))
+    block = image[PAYLOAD_SIZES[-1] : PAYLOAD_SIZES[-1] * 2]
+    old = bench("0x36 legacy (list)", legacy_transfer, block)
+    new = bench("0x36 gather", lambda b: tp.segment((b'\x36\x01', b)), block)
+    print(f"{'':<22s} speedup x{old / new:.1f}")
+
+
+if __name__ == "__main__":
+    run_bench()
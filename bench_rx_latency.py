@@ -0,0 +1,75 @@
+# bench_rx_latency.py
+#
+# 请求/响应往返延迟对比: "GetReceiveNum + sleep(5ms)" 轮询 vs receive_wait() 阻塞接收
+# 使用虚拟后端 (zcan_virtual.VirtualZCAN)，ECU 在收到请求后固定延时 ECU_TURNAROUND_S 回复，
+# 不需要真实硬件，可在任意平台运行。
+import time
+from zlgcan import *
+from zcan_virtual import VirtualZCAN
+
+ROUNDS = 200
+ECU_TURNAROUND_S = 0.0003 # 仿真 ECU 的处理时间 300us
+POLL_SLEEP_S = 0.005      # 旧实现的轮询间隔
+REQ_ID = 0x7E0
+RSP_ID = 0x7E8
+
+
+def ecu_node(bus, frame):
+    """仿真 ECU: 收到 REQ_ID 后延时 ECU_TURNAROUND_S 原样回复到 RSP_ID"""
+    if frame.can_id == REQ_ID:
+        bus.send(RSP_ID, frame.data, delay = ECU_TURNAROUND_S)
+
+
+def rtt_polling(zcan, chn):
+    """旧写法: 查询缓冲区，为空则 sleep"""
+    zcan.transmit_many(chn, ((REQ_ID, b'\x3E\x00'),))
+    while True:
+        num = zcan.GetReceiveNum(chn, ZCAN_TYPE_CAN)
+        if num > 0:
+            msgs, cnt = zcan.Receive(chn, num)
+            if cnt:
+                return
+        time.sleep(POLL_SLEEP_S)
+
+
+def rtt_blocking(zcan, chn):
+    """新写法: 驱动内阻塞等待"""
+    zcan.transmit_many(chn, ((REQ_ID, b'\x3E\x00'),))
+    while True:
+        msgs, cnt = zcan.receive_wait(chn, 1.0)
+        if cnt:
+            return
+
+
+def bench(label, func, zcan, chn):
+    samples = []
+    cpu_start = time.process_time()
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        func(zcan, chn)
+        samples.append(time.perf_counter() - start)
+    cpu = time.process_time() - cpu_start
+    samples.sort()
+    avg = sum(samples) / len(samples)
+    print(f"{label:<10s} avg {avg * 1e3:7.3f} ms  p50 {samples[len(samples) // 2] * 1e3:7.3f} ms  "
+          f"p99 {samples[int(len(samples) * 0.99)] * 1e3:7.3f} ms  cpu {cpu * 1e3:7.1f} ms")
+    return avg
+
+
+def run_bench():
+    backend = VirtualZCAN()
+    backend.bus.attach(ecu_node)
+    zcan = ZCAN(backend)
+    handle = zcan.OpenDevice(ZCAN_USBCAN1, 0, 0)
+    chn = zcan.InitCAN(handle, 0, ZCAN_CHANNEL_INIT_CONFIG())
+    zcan.StartCAN(chn)
+
+    print(f"{ROUNDS} 次请求/响应往返, ECU 处理时间 {ECU_TURNAROUND_S * 1e6:.0f} us")
+    old = bench("polling", rtt_polling, zcan, chn)
+    new = bench("blocking", rtt_blocking, zcan, chn)
+    print(f"往返延迟降低 x{old / new:.1f}")
+    zcan.CloseDevice(handle)
+
+
+if __name__ == "__main__":
+    run_bench()
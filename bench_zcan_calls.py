@@ -0,0 +1,91 @@
+# bench_zcan_calls.py
+#
+# 对比 ZCAN 热路径调用在 "每次调用都查找导出函数/重设 restype/包装句柄" (旧实现)
+# 与 "构造时一次性绑定原型" (当前实现) 两种方式下的每秒调用次数。
+# 使用无效句柄调用，驱动会立即返回，测到的基本就是 Python 侧的调用开销，不需要接设备。
+# --backend virtual 使用虚拟后端 (zcan_virtual.VirtualZCAN)，不需要 zlgcan.dll，可在任意平台运行
+# (只比较 ZCAN 包装层的开销，不含 ctypes 外部调用)。
+#
+#      python bench_zcan_calls.py [--backend dll|virtual]
+#
+import argparse
+import ctypes
+import time
+from zlgcan import *
+
+CALLS = 200000
+INVALID_HANDLE = 0
+
+
+def bench(label, func, calls=CALLS):
+    start = time.perf_counter()
+    for _ in range(calls):
+        func()
+    elapsed = time.perf_counter() - start
+    rate = calls / elapsed
+    print(f"{label:<28s} {rate:>12,.0f} calls/s  ({elapsed * 1e9 / calls:7.1f} ns/call)")
+    return rate
+
+
+def legacy_calls(dll):
+    """按旧实现的写法逐次查找 DLL 属性并包装句柄"""
+    tx_msg = ZCAN_Transmit_Data()
+
+    def get_receive_num():
+        handle = ctypes.c_ulonglong(INVALID_HANDLE)
+        return dll.ZCAN_GetReceiveNum(handle, ZCAN_TYPE_CAN)
+
+    def transmit():
+        handle = ctypes.c_ulonglong(INVALID_HANDLE)
+        return dll.ZCAN_Transmit(handle, byref(tx_msg), 1)
+
+    def receive():
+        handle = ctypes.c_ulonglong(INVALID_HANDLE)
+        rcv_msgs = (ZCAN_Receive_Data * 10)()
+        return dll.ZCAN_Receive(handle, byref(rcv_msgs), 10, 0)
+
+    def start_can():
+        func = dll.ZCAN_StartCAN
+        if hasattr(func, "restype"): # 虚拟后端的导出函数是普通方法
+            func.restype = ctypes.c_longlong
+        handle = ctypes.c_ulonglong(INVALID_HANDLE)
+        return func(handle)
+
+    return get_receive_num, transmit, receive, start_can
+
+
+def bound_calls(zcan):
+    tx_msg = ZCAN_Transmit_Data()
+    return (lambda: zcan.GetReceiveNum(INVALID_HANDLE, ZCAN_TYPE_CAN),
+            lambda: zcan.Transmit(INVALID_HANDLE, tx_msg, 1),
+            lambda: zcan.Receive(INVALID_HANDLE, 10, 0),
+            lambda: zcan.StartCAN(INVALID_HANDLE))
+
+
+def run_bench(backend="dll"):
+    if backend == "virtual":
+        from zcan_virtual import VirtualZCAN
+        legacy_dll = VirtualZCAN()
+        zcan = ZCAN(VirtualZCAN())
+    else:
+        # 旧实现使用独立加载的 DLL 对象，避免被当前实现设置的 argtypes 影响
+        legacy_dll = ctypes.WinDLL("./zlgcan.dll")
+        zcan = ZCAN()
+    print(f"backend: {backend}, {CALLS} calls")
+
+    names = ("GetReceiveNum", "Transmit", "Receive(10)", "StartCAN")
+    for name, old, new in zip(names, legacy_calls(legacy_dll), bound_calls(zcan)):
+        old_rate = bench(f"{name} (per-call lookup)", old)
+        new_rate = bench(f"{name} (bound once)", new)
+        print(f"{'':<28s} speedup x{new_rate / old_rate:.2f}\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ZCAN 热路径调用开销")
+    parser.add_argument("--backend", choices=("dll", "virtual"), default="dll",
+                        help="dll: Windows 下的 zlgcan.dll; virtual: 虚拟后端")
+    args = parser.parse_args()
+    if args.backend == "dll" and platform.system() != "Windows":
+        print("No support now! (需要 Windows 下的 zlgcan.dll，或使用 --backend virtual)")
+    else:
+        run_bench(args.backend)
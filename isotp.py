@@ -1,117 +1,517 @@
 # isotp.py
+import logging
 import time
+from collections import deque, namedtuple
 from zlgcan import * 
 
+log = logging.getLogger(__name__)
+
 # ISO-TP 帧类型定义，主要处理4种帧类型
 ISOTP_FRAME_SF = 0x00 # 单帧
 ISOTP_FRAME_FF = 0x10 # 首帧
 ISOTP_FRAME_CF = 0x20 # 连续帧
 ISOTP_FRAME_FC = 0x30 # 流控帧
 
+# 流控状态 (FlowStatus)
+ISOTP_FS_CTS    = 0 # 继续发送
+ISOTP_FS_WAIT   = 1 # 等待
+ISOTP_FS_OVFLW  = 2 # 溢出
+
 # 网络层定时参数
 ISOTP_TIMEOUT_N_BS = 2.0
 ISOTP_TIMEOUT_N_CR = 2.0
 
+# CF 的 PCI 字节序列 (SN 从 1 开始 0~15 循环)，分段时整列写入
+_CF_SN_CYCLE = bytes(ISOTP_FRAME_CF | (sn & 0x0F) for sn in range(1, 17))
+
+# FF_DL: 12 位最大 4095，更长的报文使用转义 (12 位为 0，后跟 32 位长度)
+ISOTP_FF_DL_12BIT_MAX = 0xFFF
+ISOTP_FF_DL_MAX = 0xFFFFFFFF
+
+# 接收重组缓冲区: 预分配 4095 字节，更长的报文按需扩大 (只增不减)，超过 rx_max_len 回复溢出
+ISOTP_RX_BUF_SIZE = 4095
+ISOTP_RX_MAX_LEN = 1024 * 1024
+
+# STmin 不超过该值 (秒) 时整块 CF 一次 Transmit 交给设备，由总线本身的帧间隔满足 STmin:
+# 1Mbps 下一帧 8 字节标准帧约 110us，CAN-FD 64 字节帧 (5Mbps 数据域) 约 150us
+ISOTP_BATCH_ST_MIN = 0.0001
+
+# STmin 节拍: 先 sleep 到截止时间前 ISOTP_SPIN_NS，再自旋等待 (sleep 粒度在 Windows 上常为 1~15ms)
+ISOTP_SPIN_NS = 2000000
+ISOTP_GAP_HISTORY = 4096 # 保留的帧间隔记录数
+
+# 保留 STmin 值按标准使用最大 STmin (0x7F = 127ms)
+ISOTP_ST_MIN_RESERVED_NS = 127000000
+
+# 链路层数据长度 (TX_DL)
+ISOTP_CAN_DL   = 8  # 经典 CAN
+ISOTP_CANFD_DL = 64 # CAN-FD (ISO 15765-2:2016)
+
+# 最近一次多帧发送的统计
+# gap_*_us 为逐帧发送时实测的 CF 间隔 (微秒)，整块批量发送时为 None
+IsoTpTxStats = namedtuple("IsoTpTxStats", "length frames calls elapsed_s frames_per_s "
+                                          "gap_min_us gap_avg_us gap_max_us")
+
+
+def st_min_to_ns(st_min):
+    """STmin 参数 -> 纳秒: 0x00~0x7F 毫秒，0xF1~0xF9 为 100~900 微秒，其余为保留值"""
+    if st_min <= 0x7F:
+        return st_min * 1000000
+    elif 0xF1 <= st_min <= 0xF9:
+        return (st_min - 0xF0) * 100000
+    return ISOTP_ST_MIN_RESERVED_NS
+
+
+def as_buffers(data):
+    """
+    发送数据 -> (memoryview 列表, 总长度)
+    data 可以是 bytes 类对象 (bytes/bytearray/memoryview/array ...)、int 列表，
+    或由 bytes 类对象组成的 tuple (分散/聚集，例如 (b'\x36\x01', image[offset : offset + n]))，
+    各段只被引用，直到分段时才写入帧内存
+    """
+    if isinstance(data, tuple) and data and not isinstance(data[0], int):
+        parts = [_byte_view(part) for part in data]
+    elif isinstance(data, (list, tuple)):
+        parts = [memoryview(bytes(data))]
+    else:
+        parts = [_byte_view(data)]
+    return parts, sum(len(part) for part in parts)
+
+
+def _byte_view(obj):
+    view = memoryview(obj)
+    if view.format != 'B' or view.ndim != 1:
+        view = view.cast('B')
+    return view
+
+
+class StMinPacer(object):
+    """
+    连续帧发送节拍
+    每帧发出后以 perf_counter_ns 记下绝对截止时间 (发出时刻 + STmin)，
+    下一帧发送前先 sleep 到截止前 spin_ns，再自旋到截止时间；同时记录实测帧间隔
+    """
+    def __init__(self, spin_ns=ISOTP_SPIN_NS, max_gaps=ISOTP_GAP_HISTORY):
+        self.spin_ns = spin_ns
+        self.st_min_ns = 0
+        self.gaps_ns = deque(maxlen=max_gaps)
+        self._last_ns = None
+        self._deadline_ns = 0
+
+    def reset(self):
+        """开始一次新的传输: 清空间隔记录"""
+        self.gaps_ns.clear()
+        self._last_ns = None
+
+    def start_block(self, st_min_ns):
+        """收到流控后开始新的一块: 第一帧立即发送，块之间 (等流控) 的间隔不计入记录"""
+        self.st_min_ns = st_min_ns
+        self._last_ns = None
+        self._deadline_ns = 0
+
+    def wait(self):
+        deadline = self._deadline_ns
+        remaining = deadline - time.perf_counter_ns()
+        if remaining > self.spin_ns:
+            time.sleep((remaining - self.spin_ns) / 1e9)
+        while time.perf_counter_ns() < deadline:
+            pass
+
+    def sent(self):
+        """一帧已发出"""
+        now = time.perf_counter_ns()
+        if self._last_ns is not None:
+            self.gaps_ns.append(now - self._last_ns)
+        self._last_ns = now
+        self._deadline_ns = now + self.st_min_ns
+
+    def gap_stats_us(self):
+        """(最小, 平均, 最大) 帧间隔，单位微秒；没有记录时为 (None, None, None)"""
+        gaps = self.gaps_ns
+        if not gaps:
+            return None, None, None
+        return min(gaps) / 1e3, sum(gaps) / len(gaps) / 1e3, max(gaps) / 1e3
+
+class IsoTpReassembler(object):
+    """
+    ISO-TP 接收状态机 (不做收发，同步/异步/多会话共用)
+    调用方逐帧 feed()，负责发送返回的流控帧并处理超时 (空闲时等第一帧，接收中按 N_Cr)
+    """
+    def __init__(self, rx_bs=0, rx_st_min=0, rx_max_len=ISOTP_RX_MAX_LEN):
+        """
+        :param rx_bs: 回复给对端的 BlockSize (0 = 不再发中间流控)
+        :param rx_st_min: 回复给对端的 STmin (0 = 对端全速发送)
+        :param rx_max_len: 接收报文的最大长度，超过时回复流控溢出 (FS=2)
+        """
+        self.rx_bs = rx_bs
+        self.rx_st_min = rx_st_min
+        self.rx_max_len = rx_max_len
+        self._buf = bytearray(ISOTP_RX_BUF_SIZE)
+        self.reset()
+
+    def reset(self):
+        self.length = 0 # 正在接收的报文长度，0 表示空闲
+        self.received = 0
+        self._sn = 1
+        self._block_count = 0
+
+    @property
+    def in_progress(self):
+        return self.length > 0
+
+    def _flow_control(self, fs):
+        """流控帧: [PCI(3)|FS, BS, STmin]"""
+        return bytes((ISOTP_FRAME_FC | fs, self.rx_bs, self.rx_st_min))
+
+    def feed(self, data):
+        """
+        处理一帧 rx_id 报文的有效数据
+        :return: (payload, fc, error)
+                 payload: 收完一条报文时为 bytes；fc: 需要立即回复的流控帧；
+                 error: 出错描述 (此时状态已复位)，其余为 None
+        """
+        pci = data[0] & 0xF0
+
+        # 多帧接收过程中收到新的 SF/FF 时，按标准放弃当前报文，改为接收新报文
+        if pci == ISOTP_FRAME_SF or pci == ISOTP_FRAME_FF:
+            if self.in_progress:
+                log.warning("多帧接收被新报文打断 (已接收 %d/%d 字节)", self.received, self.length)
+                self.reset()
+            if pci == ISOTP_FRAME_SF:
+                return self._single_frame(data)
+            return self._first_frame(data)
+
+        if pci == ISOTP_FRAME_CF and self.in_progress:
+            return self._consecutive_frame(data)
+
+        # 空闲时收到的 CF/FC 直接忽略
+        return None, None, None
+
+    def _single_frame(self, data):
+        length = data[0] & 0x0F
+        offset = 1
+        if length == 0 and len(data) > 8:
+            # CAN-FD 长单帧: SF_DL 在第 2 字节
+            length = data[1]
+            offset = 2
+        if length == 0 or offset + length > len(data):
+            return None, None, f"非法单帧 SF_DL={length}"
+        return bytes(data[offset : offset + length]), None, None
+
+    def _first_frame(self, ff):
+        length = ((ff[0] & 0x0F) << 8) | ff[1]
+        pci_len = 2
+        if length == 0:
+            # FF_DL 转义: 32 位长度，只允许用于 > 4095 的报文
+            if len(ff) < 8:
+                return None, None, "非法首帧 (FF_DL 转义帧过短)"
+            length = int.from_bytes(ff[2:6], "big")
+            pci_len = 6
+            if length <= ISOTP_FF_DL_12BIT_MAX:
+                return None, None, f"非法首帧 FF_DL={length} (转义只用于 > 4095 字节)"
+        if length <= len(ff) - pci_len:
+            return None, None, f"非法首帧 FF_DL={length}"
+        if length > self.rx_max_len:
+            return (None, self._flow_control(ISOTP_FS_OVFLW),
+                    f"报文长度 {length} 超过接收上限 {self.rx_max_len}，回复溢出")
+        if length > len(self._buf):
+            self._buf = bytearray(length)
+
+        self.length = length
+        self.received = len(ff) - pci_len
+        self._buf[0:self.received] = ff[pci_len:]
+        self._sn = 1
+        self._block_count = 0
+        return None, self._flow_control(ISOTP_FS_CTS), None
+
+    def _consecutive_frame(self, data):
+        if (data[0] & 0x0F) != self._sn:
+            error = f"序列号错误 (期望 {self._sn}, 收到 {data[0] & 0x0F})"
+            self.reset()
+            return None, None, error
+
+        length = self.length
+        received = self.received
+        chunk = min(len(data) - 1, length - received)
+        self._buf[received : received + chunk] = data[1 : 1 + chunk]
+        received = self.received = received + chunk
+        self._sn = (self._sn + 1) & 0x0F
+
+        if received >= length:
+            payload = bytes(self._buf[:length])
+            self.reset()
+            return payload, None, None
+
+        self._block_count += 1
+        if self.rx_bs > 0 and self._block_count >= self.rx_bs:
+            self._block_count = 0
+            return None, self._flow_control(ISOTP_FS_CTS), None
+        return None, None, None
+
+
 # ISO-TP 协议实现类
 class IsoTpLayer:
-    def __init__(self, zcan_lib, chn_handle, tx_id, rx_id):
+    def __init__(self, zcan_lib, chn_handle, tx_id, rx_id, fd=False, tx_dl=None, brs=True,
+                 rx_bs=0, rx_st_min=0, dispatcher=None, batch_st_min=ISOTP_BATCH_ST_MIN,
+                 spin_ns=ISOTP_SPIN_NS, device_queue=None, rx_max_len=ISOTP_RX_MAX_LEN):
         """
         初始化 ISO-TP 层
         :param zcan_lib: zcan 对象实例 (ZCAN())
         :param chn_handle: CAN 通道句柄
         :param tx_id: 发送 ID (上位机 -> MCU, 如 0x7E0)
         :param rx_id: 接收 ID (MCU -> 上位机, 如 0x7E8)
+        :param fd: True 使用 CAN-FD 帧 (TransmitFD/ReceiveFD)
+        :param tx_dl: 发送帧数据长度，CAN 固定为 8，CAN-FD 默认 64 (可选 12/16/20/24/32/48)
+        :param brs: CAN-FD 数据域是否切换到高波特率
+        :param rx_bs: 接收多帧时回复给对端的 BlockSize (0 = 不再发中间流控)
+        :param rx_st_min: 接收多帧时回复给对端的 STmin (0 = 对端全速发送)
+        :param dispatcher: 通道接收分发器 (zcan_dispatch.RxDispatcher)，
+                           给定时通过订阅 rx_id 接收，不再直接读取通道缓冲区
+        :param batch_st_min: 对端 STmin 不超过该值 (秒) 时按块批量发送 CF，None 表示始终逐帧发送
+        :param spin_ns: 逐帧发送时 STmin 截止前自旋等待的时长 (纳秒)，越大越准、CPU 占用越高
+        :param device_queue: (device_handle, chn_index)，通道已开启队列发送模式 (ZCAN.set_tx_queue_mode) 时给出，
+                             STmin 为整毫秒时整块 CF 带帧间隔交给设备定时发送；为 None 时由主机逐帧计时
+        :param rx_max_len: 接收报文的最大长度，超过时回复流控溢出 (FS=2)
         """
         self.zcan = zcan_lib
         self.chn = chn_handle
         self.tx_id = tx_id
         self.rx_id = rx_id
         self.timeout_n_bs = ISOTP_TIMEOUT_N_BS
+        self.timeout_n_cr = ISOTP_TIMEOUT_N_CR
+        self.batch_st_min = batch_st_min
+        self.pacer = StMinPacer(spin_ns)
+        self.device_queue = device_queue
+        self.last_tx_stats = None
+        self._tx_drain_at = 0.0 # 设备队列中已提交的帧预计全部发出的时刻 (time.time())
 
-    def _send_raw_frame(self, data_bytes):
-        """发送一帧原始 CAN 报文 (8字节)"""
-        # ISO-TP 规定不足 8 字节补 0x00
-        pad_len = 8 - len(data_bytes)
-        if pad_len > 0:
-            data_bytes += [0x00] * pad_len
-
-        # 构造 ZLG 发送结构体 
-        msg = ZCAN_Transmit_Data()
-        msg.transmit_type = 0 # 正常发送
-        msg.frame.eff = 0     # 标准帧 (0)
-        msg.frame.rtr = 0     # 数据帧
-        msg.frame.can_id = self.tx_id
-        msg.frame.can_dlc = 8
-        
-        for i in range(8):
-            msg.frame.data[i] = data_bytes[i]
+        # 接收: 重组状态机 (含预分配的重组缓冲区)，以及一次批量读取中尚未处理的 rx_id 报文
+        self.rx = IsoTpReassembler(rx_bs, rx_st_min, rx_max_len)
+        self._rx_backlog = deque()
+        self._rx_sub = dispatcher.subscribe(ids=[rx_id]) if dispatcher is not None else None
+
+        self.fd = fd
+        self.tx_dl = (tx_dl or ISOTP_CANFD_DL) if fd else ISOTP_CAN_DL
+        if self.tx_dl < 8 or self.tx_dl not in CANFD_LENGTHS:
+            raise ValueError(f"invalid TX_DL: {self.tx_dl}")
+        self.brs = 1 if brs else 0
+        self.rx_type = ZCAN_TYPE_CANFD if fd else ZCAN_TYPE_CAN
+
+        # 每种帧可携带的数据字节数
+        # SF: TX_DL=8 时 PCI 1 字节 (最多 7)，否则使用 SF_DL 转义 (PCI 2 字节)
+        # FF: 12 位 FF_DL 时 PCI 2 字节，长度 > 4095 时 PCI 6 字节
+        self.sf_max = 7 if self.tx_dl == 8 else self.tx_dl - 2
+        self.ff_payload = self.tx_dl - 2
+        self.cf_payload = self.tx_dl - 1
+
+        # 发送: 分段结果写入只增不减的预分配数组，帧头 (ID/DLC/BRS) 对所有帧相同，预先生成模板
+        if fd:
+            self._tx_type = ZCAN_TransmitFD_Data
+            self._tx_data_offset = ZCAN_CANFD_FRAME.data.offset
+            self._transmit = self.zcan.TransmitFD if self.zcan else None
+        else:
+            self._tx_type = ZCAN_Transmit_Data
+            self._tx_data_offset = ZCAN_CAN_FRAME.data.offset
+            self._transmit = self.zcan.Transmit if self.zcan else None
+        template = self._tx_type()
+        template.frame.can_id = tx_id
+        if fd:
+            template.frame.len = self.tx_dl
+            template.frame.brs = self.brs
+        else:
+            template.frame.can_dlc = 8
+        self._tx_header = bytes(template)[:self._tx_data_offset]
+        self._tx_msgs = None
+
+    def close(self):
+        """取消在分发器上的订阅"""
+        if self._rx_sub is not None:
+            self._rx_sub.close()
+            self._rx_sub = None
 
-        ret = self.zcan.Transmit(self.chn, msg, 1)
+    def clear(self):
+        """丢弃已收到但还没有被 recv 取走的报文 (例如上一个请求超时后才到的响应)"""
+        self._rx_backlog.clear()
+        if self._rx_sub is not None:
+            self._rx_sub.clear()
+
+    @staticmethod
+    def _frame_data(msg):
+        """ZCAN_Receive_Data / ZCAN_ReceiveFD_Data -> 有效数据 (bytes)"""
+        frame = msg.frame
+        dlc = frame.len if isinstance(msg, ZCAN_ReceiveFD_Data) else frame.can_dlc
+        return bytes(frame.data[:dlc])
+
+    def _send_raw_frame(self, data_bytes):
+        """
+        发送一帧原始报文
+        CAN: 不足 8 字节补 0x00；CAN-FD: 补 0x00 到不小于 8 的合法 DLC 长度
+        """
+        frame = bytes(data_bytes)
+        if self.fd:
+            frame = frame.ljust(max(8, canfd_len(len(frame))), b'\x00')
+            ret = self.zcan.transmit_many_fd(self.chn, ((self.tx_id, frame),), brs=self.brs)
+        else:
+            frame = frame.ljust(8, b'\x00')
+            ret = self.zcan.transmit_many(self.chn, ((self.tx_id, frame),))
         return ret == 1
 
+    def _next_frame(self, deadline):
+        """
+        取下一帧 rx_id 报文的有效数据 (bytes)，超过 deadline (time.time()) 返回 None
+        一次批量读到的多帧先放入 backlog，不会因为只处理第一帧而丢失后续帧
+        """
+        if self._rx_sub is not None:
+            msg = self._rx_sub.get(max(0.0, deadline - time.time()))
+            return None if msg is None else self._frame_data(msg)
+
+        while not self._rx_backlog:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+            # 在驱动内阻塞等待，有报文立即返回
+            msgs, cnt = self.zcan.receive_wait(self.chn, remaining, can_type=self.rx_type)
+            for i in range(cnt):
+                if msgs[i].frame.can_id == self.rx_id:
+                    self._rx_backlog.append(self._frame_data(msgs[i]))
+        return self._rx_backlog.popleft()
+
+    def tx_pending_s(self):
+        """
+        设备发送队列中本层已提交、还没发到总线上的帧预计需要的时间 (秒)
+        send() 在帧交给设备队列后就返回，之后的超时计时 (N_Bs、UDS P2) 应从队列发完开始
+        """
+        return max(0.0, self._tx_drain_at - time.time())
+
     def _wait_flow_control(self):
-        """等待 MCU 回复流控帧 (FC)"""
-        start_time = time.time()
-
-        while time.time() - start_time < self.timeout_n_bs:
-            # 查询缓冲区 
-            num = self.zcan.GetReceiveNum(self.chn, ZCAN_TYPE_CAN)
-            if num > 0:
-                # 读取报文 
-                msgs, cnt = self.zcan.Receive(self.chn, num)
-                for i in range(cnt):
-                    msg = msgs[i].frame
-                    # 判断 ID 是否匹配且是 FC 帧 (0x30)
-                    if msg.can_id == self.rx_id and (msg.data[0] & 0xF0) == ISOTP_FRAME_FC:
-                        # 解析 FC 参数
-                        fs = msg.data[0] & 0x0F # FlowStatus (0=CTS, 1=WT, 2=OVFLW)
-                        bs = msg.data[1]        # BlockSize
-                        st_min = msg.data[2]    # SeparationTime
-                        return True, fs, bs, st_min
-            
-            time.sleep(0.002) # 避免 CPU 满载
+        """等待 MCU 回复流控帧 (FC)，N_Bs 从设备队列中的帧发完开始计时"""
+        deadline = time.time() + self.tx_pending_s() + self.timeout_n_bs
+
+        while True:
+            data = self._next_frame(deadline)
+            if data is None:
+                break
+            # 判断是否是 FC 帧 (0x30)
+            if len(data) >= 3 and (data[0] & 0xF0) == ISOTP_FRAME_FC:
+                # 解析 FC 参数
+                fs = data[0] & 0x0F # FlowStatus (0=CTS, 1=WT, 2=OVFLW)
+                bs = data[1]        # BlockSize
+                st_min = data[2]    # SeparationTime
+                return True, fs, bs, st_min
 
-        print(f"[ISO-TP Error] N_Bs Timeout! (MCU 未在 {self.timeout_n_bs}s 内回复 FC)")    
+        log.error("N_Bs 超时: MCU 未在 %.3fs 内回复 FC", self.timeout_n_bs)
         return False, 0, 0, 0
 
+    def single_frame(self, data):
+        """构造单帧: [PCI(0)|Len] + Data；CAN-FD 长单帧 (> 7 字节) 为 [PCI(0)|0, SF_DL] + Data"""
+        parts, length = as_buffers(data)
+        data = b''.join(parts)
+        if length <= 7:
+            return bytes((ISOTP_FRAME_SF | length,)) + data
+        if length <= self.sf_max:
+            return bytes((ISOTP_FRAME_SF, length)) + data
+        raise ValueError(f"ISO-TP payload too long for a single frame: {length}")
+
+    def segment(self, data):
+        """
+        把多帧报文 (长度 > sf_max) 一次性切分成 FF + 全部 CF
+        结果写入预分配的 ZCAN_Transmit_Data (CAN-FD 为 ZCAN_TransmitFD_Data) 数组，
+        按列 (帧内同一偏移) 做跨步切片赋值，操作次数只和帧长 (及分段数) 有关，与帧数无关；
+        数据从源缓冲区直接复制到帧内存，中间不产生拼接副本
+        :param data: 见 as_buffers()，例如 (b'\x36\x01', image[offset : offset + n])
+        :return: (msgs, count)，msgs[0] 为 FF，msgs[1:count] 为 CF；数组在下次分段时复用
+        """
+        parts, length = as_buffers(data)
+        if length <= self.sf_max:
+            raise ValueError(f"ISO-TP payload fits in a single frame: {length}")
+        if length > ISOTP_FF_DL_MAX:
+            raise ValueError(f"ISO-TP payload too long: {length}")
+        if length > ISOTP_FF_DL_12BIT_MAX:
+            # [PCI(1)|0, 0] + 32 位 FF_DL
+            ff_pci = bytes((ISOTP_FRAME_FF, 0)) + length.to_bytes(4, "big")
+        else:
+            # [PCI(1)|Len_High, Len_Low]
+            ff_pci = bytes((ISOTP_FRAME_FF | (length >> 8), length & 0xFF))
+        ff_payload = self.tx_dl - len(ff_pci)
+        cf_payload = self.cf_payload
+        cf_count = -(-(length - ff_payload) // cf_payload)
+        count = 1 + cf_count
+
+        msgs = self._tx_msgs
+        if msgs is None or len(msgs) < count:
+            msgs = self._tx_msgs = (self._tx_type * count)()
+
+        size = sizeof(self._tx_type)
+        hdr_len = self._tx_data_offset
+        end = count * size
+        mem = memoryview((c_ubyte * end).from_buffer(msgs)).cast('B')
+
+        # 帧头 (ID/DLC/BRS) 所有帧相同
+        for j, value in enumerate(self._tx_header):
+            mem[j:end:size] = bytes((value,)) * count
+
+        # 首帧: FF_DL；连续帧: [PCI(2)|SN]
+        data_start = hdr_len + len(ff_pci)
+        mem[hdr_len : data_start] = ff_pci
+        start = size + hdr_len
+        mem[start:end:size] = (_CF_SN_CYCLE * (cf_count // 16 + 1))[:cf_count]
+
+        # 数据: 报文第 p 字节 (p >= ff_payload) 位于第 (p - ff_payload) // cf_payload 个 CF 的
+        # 第 (p - ff_payload) % cf_payload 列，每段每列一次跨步赋值
+        offset = 0
+        for part in parts:
+            n = len(part)
+            if offset < ff_payload:
+                k = min(n, ff_payload - offset)
+                mem[data_start + offset : data_start + offset + k] = part[:k]
+            skip = max(0, ff_payload - offset)
+            pos = offset + skip - ff_payload
+            for j in range(skip, min(n, skip + cf_payload)):
+                column = part[j::cf_payload]
+                frame, col = divmod(pos + j - skip, cf_payload)
+                dst = start + frame * size + 1 + col
+                mem[dst : dst + (len(column) - 1) * size + 1 : size] = column
+            offset += n
+
+        # 最后一帧不足部分补 0x00 (数组复用时同时清掉旧数据)
+        used = (length - ff_payload) - (cf_count - 1) * cf_payload
+        last = start + (cf_count - 1) * size + 1
+        mem[last + used : last + cf_payload] = bytes(cf_payload - used)
+
+        # CAN-FD: 最后一帧收缩到不小于 8 的合法 DLC 长度
+        if self.fd:
+            msgs[count - 1].frame.len = max(8, canfd_len(1 + used))
+
+        return msgs, count
+
     def send(self, data):
         """
         ISO-TP 发送入口函数
-        :param data: 要发送的完整数据 (list 或 bytes)
+        :param data: 要发送的完整数据 (list、bytes 类对象或分散/聚集 tuple，见 as_buffers())
         :return: True 成功, False 失败
         """
-        # 统一转为 list
-        if isinstance(data, bytes):
-            data = list(data)
-            
-        length = len(data)
+        length = as_buffers(data)[1]
         
         # ---------------------------------------------------------
         # 情况 A: 数据短，用单帧 (SF)
         # ---------------------------------------------------------
-        if length <= 7:
-            # 构造 SF: [PCI(0)|Len] + Data
-            frame_data = [ISOTP_FRAME_SF | length] + data
-            print(f"[ISO-TP] 发送单帧 (Len={length})")
-            return self._send_raw_frame(frame_data)
+        if length <= self.sf_max:
+            log.debug("发送单帧 0x%X Len=%d", self.tx_id, length)
+            return self._send_raw_frame(self.single_frame(data))
 
         # ---------------------------------------------------------
         # 情况 B: 数据长，用多帧 (FF + FC + CF...)
         # ---------------------------------------------------------
         else:
-            print(f"[ISO-TP] 发送多帧 (Len={length})")
+            log.debug("发送多帧 0x%X Len=%d", self.tx_id, length)
             
-            # 1. 发送首帧 (FF)
+            # 1. 一次性分段出 FF + 全部 CF，然后发送首帧 (FF)
             # --------------------------------
-            # Byte0: PCI(1)|Len_High, Byte1: Len_Low
-            len_high = (length >> 8) & 0x0F
-            len_low  = length & 0xFF
-            
-            # FF 包含前 6 个字节的数据
-            frame_data = [ISOTP_FRAME_FF | len_high, len_low] + data[0:6]
+            msgs, count = self.segment(data)
+            start = time.perf_counter()
             
-            if not self._send_raw_frame(frame_data):
-                print("[Error] 首帧发送失败")
+            if self._transmit(self.chn, msgs[0], 1) != 1:
+                log.error("首帧发送失败")
                 return False
                 
             # 2. 等待流控帧 (FC)
@@ -119,70 +519,164 @@ class IsoTpLayer:
             ok, fs, bs, st_min = self._wait_flow_control()
             
             if not ok:
-                print("[Error] 等待流控帧超时 (MCU没反应)")
                 return False
             
             if fs != 0: # 如果不是 CTS (Continue To Send)
-                print(f"[Error] MCU 拒绝接收 (FS={fs})")
+                log.error("MCU 拒绝接收 (FS=%d)", fs)
                 return False
                 
-            # 解析 STmin (简单处理 0-127ms)
-            delay_s = 0
-            if st_min <= 0x7F:
-                delay_s = st_min / 1000.0 # 毫秒转秒
-            elif 0xF1 <= st_min <= 0xF9:
-                delay_s = (st_min - 0xF0) * 0.0001 # 100微秒转秒
+            # 解析 STmin
+            delay_s = self._calc_st_min(st_min)
             
             block_size = bs
             
-            print(f"[ISO-TP] 收到流控: BS={bs}, STmin={st_min} (延时 {delay_s:.4f}s)")
+            log.debug("收到流控: BS=%d, STmin=0x%02X (%.6fs)", bs, st_min, delay_s)
 
 
-            # 3. 发送连续帧 (CF)
+            # 3. 发送连续帧 (CF): 直接索引分段好的数组
+            #    每次处理一块 (BS 帧，BS=0 时为剩余全部)，STmin 允许时整块一次 Transmit
             # --------------------------------
-            offset = 6 # 已经发了6个
-            sn = 1     # 序列号从1开始
-            frame_count_in_block = 0
-            
-            while offset < length:
-                # 截取最多 7 个字节
-                chunk = data[offset : offset + 7]
-                
-                # 构造 CF: [PCI(2)|SN] + Data
-                frame_data = [ISOTP_FRAME_CF | sn] + chunk
-                
-                if not self._send_raw_frame(frame_data):
-                    return False
-                
-                # 变量更新
-                offset += len(chunk)
-                sn = (sn + 1) & 0x0F # 0-15 循环
-                frame_count_in_block += 1
+            calls = 1
+            pacer = self.pacer
+            pacer.reset()
+            i = 1
+            while i < count:
+                n = count - i if block_size == 0 else min(block_size, count - i)
+
+                if self.batch_st_min is not None and delay_s <= self.batch_st_min:
+                    sent = self._transmit_block(msgs, i, n)
+                    if sent < 0:
+                        return False
+                    calls += sent
+                elif self.device_queue is not None and self._queue_st_min_ms(delay_s):
+                    # 设备队列发送: 帧间隔由设备固件保证
+                    sent = self._transmit_queued(msgs, i, n, self._queue_st_min_ms(delay_s))
+                    if sent < 0:
+                        return False
+                    calls += sent
+                else:
+                    # 按 MCU 要求的 STmin 逐帧发送 (关键!)，块内最后一帧之后等流控即可
+                    pacer.start_block(int(round(delay_s * 1e9)))
+                    for k in range(i, i + n):
+                        pacer.wait()
+                        if self._transmit(self.chn, msgs[k], 1) != 1:
+                            return False
+                        pacer.sent()
+                        calls += 1
+                i += n
 
-                if block_size > 0 and frame_count_in_block >= block_size:
-                    print(f"[ISO-TP] 已发送 {frame_count_in_block} 帧，等待中间流控...")
+                if i < count and block_size > 0:
+                    log.debug("已发送 %d 帧，等待中间流控", n)
 
                     ok, fs, new_bs, new_st = self._wait_flow_control()
                     if not ok: return False
-                    if fs != 0: return False
+                    if fs != 0:
+                        log.error("MCU 拒绝接收 (FS=%d)", fs)
+                        return False
 
                     block_size = new_bs
                     delay_s = self._calc_st_min(new_st)
-                    frame_count_in_block = 0
-
-                    continue
-                
-                # 执行 MCU 要求的延时 (关键!)
-                if delay_s > 0:
-                    time.sleep(delay_s)
             
-            print("[ISO-TP] 传输完成")
+            elapsed = time.perf_counter() - start
+            self.last_tx_stats = IsoTpTxStats(length, count, calls, elapsed,
+                                              count / elapsed if elapsed > 0 else 0.0,
+                                              *pacer.gap_stats_us())
+            # 统计以结构化参数记录，只在输出时格式化
+            log.debug("传输完成: %s", self.last_tx_stats)
             return True
+
+    @staticmethod
+    def _queue_st_min_ms(delay_s):
+        """STmin 为整毫秒 (设备队列发送的帧间隔单位) 时返回毫秒数，否则返回 0"""
+        ms = int(round(delay_s * 1000))
+        return ms if ms >= 1 and abs(ms - delay_s * 1000) < 1e-6 else 0
+
+    def _transmit_queued(self, msgs, first, n, st_min_ms):
+        """
+        把 msgs[first : first+n] 带帧间隔 st_min_ms 交给设备发送队列
+        每次只提交队列的空闲帧数 (不会溢出)；队列空闲不足一半时，按设备发出这些帧所需的时间等待后再补充，
+        队列里始终留有约一半的帧，主机侧的延迟不会让总线出现空档
+        :return: Transmit 调用次数，失败返回 -1
+        """
+        device_handle, chn_index = self.device_queue
+        set_tx_delay(msgs, st_min_ms, first, n)
+        deadline = time.time() + n * st_min_ms / 1000.0 + self.timeout_n_bs
+        calls = 0
+        sent = 0
+        ret = 0
+        while sent < n:
+            status = self.zcan.tx_queue_status(device_handle, chn_index)
+            if status is None:
+                free = want = n - sent
+            else:
+                depth, free = status
+                want = min(n - sent, max(1, (depth + free) // 2))
+            if free < want:
+                if time.time() > deadline:
+                    log.error("设备发送队列长时间已满 (已提交 %d/%d)", sent, n)
+                    return -1
+                time.sleep((want - free) * st_min_ms / 1000.0)
+                continue
+            ret = self._transmit(self.chn, msgs[first + sent], min(free, n - sent))
+            calls += 1
+            if ret <= 0:
+                log.error("连续帧提交到设备队列失败 (已提交 %d/%d)", sent, n)
+                return -1
+            sent += ret
+        # 返回时队列里还有帧在按 STmin 等待发送: 记下预计发完的时刻
+        status = self.zcan.tx_queue_status(device_handle, chn_index)
+        backlog = status[0] if status is not None else ret
+        self._tx_drain_at = time.time() + backlog * st_min_ms / 1000.0
+        return calls
+
+    def _transmit_block(self, msgs, first, n):
+        """
+        一次 Transmit 提交 msgs[first : first+n]，设备队列只接收了一部分时从剩余处继续提交
+        :return: Transmit 调用次数，失败返回 -1
+        """
+        calls = 0
+        sent = 0
+        while sent < n:
+            ret = self._transmit(self.chn, msgs[first + sent], n - sent)
+            calls += 1
+            if ret <= 0:
+                log.error("连续帧发送失败 (已发送 %d/%d)", sent, n)
+                return -1
+            sent += ret
+        return calls
     
+    def recv(self, timeout=ISOTP_TIMEOUT_N_CR):
+        """
+        ISO-TP 接收入口函数: 接收一条完整报文 (SF 或 FF + CF...)
+        收到首帧后由上位机回复流控 (BS=rx_bs, STmin=rx_st_min)，连续帧之间按 N_Cr 超时
+        :param timeout: 等待第一帧 (SF/FF) 的超时时间 (秒)
+        :return: 重组后的数据 (bytes)，超时或出错返回 None
+        """
+        rx = self.rx
+        rx.reset()
+        deadline = time.time() + timeout
+        while True:
+            data = self._next_frame(deadline)
+            if data is None:
+                if rx.in_progress:
+                    log.error("N_Cr 超时 (已接收 %d/%d 字节)", rx.received, rx.length)
+                else:
+                    log.debug("0x%X 接收超时 (%.3fs)", self.rx_id, timeout)
+                rx.reset()
+                return None
+
+            payload, fc, error = rx.feed(data)
+            if fc is not None and not self._send_raw_frame(fc):
+                rx.reset()
+                return None
+            if error is not None:
+                log.error("%s", error)
+                return None
+            if payload is not None:
+                return payload
+            if rx.in_progress:
+                deadline = time.time() + self.timeout_n_cr
+
     def _calc_st_min(self, st_min_val):
-        """辅助函数：解析 STmin"""
-        if st_min_val <= 0x7F:
-            return st_min_val / 1000.0 # ms
-        elif 0xF1 <= st_min_val <= 0xF9:
-            return (st_min_val - 0xF0) * 0.0001 # 100us
-        return 0.1 # 默认安全值
\ No newline at end of file
+        """辅助函数：解析 STmin (秒)，保留值按标准使用 127ms"""
+        return st_min_to_ns(st_min_val) / 1e9
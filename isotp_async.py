@@ -0,0 +1,215 @@
+# -*- coding:utf-8 -*-
+#  isotp_async.py
+#
+#  asyncio 版 ISO-TP: send/recv 为协程，报文由通道分发器 (zcan_dispatch) 的接收线程读取，
+#  经 loop.call_soon_threadsafe 交给事件循环，流控帧和数据帧分别进入各自的 asyncio 队列。
+#  分段、组帧、整块发送复用 IsoTpLayer，帧间隔 (STmin) 用 asyncio.sleep 按绝对时间等待，
+#  所以一个事件循环里可以同时运行多个 ECU 会话而不占用线程。
+#
+#      tp = AsyncIsoTpLayer(zcan, chn_handle, 0x7E0, 0x7E8)
+#      await tp.send(b'\x10\x03')
+#      resp = await tp.recv(1.0)
+#      tp.close()
+#
+import asyncio
+import logging
+from zlgcan import *
+from zcan_dispatch import get_dispatcher
+from isotp import *
+
+log = logging.getLogger(__name__)
+
+ISOTP_WFT_MAX = 16 # 连续收到 FS=WAIT 流控的最大次数 (N_WFTmax)，超过即放弃发送
+
+
+class AsyncIsoTpLayer(object):
+    def __init__(self, zcan_lib, chn_handle, tx_id, rx_id, dispatcher=None, fd=False, tx_dl=None, brs=True,
+                 rx_bs=0, rx_st_min=0, batch_st_min=ISOTP_BATCH_ST_MIN, rx_max_len=ISOTP_RX_MAX_LEN):
+        """
+        :param dispatcher: 通道分发器，None 时使用 get_dispatcher(zcan_lib, chn_handle, fd) 并在 close() 时释放
+        其余参数同 IsoTpLayer；设备队列发送 (device_queue) 需要阻塞等待队列空闲，这里不使用
+        """
+        self.tp = IsoTpLayer(zcan_lib, chn_handle, tx_id, rx_id, fd=fd, tx_dl=tx_dl, brs=brs,
+                             rx_bs=rx_bs, rx_st_min=rx_st_min, batch_st_min=batch_st_min,
+                             rx_max_len=rx_max_len)
+        self._own_dispatcher = dispatcher is None
+        self.dispatcher = dispatcher if dispatcher is not None else get_dispatcher(zcan_lib, chn_handle, fd)
+        self.tx_id = tx_id
+        self.rx_id = rx_id
+        self.timeout_n_bs = ISOTP_TIMEOUT_N_BS
+        self.timeout_n_cr = ISOTP_TIMEOUT_N_CR
+        self.last_tx_stats = None
+        self._loop = None
+        self._sub = None
+        self._frames = None    # 数据帧 (SF/FF/CF)
+        self._fc_frames = None # 流控帧
+        self._send_lock = None
+
+    def _start(self):
+        """第一次 send/recv 时绑定当前事件循环并订阅 rx_id"""
+        loop = asyncio.get_running_loop()
+        if self._sub is not None:
+            if loop is not self._loop:
+                raise RuntimeError("AsyncIsoTpLayer is bound to another event loop")
+            return loop
+        self._loop = loop
+        self._frames = asyncio.Queue()
+        self._fc_frames = asyncio.Queue()
+        self._send_lock = asyncio.Lock()
+        if self.dispatcher is None:
+            self.dispatcher = get_dispatcher(self.tp.zcan, self.tp.chn, self.tp.fd)
+        self._sub = self.dispatcher.subscribe(ids=[self.rx_id], callback=self._on_frame)
+        return loop
+
+    def close(self):
+        """取消订阅 (并释放自己取得的分发器)，之后的 send/recv 会重新订阅"""
+        if self._sub is not None:
+            self._sub.close()
+            self._sub = None
+        if self._own_dispatcher and self.dispatcher is not None:
+            self.dispatcher.release()
+            self.dispatcher = None
+
+    def clear(self):
+        """丢弃已收到但还没有被 recv 取走的报文 (例如上一个请求超时后才到的响应)"""
+        if self._frames is not None:
+            while not self._frames.empty():
+                self._frames.get_nowait()
+
+    # --- 接收线程 -> 事件循环 -------------------------------------------------
+    def _on_frame(self, msg):
+        """分发器接收线程中调用: 只取出数据，入队交给事件循环"""
+        data = IsoTpLayer._frame_data(msg)
+        try:
+            self._loop.call_soon_threadsafe(self._deliver, data)
+        except RuntimeError:
+            pass # 事件循环已关闭
+
+    def _deliver(self, data):
+        if data and (data[0] & 0xF0) == ISOTP_FRAME_FC:
+            self._fc_frames.put_nowait(data)
+        else:
+            self._frames.put_nowait(data)
+
+    # --- 发送 -----------------------------------------------------------------
+    async def _wait_flow_control(self):
+        """等待流控帧，FS=WAIT 时重新计时继续等待；返回 (fs, bs, st_min)，超时返回 None"""
+        wait_count = 0
+        while True:
+            try:
+                data = await asyncio.wait_for(self._fc_frames.get(), self.timeout_n_bs)
+            except asyncio.TimeoutError:
+                log.error("N_Bs 超时: MCU 未在 %.3fs 内回复 FC", self.timeout_n_bs)
+                return None
+            if len(data) < 3:
+                continue
+            fs = data[0] & 0x0F
+            if fs == ISOTP_FS_WAIT:
+                wait_count += 1
+                if wait_count > ISOTP_WFT_MAX:
+                    log.error("连续 %d 次 FS=WAIT，放弃发送", wait_count)
+                    return None
+                continue
+            return fs, data[1], data[2]
+
+    async def send(self, data):
+        """
+        发送一条 ISO-TP 报文 (协程)，同一个会话上的多次 send 依次进行
+        :param data: list、bytes 类对象或分散/聚集 tuple，见 as_buffers()
+        :return: True 成功, False 失败
+        """
+        loop = self._start()
+        tp = self.tp
+        length = as_buffers(data)[1]
+
+        async with self._send_lock:
+            if length <= tp.sf_max:
+                return tp._send_raw_frame(tp.single_frame(data))
+
+            msgs, count = tp.segment(data)
+            start = loop.time()
+            # 丢弃之前残留的流控帧，再发首帧
+            while not self._fc_frames.empty():
+                self._fc_frames.get_nowait()
+            if tp._transmit(tp.chn, msgs[0], 1) != 1:
+                log.error("首帧发送失败")
+                return False
+            calls = 1
+
+            i = 1
+            while i < count:
+                fc = await self._wait_flow_control()
+                if fc is None:
+                    return False
+                fs, block_size, st_min = fc
+                if fs != ISOTP_FS_CTS:
+                    log.error("MCU 拒绝接收 (FS=%d)", fs)
+                    return False
+                delay_s = tp._calc_st_min(st_min)
+                n = count - i if block_size == 0 else min(block_size, count - i)
+
+                if tp.batch_st_min is not None and delay_s <= tp.batch_st_min:
+                    sent = tp._transmit_block(msgs, i, n)
+                    if sent < 0:
+                        return False
+                    calls += sent
+                else:
+                    # 按绝对时间推进，等待期间事件循环可以处理其它会话
+                    deadline = loop.time()
+                    for k in range(i, i + n):
+                        remaining = deadline - loop.time()
+                        if remaining > 0:
+                            await asyncio.sleep(remaining)
+                        if tp._transmit(tp.chn, msgs[k], 1) != 1:
+                            return False
+                        calls += 1
+                        deadline = max(deadline + delay_s, loop.time())
+                i += n
+
+            elapsed = loop.time() - start
+            self.last_tx_stats = IsoTpTxStats(length, count, calls, elapsed,
+                                              count / elapsed if elapsed > 0 else 0.0, None, None, None)
+            log.debug("传输完成: %s", self.last_tx_stats)
+            return True
+
+    # --- 接收 -----------------------------------------------------------------
+    async def _get_frame(self, wait):
+        """取一个数据帧，已在队列中的立即返回，wait 秒内没有收到返回 None"""
+        if not self._frames.empty():
+            return self._frames.get_nowait()
+        if wait <= 0:
+            return None
+        try:
+            return await asyncio.wait_for(self._frames.get(), wait)
+        except asyncio.TimeoutError:
+            return None
+
+    async def recv(self, timeout=ISOTP_TIMEOUT_N_CR):
+        """
+        接收一条完整报文 (协程)，收到首帧后回复流控，连续帧之间按 N_Cr 超时
+        :param timeout: 等待第一帧 (SF/FF) 的超时时间 (秒)，从调用时起算，期间被忽略的帧不会延长等待
+        :return: 重组后的数据 (bytes)，超时或出错返回 None
+        """
+        loop = self._start()
+        tp = self.tp
+        rx = tp.rx
+        rx.reset()
+        deadline = loop.time() + timeout
+        while True:
+            wait = self.timeout_n_cr if rx.in_progress else deadline - loop.time()
+            data = await self._get_frame(wait)
+            if data is None:
+                if rx.in_progress:
+                    log.error("N_Cr 超时 (已接收 %d/%d 字节)", rx.received, rx.length)
+                rx.reset()
+                return None
+
+            payload, fc, error = rx.feed(data)
+            if fc is not None and not tp._send_raw_frame(fc):
+                rx.reset()
+                return None
+            if error is not None:
+                log.error("%s", error)
+                return None
+            if payload is not None:
+                return payload
@@ -0,0 +1,138 @@
+# -*- coding:utf-8 -*-
+#  isotp_sessions.py
+#
+#  一个通道上的多 ECU ISO-TP 会话管理: 每个物理会话 (0x7E0/0x7E8, 0x7E1/0x7E9, ...) 是一个
+#  订阅了自己响应 ID 的 IsoTpLayer，流控和重组状态各自独立，可以在不同线程里同时收发；
+#  功能寻址 (0x7DF) 的单帧请求发出后，在所有物理会话上并行收集各 ECU 的响应。
+#
+#      mgr = IsoTpSessionManager(zcan, chn_handle)
+#      for i in range(8):
+#          mgr.add_session(0x7E0 + i, 0x7E8 + i)
+#      resps = mgr.functional_request(b'\x22\xF1\x90')     # {tx_id: 响应 bytes}
+#      results = mgr.run_parallel(lambda tp: UdsClient(tp).request([0x10, 0x03]))
+#      mgr.close()
+#
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from zlgcan import *
+from zcan_dispatch import get_dispatcher
+from isotp import IsoTpLayer, as_buffers
+
+log = logging.getLogger(__name__)
+
+ISOTP_FUNCTIONAL_ID = 0x7DF  # OBD/UDS 功能寻址请求 ID (11 位)
+FUNCTIONAL_P2       = 0.15   # 功能请求等待各 ECU 响应的时间 (秒，含余量)
+FUNCTIONAL_P2_STAR  = 5.1    # 收到 NRC 0x78 后继续等待的时间 (秒)
+
+
+class IsoTpSessionManager(object):
+    def __init__(self, zcan_lib, chn_handle, fd=False, dispatcher=None,
+                 functional_id=ISOTP_FUNCTIONAL_ID, **tp_kwargs):
+        """
+        :param dispatcher: 通道分发器，None 时使用 get_dispatcher(zcan_lib, chn_handle, fd) 并在 close() 时释放
+        :param functional_id: 功能寻址请求 ID
+        :param tp_kwargs: 传给每个 IsoTpLayer 的参数 (tx_dl, brs, rx_bs, rx_st_min, device_queue ...)
+        """
+        self.zcan = zcan_lib
+        self.chn = chn_handle
+        self.fd = fd
+        self._own_dispatcher = dispatcher is None
+        self.dispatcher = dispatcher if dispatcher is not None else get_dispatcher(zcan_lib, chn_handle, fd)
+        self.tp_kwargs = tp_kwargs
+        self.sessions = {} # {tx_id: IsoTpLayer}
+        # 功能寻址只发单帧，不订阅接收
+        self.functional = IsoTpLayer(zcan_lib, chn_handle, functional_id, None, fd=fd,
+                                     tx_dl=tp_kwargs.get("tx_dl"), brs=tp_kwargs.get("brs", True))
+
+    def add_session(self, tx_id, rx_id, **tp_kwargs):
+        """添加一个物理寻址会话，返回其 IsoTpLayer (tp_kwargs 覆盖管理器的默认参数)"""
+        if tx_id in self.sessions:
+            raise ValueError(f"ISO-TP session 0x{tx_id:X} already exists")
+        kwargs = dict(self.tp_kwargs, **tp_kwargs)
+        tp = IsoTpLayer(self.zcan, self.chn, tx_id, rx_id, fd=self.fd, dispatcher=self.dispatcher, **kwargs)
+        self.sessions[tx_id] = tp
+        return tp
+
+    def remove_session(self, tx_id):
+        tp = self.sessions.pop(tx_id, None)
+        if tp is not None:
+            tp.close()
+
+    def session(self, tx_id):
+        return self.sessions[tx_id]
+
+    def close(self):
+        """关闭全部会话；分发器是自己取得的才释放，调用方传入的由调用方释放"""
+        for tp in self.sessions.values():
+            tp.close()
+        self.sessions.clear()
+        if self._own_dispatcher and self.dispatcher is not None:
+            self.dispatcher.release()
+            self.dispatcher = None
+
+    # --- 功能寻址 -------------------------------------------------------------
+    def functional_request(self, data, timeout=FUNCTIONAL_P2, pending_timeout=FUNCTIONAL_P2_STAR):
+        """
+        功能寻址请求: 单帧发到 functional_id，在所有会话上并行等待响应
+        多帧响应由各自会话回复流控 (发往该 ECU 的物理 ID)
+        :param data: 请求数据，长度不能超过单帧 (CAN 7 字节)
+        :param timeout: 等待各 ECU 第一个响应的时间 (秒)
+        :param pending_timeout: 收到 NRC 0x78 后再等待的时间 (秒)
+        :return: {tx_id: 响应 bytes}，没有响应的 ECU 不在结果中
+        """
+        data = b''.join(as_buffers(data)[0])
+        if len(data) > self.functional.sf_max:
+            raise ValueError(f"functional request must fit in a single frame: {len(data)}")
+
+        sessions = list(self.sessions.items())
+        for _, tp in sessions:
+            tp.clear()
+        if not self.functional._send_raw_frame(self.functional.single_frame(data)):
+            log.error("功能寻址请求发送失败")
+            return {}
+        if not sessions:
+            return {}
+
+        sid = data[0]
+        with ThreadPoolExecutor(max_workers=len(sessions)) as pool:
+            futures = [(tx_id, pool.submit(self._collect, tp, sid, timeout, pending_timeout))
+                       for tx_id, tp in sessions]
+            results = {tx_id: future.result() for tx_id, future in futures}
+        return {tx_id: resp for tx_id, resp in results.items() if resp is not None}
+
+    @staticmethod
+    def _collect(tp, sid, timeout, pending_timeout):
+        """等待一个 ECU 对功能请求的最终响应 (跳过 NRC 0x78)"""
+        deadline = time.time() + timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+            resp = tp.recv(remaining)
+            if resp is None:
+                return None
+            if len(resp) >= 3 and resp[0] == 0x7F and resp[1] == sid and resp[2] == 0x78:
+                deadline = time.time() + pending_timeout
+                continue
+            return resp
+
+    # --- 物理寻址并行执行 -----------------------------------------------------
+    def run_parallel(self, func, tx_ids=None, max_workers=None):
+        """
+        在多个会话上并行执行 func(tp)，每个会话一个线程
+        :param tx_ids: 要执行的会话，None 为全部
+        :return: {tx_id: func 返回值}；func 抛出的异常原样作为该会话的结果
+        """
+        sessions = [(tx_id, self.sessions[tx_id]) for tx_id in (tx_ids if tx_ids is not None else self.sessions)]
+        if not sessions:
+            return {}
+        results = {}
+        with ThreadPoolExecutor(max_workers=max_workers or len(sessions)) as pool:
+            futures = [(tx_id, pool.submit(func, tp)) for tx_id, tp in sessions]
+            for tx_id, future in futures:
+                try:
+                    results[tx_id] = future.result()
+                except Exception as e:
+                    results[tx_id] = e
+        return results
@@ -0,0 +1,141 @@
+# test_channel_filter.py
+#
+# ChannelFilter: 排序合并、hw_ranges() 组数限制、acc_code_mask() 至少覆盖全部 ID (超集)。
+# 不需要设备:  python -m pytest test_channel_filter.py
+import pytest
+from zlgcan import *
+
+STD_IDS = range(0x800)
+
+
+def acc_accepts(code, mask, can_id, eff=False):
+    """按 SJA1000 单滤波规则判断 can_id 是否通过 (mask 位为 1 表示不关心)"""
+    shift = 3 if eff else 21
+    return ((can_id << shift) ^ code) & ~mask & 0xFFFFFFFF == 0
+
+
+def test_ranges_merged_and_sorted():
+    f = ChannelFilter(ids=(0x7E8, 0x100, 0x7E9), ranges=((0x7EF, 0x7EA), (0x101, 0x103)))
+    assert f.ranges == [(0x100, 0x103), (0x7E8, 0x7EF)]
+    assert f.id_count == 12
+    assert f.match(0x102) and f.match(0x7EC)
+    assert not f.match(0x104) and not f.match(0x7F0)
+
+
+def test_accept_all():
+    f = ChannelFilter()
+    assert f.accept_all
+    assert f.match(0x123)
+    assert f.acc_code_mask() == (0, 0xFFFFFFFF, True)
+
+
+def test_hw_ranges_exact():
+    f = ChannelFilter(ids=(0x10, 0x20, 0x30))
+    assert f.hw_ranges() == ([(0x10, 0x10), (0x20, 0x20), (0x30, 0x30)], True)
+
+
+def test_hw_ranges_merge_smallest_gap():
+    f = ChannelFilter(ids=(0x10, 0x12, 0x40, 0x80))
+    ranges, exact = f.hw_ranges(max_ranges=3)
+    assert not exact
+    assert ranges == [(0x10, 0x12), (0x40, 0x40), (0x80, 0x80)]
+    ranges, _ = f.hw_ranges(max_ranges=1)
+    assert ranges == [(0x10, 0x80)]
+
+
+def test_hw_ranges_superset():
+    f = ChannelFilter(ids=range(0, 0x400, 5))
+    ranges, exact = f.hw_ranges(max_ranges=8)
+    assert not exact and len(ranges) == 8
+    for can_id in STD_IDS:
+        if f.match(can_id):
+            assert any(start <= can_id <= end for start, end in ranges)
+
+
+@pytest.mark.parametrize("ids, ranges, exact", [
+    ((0x7E8,), (), True),
+    ((), ((0x7E8, 0x7EF),), True),
+    ((0x7E0, 0x7E8), (), True),
+    ((0x7E8, 0x7E9, 0x7EA), (), False),
+    ((0x100, 0x7E8), ((0x300, 0x30F),), False),
+])
+def test_acc_code_mask_superset(ids, ranges, exact):
+    f = ChannelFilter(ids=ids, ranges=ranges)
+    code, mask, is_exact = f.acc_code_mask()
+    assert is_exact == exact
+    accepted = [can_id for can_id in STD_IDS if acc_accepts(code, mask, can_id)]
+    assert all(acc_accepts(code, mask, can_id) for can_id in STD_IDS if f.match(can_id))
+    if exact:
+        assert accepted == [can_id for can_id in STD_IDS if f.match(can_id)]
+
+
+def test_acc_code_mask_extended():
+    f = ChannelFilter(ids=(0x18DAF100, 0x18DAF101), eff=True)
+    code, mask, exact = f.acc_code_mask()
+    assert exact
+    assert acc_accepts(code, mask, 0x18DAF100, eff=True)
+    assert acc_accepts(code, mask, 0x18DAF101, eff=True)
+    assert not acc_accepts(code, mask, 0x18DAF102, eff=True)
+
+
+# --- ZCAN.set_channel_filter (虚拟后端) --------------------------------------
+def open_pair():
+    from zcan_virtual import VirtualZCAN
+    zcan = ZCAN(VirtualZCAN())
+    handle = zcan.OpenDevice(ZCAN_USBCANFD_200U, 0, 0)
+    chns = [zcan.InitCAN(handle, i, ZCAN_CHANNEL_INIT_CONFIG()) for i in range(2)]
+    for chn in chns:
+        zcan.StartCAN(chn)
+    return zcan, handle, chns
+
+
+def received_ids(zcan, chn):
+    msgs, count = zcan.Receive(chn, 64, 0)
+    return [msgs[i].frame.can_id for i in range(count)]
+
+
+def test_set_channel_filter_exact():
+    zcan, handle, (a, b) = open_pair()
+    assert zcan.set_channel_filter(handle, 1, b, ChannelFilter(ids=(0x7E8, 0x7E9)))
+    zcan.transmit_many(a, [(can_id, b'\x00') for can_id in (0x100, 0x7E8, 0x7E9, 0x7EA)])
+    assert received_ids(zcan, b) == [0x7E8, 0x7E9]
+    zcan.CloseDevice(handle)
+
+
+def test_set_channel_filter_host_fallback():
+    zcan, handle, (a, b) = open_pair()
+    ids = range(0, 0x400, 5) # 超过硬件范围组数
+    assert not zcan.set_channel_filter(handle, 1, b, ChannelFilter(ids=ids))
+    zcan.transmit_many(a, [(can_id, b'\x00') for can_id in (0, 1, 5, 6, 0x3FC)])
+    assert received_ids(zcan, b) == [0, 5, 0x3FC]
+    zcan.CloseDevice(handle)
+
+
+def test_set_channel_filter_accept_all_clears_hw():
+    zcan, handle, (a, b) = open_pair()
+    zcan.set_channel_filter(handle, 1, b, ChannelFilter(ids=(0x7E8,)))
+    assert zcan.set_channel_filter(handle, 1, b, ChannelFilter())
+    assert zcan.backend._devices[handle]["filters"][1] == [] # filter_ack 已下发
+    zcan.transmit_many(a, [(0x100, b'\x00'), (0x7E8, b'\x00')])
+    assert received_ids(zcan, b) == [0x100, 0x7E8]
+    zcan.CloseDevice(handle)
+
+
+def test_set_channel_filter_partial_failure(monkeypatch):
+    zcan, handle, (a, b) = open_pair()
+    backend = zcan.backend
+    set_value = backend.ZCAN_SetValue
+    calls = []
+    def failing(device_handle, path, value):
+        path = path.decode() if isinstance(path, bytes) else path
+        calls.append(path)
+        if path.endswith("filter_start") and calls.count(path) == 2:
+            return ZCAN_STATUS_ERR # 第二组写入失败
+        return set_value(device_handle, path, value)
+    monkeypatch.setattr(backend, "ZCAN_SetValue", failing)
+    zcan._bind(backend)
+    assert not zcan.set_channel_filter(handle, 1, b, ChannelFilter(ids=(0x100, 0x200)))
+    assert backend._devices[handle]["filters"][1] == [] # 部分写入的范围已清除
+    zcan.transmit_many(a, [(can_id, b'\x00') for can_id in (0x100, 0x150, 0x200)])
+    assert received_ids(zcan, b) == [0x100, 0x200] # 主机侧过滤
+    zcan.CloseDevice(handle)
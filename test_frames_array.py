@@ -0,0 +1,72 @@
+# test_frames_array.py
+#
+# frames_as_array / ZCAN.receive_array: 接收数组的 NumPy 零拷贝视图。
+# 不需要设备 (需要 numpy):  python -m pytest test_frames_array.py
+import pytest
+from zlgcan import *
+from zcan_virtual import VirtualZCAN
+
+np = pytest.importorskip("numpy")
+
+
+def open_pair():
+    zcan = ZCAN(VirtualZCAN())
+    handle = zcan.OpenDevice(ZCAN_USBCANFD_200U, 0, 0)
+    chns = [zcan.InitCAN(handle, i, ZCAN_CHANNEL_INIT_CONFIG()) for i in range(2)]
+    for chn in chns:
+        zcan.StartCAN(chn)
+    return zcan, handle, chns
+
+
+def test_fields_match_structures():
+    msgs = (ZCAN_Receive_Data * 3)()
+    for i in range(3):
+        msgs[i].frame.can_id = 0x100 + i
+        msgs[i].frame.can_dlc = i + 1
+        msgs[i].frame.data[0] = 0xA0 + i
+        msgs[i].timestamp = 1000 * i
+    arr = frames_as_array(msgs, 2)
+    assert len(arr) == 2
+    assert list(arr["can_id"] & CAN_ID_MASK) == [0x100, 0x101]
+    assert list(arr["dlc"]) == [1, 2]
+    assert list(arr["data"][:, 0]) == [0xA0, 0xA1]
+    assert list(arr["timestamp"]) == [0, 1000]
+
+
+def test_zero_copy_view():
+    msgs = (ZCAN_Receive_Data * 2)()
+    arr = frames_as_array(msgs)
+    msgs[1].frame.can_id = 0x7E8
+    msgs[1].frame.data[7] = 0x55
+    assert arr["can_id"][1] == 0x7E8 and arr["data"][1, 7] == 0x55
+
+
+def test_fd_fields():
+    msgs = (ZCAN_ReceiveFD_Data * 1)()
+    msgs[0].frame.len = 64
+    msgs[0].frame.data[63] = 0x3F
+    arr = frames_as_array(msgs)
+    assert arr.dtype == CANFD_RX_DTYPE
+    assert arr["dlc"][0] == 64 and arr["data"][0, 63] == 0x3F
+
+
+def test_receive_array():
+    zcan, handle, (a, b) = open_pair()
+    zcan.transmit_many(a, [(0x7E0 + i, bytes((i,)) * (i + 1)) for i in range(5)])
+    arr = zcan.receive_array(b, 16)
+    assert len(arr) == 5
+    assert list(arr["can_id"] & CAN_ID_MASK) == [0x7E0 + i for i in range(5)]
+    assert list(arr["dlc"]) == [1, 2, 3, 4, 5]
+    sel = arr[(arr["can_id"] & CAN_ID_MASK) >= 0x7E3]
+    assert list(sel["data"][:, 0]) == [3, 4]
+    assert len(zcan.receive_array(b, 16)) == 0
+    zcan.CloseDevice(handle)
+
+
+def test_receive_array_fd():
+    zcan, handle, (a, b) = open_pair()
+    zcan.transmit_many_fd(a, [(0x100, bytes(range(64)))])
+    arr = zcan.receive_array(b, 4, can_type=ZCAN_TYPE_CANFD)
+    assert len(arr) == 1
+    assert bytes(arr["data"][0]) == bytes(range(64))
+    zcan.CloseDevice(handle)
@@ -18,26 +18,12 @@ TX_ID = 0x7E0 # 上位机请求 CAN ID
 RX_ID = 0x7E8 # MCU 响应 CAN ID
 
 
-def wait_uds_response(zcan, chn_handle, timeout=2.0):
+def wait_uds_response(tp, timeout=2.0):
     """
-    简单的等待 UDS 响应函数 (仅支持接收单帧 SF，因为测试App部分的代码主要是单帧交互)
+    等待 UDS 响应 (由 ISO-TP 层完成单帧/多帧重组)
     """
-    start_time = time.time()
-    while time.time() - start_time < timeout:
-        num = zcan.GetReceiveNum(chn_handle, ZCAN_TYPE_CAN)
-        if num > 0:
-            msgs, cnt = zcan.Receive(chn_handle, num)
-            for i in range(cnt):
-                msg = msgs[i].frame
-                if msg.can_id == RX_ID:
-                    # 简单解析 ISO-TP 单帧 (SF)
-                    # Byte 0: [PCI(4bit) | Len(4bit)]
-                    if (msg.data[0] & 0xF0) == 0x00:
-                        length = msg.data[0] & 0x0F
-                        # 返回有效数据部分
-                        return list(msg.data[1 : 1+length])
-        time.sleep(0.005)
-    return None
+    resp = tp.recv(timeout)
+    return list(resp) if resp else None
 
 def print_result(step_name, passed, detail=""):
     if passed:
@@ -72,7 +58,7 @@ def run_test():
         print("\n>>> 测试 1: 直接请求编程会话 (Expect: Failure)")
         tp.send([0x10, 0x02]) # DiagnosticSessionControl - Programming
         
-        resp = wait_uds_response(zcan, chn_handle)
+        resp = wait_uds_response(tp)
         if resp and resp[0] == 0x7F and resp[2] == 0x22:
             print_result("Test 1", True, f"MCU 正确拒绝 (NRC={resp[2]:02X})")
         elif resp and resp[0] == 0x50:
@@ -87,7 +73,7 @@ def run_test():
         print("\n>>> 测试 2: 进入扩展会话 (Expect: Success)")
         tp.send([0x10, 0x03]) # DiagnosticSessionControl - Extended
         
-        resp = wait_uds_response(zcan, chn_handle)
+        resp = wait_uds_response(tp)
         if resp and resp[0] == 0x50 and resp[1] == 0x03:
             print_result("Test 2", True, "成功进入扩展会话")
         else:
@@ -100,7 +86,7 @@ def run_test():
         print("\n>>> 测试 3: 未预检请求编程 (Expect: Failure)")
         tp.send([0x10, 0x02]) 
         
-        resp = wait_uds_response(zcan, chn_handle)
+        resp = wait_uds_response(tp)
         if resp and resp[0] == 0x7F and resp[2] == 0x22:
             print_result("Test 3", True, f"MCU 正确拒绝 (NRC={resp[2]:02X})")
         elif resp and resp[0] == 0x50:
@@ -115,7 +101,7 @@ def run_test():
         print("\n>>> 测试 4: 执行预编程检查 (Expect: Success)")
         tp.send([0x31, 0x01, 0xFF, 0x00]) # RoutineControl - Start - CheckRoutine
         
-        resp = wait_uds_response(zcan, chn_handle)
+        resp = wait_uds_response(tp)
         if resp and resp[0] == 0x71 and resp[1] == 0x01:
             print_result("Test 4", True, "预编程检查通过")
         else:
@@ -128,7 +114,7 @@ def run_test():
         print("\n>>> 测试 5: 请求编程并跳转 (Expect: Success & Reset)")
         tp.send([0x10, 0x02]) 
         
-        resp = wait_uds_response(zcan, chn_handle)
+        resp = wait_uds_response(tp)
         if resp and resp[0] == 0x50 and resp[1] == 0x02:
             print_result("Test 5", True, "成功！MCU 正在重启进入 Bootloader...")
         else:
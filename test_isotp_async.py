@@ -0,0 +1,111 @@
+# test_isotp_async.py
+#
+# AsyncIsoTpLayer / AsyncUdsClient 经虚拟总线与仿真 ECU 通信: 多帧收发、NRC 0x78、超时不被无关报文延长。
+# 不需要设备:  python -m pytest test_isotp_async.py
+import asyncio
+import threading
+import time
+import pytest
+from zlgcan import *
+from zcan_virtual import VirtualZCAN
+from zcan_sim_ecu import SimBootloaderEcu
+from isotp import IsoTpReassembler, ISOTP_FRAME_CF
+from isotp_async import AsyncIsoTpLayer
+from uds_async import AsyncUdsClient
+
+TX_ID = 0x7E0
+RX_ID = 0x7E8
+
+
+class StrayNode(object):
+    """收到请求后不回复，而是每隔 interval 在 RX_ID 上发 count 帧 frame (空闲时的 CF、其它服务的响应等)"""
+    def __init__(self, frame, interval=0.02, count=25):
+        self.frame = frame
+        self.interval = interval
+        self.count = count
+        self.rx = IsoTpReassembler()
+
+    def __call__(self, bus, frame):
+        if frame.can_id != TX_ID:
+            return
+        payload, fc, error = self.rx.feed(frame.data)
+        if payload is not None:
+            threading.Thread(target=self._send, args=(bus,), daemon=True).start()
+
+    def _send(self, bus):
+        for _ in range(self.count):
+            time.sleep(self.interval)
+            bus.send(RX_ID, self.frame)
+
+
+def run(node, coro_fn, **kwargs):
+    """在虚拟总线上打开通道，asyncio.run(coro_fn(tp))"""
+    backend = VirtualZCAN(bitrate=500000)
+    backend.bus.attach(node)
+    zcan = ZCAN(backend)
+    handle = zcan.OpenDevice(ZCAN_USBCANFD_200U, 0, 0)
+    chn = zcan.InitCAN(handle, 0, ZCAN_CHANNEL_INIT_CONFIG())
+    zcan.StartCAN(chn)
+    tp = AsyncIsoTpLayer(zcan, chn, TX_ID, RX_ID, **kwargs)
+    try:
+        return asyncio.run(coro_fn(tp))
+    finally:
+        tp.close()
+        zcan.CloseDevice(handle)
+
+
+def test_send_and_recv_multi_frame():
+    ecu = SimBootloaderEcu(TX_ID, RX_ID, app_image=bytes(100))
+    async def flow(tp):
+        assert await tp.send(b'\x22\xF1\xA0')
+        resp = await tp.recv(1.0)   # 多帧响应 (11 字节)
+        assert resp[:3] == b'\x62\xF1\xA0' and len(resp) == 11
+        assert await tp.send(b'\x10\x02')
+        assert await tp.recv(1.0) == b'\x50\x02\x00\x32\x01\xF4'
+        await asyncio.sleep(0.35)   # 复位到 Bootloader
+        assert await tp.send(bytes((0x34,)) + bytes(8))
+        assert (await tp.recv(1.0))[0] == 0x74
+        block = bytes((0x36, 0x01)) + bytes(range(200))
+        assert await tp.send(block)  # 多帧请求，ECU 回 BS=8 的流控
+        assert tp.last_tx_stats.frames == 1 + -(-(len(block) - 6) // 7)
+        assert await tp.recv(1.0) == b'\x76\x01'
+    run(ecu, flow)
+    assert ecu.image == bytes(range(200))
+
+
+def test_uds_request_response_pending():
+    ecu = SimBootloaderEcu(TX_ID, RX_ID, start_in_boot=True, erase_time=0.3)
+    async def flow(tp):
+        uds = AsyncUdsClient(tp)
+        ok, resp = await uds.request([0x10, 0x02], "编程会话")
+        assert ok and resp[:2] == [0x50, 0x02]
+        assert (uds.p2, uds.p2_star) == (0.05, 5.0) # 采用 0x50 响应中的 P2/P2*
+        uds.p2_star = 0.5
+        start = time.perf_counter()
+        ok, resp = await uds.request([0x31, 0x01, 0xFF, 0x00], "擦除") # 先回 NRC 0x78，0.3s 后肯定响应
+        assert ok and resp == [0x71, 0x01, 0xFF, 0x00]
+        assert 0.25 < time.perf_counter() - start < 0.6
+        ok, resp = await uds.request([0x85, 0x02], "不支持")
+        assert not ok and resp == [0x7F, 0x85, 0x11]
+    run(ecu, flow)
+
+
+def test_recv_timeout_not_extended_by_stray_frames():
+    node = StrayNode(bytes((ISOTP_FRAME_CF | 1,)) + bytes(7)) # 空闲时的 CF 被忽略
+    async def flow(tp):
+        assert await tp.send(b'\x3E\x00')
+        start = time.perf_counter()
+        assert await tp.recv(0.1) is None
+        return time.perf_counter() - start
+    assert run(node, flow) < 0.2
+
+
+def test_request_timeout_not_extended_by_other_responses():
+    node = StrayNode(b'\x02\x7E\x00' + bytes(5)) # 其它请求的响应
+    async def flow(tp):
+        uds = AsyncUdsClient(tp, p2=0.05, margin=0.05)
+        start = time.perf_counter()
+        ok, resp = await uds.request([0x10, 0x03], "扩展会话")
+        assert not ok and resp == []
+        return time.perf_counter() - start
+    assert run(node, flow) < 0.2
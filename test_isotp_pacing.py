@@ -0,0 +1,113 @@
+# test_isotp_pacing.py
+#
+# 连续帧发送方式: STmin 允许时整块一次 Transmit，否则逐帧按 STmin 节拍 (StMinPacer) 发送。
+# 不需要设备:  python -m pytest test_isotp_pacing.py
+import time
+import pytest
+from isotp import StMinPacer, st_min_to_ns, ISOTP_ST_MIN_RESERVED_NS
+from test_isotp_segment import ReceiverNode, open_tp
+
+DATA = bytes(i & 0xFF for i in range(700)) # 1 FF + 100 CF
+
+
+@pytest.mark.parametrize("rx_bs, calls", [(0, 2), (8, 1 + 13), (64, 1 + 2)])
+def test_block_batching(rx_bs, calls):
+    node = ReceiverNode(rx_bs=rx_bs)
+    tp, close = open_tp(node)
+    assert tp.send(DATA)
+    assert node.payloads == [DATA]
+    stats = tp.last_tx_stats
+    assert stats.frames == 101
+    assert stats.calls == calls # FF + 每块一次 Transmit
+    assert stats.gap_avg_us is None
+    close()
+
+
+def test_batching_disabled():
+    node = ReceiverNode()
+    tp, close = open_tp(node, batch_st_min=None)
+    assert tp.send(DATA)
+    assert node.payloads == [DATA]
+    assert tp.last_tx_stats.calls == 101
+    close()
+
+
+def test_st_min_sends_frame_by_frame():
+    node = ReceiverNode(rx_st_min=0xF5) # 500us，大于批量发送阈值
+    tp, close = open_tp(node)
+    assert tp.send(DATA[:100])
+    assert node.payloads == [DATA[:100]]
+    assert tp.last_tx_stats.calls == tp.last_tx_stats.frames
+    close()
+
+
+@pytest.mark.parametrize("st_min, ns", [
+    (0x00, 0), (0x05, 5000000), (0x7F, 127000000),
+    (0xF1, 100000), (0xF9, 900000),
+    (0x80, ISOTP_ST_MIN_RESERVED_NS), (0xF0, ISOTP_ST_MIN_RESERVED_NS), (0xFA, ISOTP_ST_MIN_RESERVED_NS),
+])
+def test_st_min_to_ns(st_min, ns):
+    assert st_min_to_ns(st_min) == ns
+
+
+@pytest.mark.parametrize("rx_st_min, gap_us", [(0x02, 2000), (0xF8, 800)])
+def test_cf_gaps_respect_st_min(rx_st_min, gap_us):
+    node = ReceiverNode(rx_bs=4, rx_st_min=rx_st_min)
+    tp, close = open_tp(node)
+    assert tp.send(DATA[:200])
+    stats = tp.last_tx_stats
+    assert stats.calls == stats.frames
+    assert stats.gap_min_us >= gap_us
+    assert stats.gap_min_us <= stats.gap_avg_us <= stats.gap_max_us
+    # 总线时间戳 (us)，块内相邻 CF；每块第一帧收到流控后立即发送
+    stamps = node.cf_stamps
+    gaps = [stamps[k + 1] - stamps[k] for k in range(len(stamps) - 1) if (k + 1) % 4]
+    assert min(gaps) >= gap_us - 50
+    close()
+
+
+def test_pacer_blocks_and_reset():
+    pacer = StMinPacer()
+    pacer.start_block(1000000)
+    start = time.perf_counter_ns()
+    for _ in range(3):
+        pacer.wait()
+        pacer.sent()
+    assert time.perf_counter_ns() - start >= 2000000 # 块内第一帧立即发送
+    assert len(pacer.gaps_ns) == 2 and min(pacer.gaps_ns) >= 1000000
+    pacer.start_block(0)
+    pacer.wait()
+    pacer.sent()
+    assert len(pacer.gaps_ns) == 2 # 等流控的间隔不计入
+    low, avg, high = pacer.gap_stats_us()
+    assert 1000 <= low <= avg <= high
+    pacer.reset()
+    assert pacer.gap_stats_us() == (None, None, None)
+
+
+@pytest.mark.parametrize("rx_bs", [0, 8])
+def test_device_queue(rx_bs):
+    node = ReceiverNode(rx_bs=rx_bs, rx_st_min=0x01)
+    tp, close = open_tp(node, queue=True)
+    data = DATA[:300] # 1 FF + 42 CF
+    assert tp.send(data)
+    stats = tp.last_tx_stats
+    assert stats.calls < stats.frames # 按队列空闲数成批提交
+    assert stats.gap_avg_us is None
+    if rx_bs == 0:
+        assert tp.tx_pending_s() > 0 # send() 返回时队列里还有帧
+    assert node.payloads == [data]
+    stamps = node.cf_stamps
+    gaps = [stamps[k + 1] - stamps[k] for k in range(len(stamps) - 1) if rx_bs == 0 or (k + 1) % rx_bs]
+    assert min(gaps) >= 950 # 帧间隔由设备队列保证
+    time.sleep(tp.tx_pending_s() + 0.01)
+    assert tp.tx_pending_s() == 0.0
+    close()
+
+
+def test_device_queue_needs_whole_ms():
+    node = ReceiverNode(rx_st_min=0xF5)
+    tp, close = open_tp(node, queue=True)
+    assert tp.send(DATA[:100])
+    assert tp.last_tx_stats.calls == tp.last_tx_stats.frames # 500us 不能交给设备队列，逐帧发送
+    close()
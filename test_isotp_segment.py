@@ -0,0 +1,140 @@
+# test_isotp_segment.py
+#
+# IsoTpLayer.segment() 的分段结果逐帧送入 IsoTpReassembler，重组后应与原报文一致 (经典 CAN、CAN-FD)；
+# IsoTpLayer.send() 经虚拟总线发给接收节点。不需要设备:  python -m pytest test_isotp_segment.py
+import pytest
+from zlgcan import *
+from zcan_virtual import VirtualZCAN
+from zcan_dispatch import get_dispatcher
+from isotp import IsoTpLayer, IsoTpReassembler, ISOTP_FRAME_FF, ISOTP_FRAME_CF, ISOTP_FRAME_FC
+
+TX_ID = 0x7E0
+RX_ID = 0x7E8
+
+
+def reassemble(tp, data):
+    """分段后逐帧 feed，返回 (重组结果, 帧数, 首帧数据)"""
+    msgs, count = tp.segment(data)
+    rx = IsoTpReassembler()
+    frames = [bytes(msgs[i].frame.data[:tp.tx_dl]) for i in range(count)]
+    for i, frame in enumerate(frames):
+        assert msgs[i].frame.can_id == TX_ID
+        payload, fc, error = rx.feed(frame)
+        assert error is None
+        if i == 0:
+            assert fc is not None and fc[0] == ISOTP_FRAME_FC
+        if payload is not None:
+            assert i == count - 1
+            return payload, count, frames[0]
+    pytest.fail("报文没有收完")
+
+
+@pytest.mark.parametrize("fd, length", [
+    (False, 8), (False, 13), (False, 14), (False, 256), (False, 4095),
+    (True, 63), (True, 64), (True, 125), (True, 1000), (True, 4095),
+])
+def test_segment_roundtrip(fd, length):
+    tp = IsoTpLayer(None, 0, TX_ID, RX_ID, fd=fd)
+    data = bytes((i * 7 + 3) & 0xFF for i in range(length))
+    payload, count, ff = reassemble(tp, data)
+    assert payload == data
+    assert ff[0] == ISOTP_FRAME_FF | (length >> 8)
+    assert count == 1 + -(-(length - tp.ff_payload) // tp.cf_payload)
+
+
+@pytest.mark.parametrize("fd", [False, True])
+def test_segment_ff_dl_escape(fd):
+    tp = IsoTpLayer(None, 0, TX_ID, RX_ID, fd=fd)
+    data = bytes(i & 0xFF for i in range(5000))
+    payload, count, ff = reassemble(tp, data)
+    assert payload == data
+    assert ff[:2] == bytes((ISOTP_FRAME_FF, 0))
+    assert int.from_bytes(ff[2:6], "big") == len(data)
+
+
+@pytest.mark.parametrize("ff", [
+    bytes((ISOTP_FRAME_FF, 0, 0, 0, 0x0F, 0xFF, 0, 0)), # 转义只用于 > 4095 字节
+    bytes((ISOTP_FRAME_FF, 0, 0, 0, 0, 5, 0, 0)),
+    bytes((ISOTP_FRAME_FF, 0, 0, 0, 0x13)),             # 转义帧过短
+])
+def test_reassembler_rejects_bad_escape(ff):
+    payload, fc, error = IsoTpReassembler().feed(ff)
+    assert payload is None and fc is None and error
+
+
+def test_reassembler_escape_over_rx_max_len():
+    rx = IsoTpReassembler(rx_max_len=4096)
+    payload, fc, error = rx.feed(bytes((ISOTP_FRAME_FF, 0, 0, 0, 0x10, 0x01, 0, 0)))
+    assert payload is None and error
+    assert fc[0] == ISOTP_FRAME_FC | 2 # 溢出
+
+
+def test_segment_scatter_gather():
+    tp = IsoTpLayer(None, 0, TX_ID, RX_ID)
+    image = memoryview(bytes(i & 0xFF for i in range(3000)))
+    payload, _, _ = reassemble(tp, (b'\x36\x01', image[1000:2000]))
+    assert payload == b'\x36\x01' + bytes(image[1000:2000])
+
+
+def test_segment_sequence_numbers_wrap():
+    tp = IsoTpLayer(None, 0, TX_ID, RX_ID)
+    msgs, count = tp.segment(bytes(200))
+    sn = [msgs[i].frame.data[0] for i in range(1, count)]
+    assert sn == [ISOTP_FRAME_CF | (i & 0x0F) for i in range(1, count)]
+
+
+def test_segment_rejects_single_frame():
+    tp = IsoTpLayer(None, 0, TX_ID, RX_ID)
+    with pytest.raises(ValueError):
+        tp.segment(bytes(7))
+
+
+class ReceiverNode(object):
+    """虚拟总线上的 ISO-TP 接收节点: 回复流控 (BS/STmin)，记录收到的报文和每帧时间戳"""
+    def __init__(self, rx_bs=0, rx_st_min=0, fd=False):
+        self.rx = IsoTpReassembler(rx_bs=rx_bs, rx_st_min=rx_st_min)
+        self.fd = fd
+        self.payloads = []
+        self.cf_stamps = []
+
+    def __call__(self, bus, frame):
+        if frame.can_id != TX_ID:
+            return
+        if frame.data[0] & 0xF0 == ISOTP_FRAME_CF:
+            self.cf_stamps.append(frame.timestamp)
+        payload, fc, error = self.rx.feed(frame.data)
+        if fc is not None:
+            bus.send(RX_ID, fc.ljust(8, b'\x00'), is_fd=self.fd)
+        if payload is not None:
+            self.payloads.append(payload)
+
+
+def open_tp(node, fd=False, queue=False, **kwargs):
+    """queue=True 时通道开启队列发送模式，连续帧交给设备队列按 STmin 发送"""
+    backend = VirtualZCAN(bitrate=500000)
+    backend.bus.attach(node)
+    zcan = ZCAN(backend)
+    handle = zcan.OpenDevice(ZCAN_USBCANFD_200U, 0, 0)
+    chn = zcan.InitCAN(handle, 0, ZCAN_CHANNEL_INIT_CONFIG())
+    zcan.StartCAN(chn)
+    if queue:
+        zcan.set_tx_queue_mode(handle, 0)
+        kwargs["device_queue"] = (handle, 0)
+    dispatcher = get_dispatcher(zcan, chn, fd)
+    tp = IsoTpLayer(zcan, chn, TX_ID, RX_ID, fd=fd, dispatcher=dispatcher, **kwargs)
+    def close():
+        tp.close()
+        dispatcher.release()
+        zcan.CloseDevice(handle)
+    return tp, close
+
+
+@pytest.mark.parametrize("fd, rx_bs", [(False, 0), (False, 8), (True, 0), (True, 3)])
+def test_send_over_bus(fd, rx_bs):
+    node = ReceiverNode(rx_bs=rx_bs, fd=fd)
+    tp, close = open_tp(node, fd=fd)
+    data = bytes(i & 0xFF for i in range(1500))
+    assert tp.send(data)
+    assert tp.send(b'\x3E\x00') # 单帧
+    assert node.payloads == [data, b'\x3E\x00']
+    close()
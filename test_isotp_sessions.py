@@ -0,0 +1,70 @@
+# test_isotp_sessions.py
+#
+# IsoTpSessionManager: 功能寻址请求在多个仿真 ECU 上并行收集响应 (多帧响应、NRC 0x78、无响应的 ECU)。
+# 不需要设备:  python -m pytest test_isotp_sessions.py
+import time
+import pytest
+from zlgcan import *
+from zcan_virtual import VirtualZCAN
+from zcan_sim_ecu import SimBootloaderEcu
+from isotp_sessions import IsoTpSessionManager
+
+
+@pytest.fixture
+def bench():
+    """0x7E0~0x7E2 上各有一个仿真 ECU (0x7E1 有已安装的 App，0x7E2 在 Bootloader 中)，0x7E3 没有 ECU"""
+    backend = VirtualZCAN(bitrate=500000)
+    ecus = [SimBootloaderEcu(0x7E0, 0x7E8),
+            SimBootloaderEcu(0x7E1, 0x7E9, app_image=bytes(range(64))),
+            SimBootloaderEcu(0x7E2, 0x7EA, start_in_boot=True, erase_time=0.3)]
+    for ecu in ecus:
+        backend.bus.attach(ecu)
+    zcan = ZCAN(backend)
+    handle = zcan.OpenDevice(ZCAN_USBCANFD_200U, 0, 0)
+    chn = zcan.InitCAN(handle, 0, ZCAN_CHANNEL_INIT_CONFIG())
+    zcan.StartCAN(chn)
+    mgr = IsoTpSessionManager(zcan, chn)
+    for i in range(4):
+        mgr.add_session(0x7E0 + i, 0x7E8 + i)
+    yield mgr, ecus
+    mgr.close()
+    zcan.CloseDevice(handle)
+
+
+def test_functional_request_collects_all(bench):
+    mgr, ecus = bench
+    start = time.perf_counter()
+    resps = mgr.functional_request(b'\x22\xF1\xA0')
+    assert time.perf_counter() - start < 0.5 # 并行等待，不是逐个超时
+    assert sorted(resps) == [0x7E0, 0x7E1, 0x7E2] # 0x7E3 没有响应
+    assert resps[0x7E0] == b'\x7F\x22\x7F'
+    assert resps[0x7E1][:3] == b'\x62\xF1\xA0' and len(resps[0x7E1]) == 11 # 多帧响应，流控发往物理 ID
+    assert resps[0x7E2] == b'\x7F\x22\x11'
+    assert all(ecu.requests == [(ecu.state, 0x22)] for ecu in ecus)
+
+
+def test_functional_request_response_pending(bench):
+    mgr, ecus = bench
+    start = time.perf_counter()
+    resps = mgr.functional_request([0x31, 0x01, 0x02, 0x03], pending_timeout=1.0)
+    elapsed = time.perf_counter() - start
+    assert resps[0x7E0] == resps[0x7E1] == b'\x71\x01\x02\x03'
+    assert resps[0x7E2] == b'\x71\x01\x02\x03' # 先回 NRC 0x78，0.3s 后肯定响应
+    assert 0.25 < elapsed < 1.0
+
+
+def test_functional_request_single_frame_only(bench):
+    mgr, ecus = bench
+    with pytest.raises(ValueError):
+        mgr.functional_request(bytes(8))
+    assert mgr.functional_request(b'\x3E\x00', timeout=0.05) == {
+        0x7E0: b'\x7F\x3E\x7F', 0x7E1: b'\x7F\x3E\x7F', 0x7E2: b'\x7F\x3E\x11'}
+
+
+def test_run_parallel(bench):
+    mgr, ecus = bench
+    def read(tp):
+        tp.send(b'\x22\xF1\xA0')
+        return tp.recv(0.2)
+    results = mgr.run_parallel(read, tx_ids=[0x7E1, 0x7E3])
+    assert results[0x7E1][:3] == b'\x62\xF1\xA0' and results[0x7E3] is None
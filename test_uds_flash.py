@@ -0,0 +1,235 @@
+# test_uds_flash.py
+#
+# 刷写流程测试: 0x74 块长度协商；仿真 ECU (zcan_sim_ecu) 挂在虚拟总线上，测试等待 Bootloader 就绪 (探测)、
+# flash_ecu 的刷写/跳过/强制刷写，以及广播刷写 (含丢帧后的物理寻址重新下载)。
+# 不需要设备:  python -m pytest test_uds_flash.py
+import binascii
+import time
+import pytest
+from zlgcan import *
+from zcan_virtual import VirtualZCAN, VirtualBus
+from zcan_dispatch import get_dispatcher
+from zcan_sim_ecu import SimBootloaderEcu
+from isotp import IsoTpLayer
+from uds_broadcast import BroadcastFlasher
+from uds_IAP import (UdsClient, ECU_TIMING_PROFILES, MAX_BLOCK_SIZE, open_uds_channel, wait_bootloader, flash_ecu,
+                     parse_max_block_length, negotiate_block_size)
+
+TIMING = ECU_TIMING_PROFILES["default"]
+FW_DATA = bytes((i * 31 + 7) & 0xFF for i in range(3000))
+FW_CRC = binascii.crc32(FW_DATA) & 0xFFFFFFFF
+FLEET = [(0x7E0 + i, 0x7E8 + i) for i in range(4)]
+
+
+# --- 0x74 块长度协商 ----------------------------------------------------------
+@pytest.mark.parametrize("resp, expected", [
+    ([0x74, 0x20, 0x0F, 0xFE], 4094),
+    ([0x74, 0x10, 0x82], 0x82),
+    ([0x74, 0x40, 0x00, 0x01, 0x00, 0x02], 0x10002),
+    ([0x74, 0x20, 0x0F], None),      # 长度不够
+    ([0x74, 0x00], None),            # 没有长度字节
+    ([0x74, 0x90] + [0] * 9, None),  # 超过 8 字节
+    ([0x7F, 0x34, 0x22], None),
+    ([], None),
+])
+def test_parse_max_block_length(resp, expected):
+    assert parse_max_block_length(resp) == expected
+
+
+@pytest.mark.parametrize("resp, override, expected", [
+    ([0x74, 0x20, 0x0F, 0xFE], None, 4092),       # 4094 - 2
+    ([0x74, 0x20, 0x01, 0x03], None, 256),        # 259 - 2 = 257 向下对齐到 4
+    ([0x74, 0x40, 0x7F, 0xFF, 0xFF, 0xFF], None, 1024 * 1024),  # 受 cap 限制
+    ([0x74, 0x10, 0x02], None, MAX_BLOCK_SIZE),   # 0 字节数据无效
+    ([0x74, 0x20, 0x0F], None, MAX_BLOCK_SIZE),   # 格式不对
+    ([0x74, 0x20, 0x0F, 0xFE], 1001, 1000),       # override 同样对齐
+])
+def test_negotiate_block_size(resp, override, expected):
+    assert negotiate_block_size(resp, override) == expected
+
+
+# --- 虚拟总线上的仿真 ECU -------------------------------------------------------
+class Bench(object):
+    """虚拟总线 + 打开的通道 + 分发器"""
+    def __init__(self, ecus):
+        self.bus = VirtualBus(latency=0.0002, bitrate=500000)
+        for ecu in ecus:
+            self.bus.attach(ecu)
+        self.zcan = ZCAN(VirtualZCAN(latency=0.0002, bitrate=500000, bus=self.bus))
+        self.handle = self.zcan.OpenDevice(ZCAN_USBCAN1, 0, 0)
+        self.chn, self.device_queue = open_uds_channel(self.zcan, self.handle, 0, [ecu.tx_id for ecu in ecus],
+                                                       fd=False)
+        self.dispatcher = get_dispatcher(self.zcan, self.chn)
+
+    def close(self):
+        self.dispatcher.release()
+        self.zcan.CloseDevice(self.handle)
+
+
+def wait_app(ecus, timeout=2.0):
+    """37 校验通过后 ECU 复位回到 App"""
+    deadline = time.time() + timeout
+    while any(ecu.state != "app" for ecu in ecus):
+        assert time.time() < deadline, "ECU 没有回到 App"
+        time.sleep(0.01)
+
+
+def count(ecu, state, sid):
+    return ecu.requests.count((state, sid))
+
+
+def open_uds(ecu):
+    bench = Bench([ecu])
+    tp = IsoTpLayer(bench.zcan, bench.chn, ecu.rx_id, ecu.tx_id, dispatcher=bench.dispatcher)
+    def close():
+        tp.close()
+        bench.close()
+    return UdsClient(tp), close
+
+
+class StartingBootloader(object):
+    """Bootloader 启动过程中对 10 02 立即回复 NRC 0x22，busy_s 秒后回复 50 02"""
+    def __init__(self, busy_s):
+        self.rx_id = 0x7E0
+        self.tx_id = 0x7E8
+        self.ready_at = time.time() + busy_s
+        self.probes = 0
+
+    def __call__(self, bus, frame):
+        if frame.can_id != self.rx_id or bytes(frame.data[:3]) != b'\x02\x10\x02':
+            return
+        self.probes += 1
+        if time.time() < self.ready_at:
+            bus.send(self.tx_id, b'\x03\x7F\x10\x22' + bytes(4))
+        else:
+            bus.send(self.tx_id, b'\x06\x50\x02\x00\x32\x01\xF4\x00')
+
+
+# --- 等待 Bootloader 就绪 -------------------------------------------------------
+def test_default_profile_probes_readiness():
+    assert TIMING.await_reset and TIMING.reset_delay < ECU_TIMING_PROFILES["legacy"].reset_delay
+
+
+def test_wait_bootloader_after_reset_latency():
+    # App 回复 50 02 后 0.1s 内照常响应，之后复位 0.1s 进入 Bootloader
+    ecu = SimBootloaderEcu(0x7E0, 0x7E8, boot_delay=0.1, reset_latency=0.1)
+    uds, close = open_uds(ecu)
+    ok, _ = uds.request([0x10, 0x02], "进入编程会话")
+    assert ok
+    start = time.time()
+    assert wait_bootloader(uds, TIMING, jumped=True)
+    assert time.time() - start < 0.5
+    assert ecu.state == "boot" and count(ecu, "boot", 0x10) == 1
+    assert count(ecu, "app", 0x10) <= 1 + 3 # App 复位前的探测按 probe_interval 间隔
+    close()
+
+
+def test_wait_bootloader_paces_negative_responses():
+    node = StartingBootloader(0.2)
+    uds, close = open_uds(node)
+    assert wait_bootloader(uds, TIMING, jumped=False)
+    assert node.probes <= 0.2 / TIMING.probe_interval + 2 # 否定响应之后不连续探测
+    close()
+
+
+def test_wait_bootloader_timeout():
+    node = StartingBootloader(10.0)
+    uds, close = open_uds(node)
+    timing = TIMING._replace(boot_timeout=0.2)
+    assert not wait_bootloader(uds, timing, jumped=False)
+    assert node.probes <= 0.2 / timing.probe_interval + 1
+    close()
+
+
+# --- flash_ecu: 刷写 / 相同固件跳过 / 强制刷写 -------------------------------------
+@pytest.fixture
+def single():
+    ecu = SimBootloaderEcu(0x7E0, 0x7E8, boot_delay=0.05, erase_time=0.02, max_block_length=1026,
+                           app_image=b'\x00' * 16)
+    bench = Bench([ecu])
+    tp = IsoTpLayer(bench.zcan, bench.chn, 0x7E0, 0x7E8, dispatcher=bench.dispatcher)
+    yield ecu, UdsClient(tp)
+    tp.close()
+    bench.close()
+
+
+def test_flash_ecu_flash_skip_force(single):
+    ecu, uds = single
+    assert flash_ecu(uds, FW_DATA, FW_CRC, TIMING) is True
+    assert ecu.app_image == FW_DATA
+    assert count(ecu, "boot", 0x36) == 3 # 1024 字节一块
+    wait_app([ecu])
+
+    # 已是相同固件: 只读指纹，不进入 Bootloader
+    ecu.requests.clear()
+    assert flash_ecu(uds, FW_DATA, FW_CRC, TIMING) is False
+    assert [sid for _, sid in ecu.requests] == [0x22]
+
+    ecu.requests.clear()
+    assert flash_ecu(uds, FW_DATA, FW_CRC, TIMING, force=True) is True
+    assert count(ecu, "app", 0x22) == 0
+    assert count(ecu, "boot", 0x37) == 1
+    wait_app([ecu])
+
+
+def test_flash_ecu_without_fingerprint(single):
+    ecu, uds = single
+    ecu.app_image = None # App 不支持 22 F1 A0
+    assert flash_ecu(uds, FW_DATA, FW_CRC, TIMING, block_size=512) is True
+    assert ecu.app_image == FW_DATA
+    assert count(ecu, "boot", 0x36) == 6
+    wait_app([ecu])
+
+
+# --- 广播刷写 -------------------------------------------------------------------
+def run_broadcast(ecus, retries=1):
+    bench = Bench(ecus)
+    flasher = BroadcastFlasher(bench.zcan, bench.chn, FLEET, dispatcher=bench.dispatcher,
+                               device_queue=bench.device_queue, fd=False, timing=TIMING, retries=retries)
+    try:
+        return flasher.run(FW_DATA, FW_CRC)
+    finally:
+        flasher.close()
+        bench.close()
+
+
+def make_fleet(drop=None, **kwargs):
+    return [SimBootloaderEcu(tx_id, rx_id, broadcast_id=0x7F0, boot_delay=0.05, erase_time=0.02,
+                             drop_broadcast_cf=(drop if i == 2 else None), **kwargs)
+            for i, (tx_id, rx_id) in enumerate(FLEET)]
+
+
+def test_broadcast_all_ok():
+    ecus = make_fleet()
+    jobs = run_broadcast(ecus)
+    assert [job.state for job in jobs] == ["ok"] * 4
+    assert all(ecu.app_image == FW_DATA for ecu in ecus)
+    assert all(count(ecu, "boot", 0x36) == 0 for ecu in ecus)
+    assert [ecu.leader for ecu in ecus] == [True, False, False, False]
+
+
+def test_broadcast_drop_cf_retry():
+    ecus = make_fleet(drop=50)
+    jobs = run_broadcast(ecus, retries=1)
+    assert [job.state for job in jobs] == ["ok"] * 4
+    assert ecus[2].app_image == FW_DATA
+    assert count(ecus[2], "boot", 0x36) > 0 # 物理寻址重新下载
+    assert all(count(ecu, "boot", 0x36) == 0 for i, ecu in enumerate(ecus) if i != 2)
+
+
+def test_broadcast_drop_cf_no_retry():
+    ecus = make_fleet(drop=50)
+    jobs = run_broadcast(ecus, retries=0)
+    assert [job.state for job in jobs] == ["ok", "ok", "failed", "ok"]
+    assert jobs[2].error == "CRC 校验失败"
+
+
+def test_broadcast_leader_skipped():
+    # 首选 leader 已是相同固件，从其余就绪的 ECU 中选 leader，不占重新下载次数
+    ecus = make_fleet(app_image=b'\x00' * 16)
+    ecus[0].app_image = FW_DATA
+    jobs = run_broadcast(ecus, retries=0)
+    assert [job.state for job in jobs] == ["skipped", "ok", "ok", "ok"]
+    assert ecus[1].leader
+    assert all(count(ecu, "broadcast", 0x36) > 0 for ecu in ecus[1:])
+    assert all(ecu.app_image == FW_DATA for ecu in ecus)
@@ -0,0 +1,142 @@
+# test_zcan_cyclic.py
+#
+# CyclicSender: 设备定时发送条目的分配/复用、逐条退回主机侧、主机侧周期调度。
+# 不需要设备:  python -m pytest test_zcan_cyclic.py
+import time
+from zlgcan import *
+from zcan_virtual import VirtualZCAN
+from zcan_cyclic import CyclicSender, AUTO_TRANSMIT_MAX
+
+
+class AutoSendZCAN(object):
+    """带设备定时发送的假 ZCAN: 记录条目，fail_ids 中的报文设置失败"""
+    def __init__(self, fail_ids=(), fail_cancel=False):
+        self.entries = {}
+        self.fail_ids = set(fail_ids)
+        self.fail_cancel = fail_cancel
+        self.cleared = 0
+
+    def set_auto_transmit(self, device_handle, chn_index, index, can_id, payload, period_ms, eff=0, is_fd=False):
+        if can_id in self.fail_ids:
+            return ZCAN_STATUS_ERR
+        self.entries[index] = (can_id, bytes(payload), period_ms)
+        return ZCAN_STATUS_OK
+
+    def apply_auto_transmit(self, device_handle, chn_index):
+        return ZCAN_STATUS_OK
+
+    def cancel_auto_transmit(self, device_handle, chn_index, index, is_fd=False):
+        if self.fail_cancel:
+            return ZCAN_STATUS_ERR
+        self.entries.pop(index, None)
+        return ZCAN_STATUS_OK
+
+    def clear_auto_transmit(self, device_handle, chn_index):
+        self.entries.clear()
+        self.cleared += 1
+        return ZCAN_STATUS_OK
+
+    def transmit_many(self, chn_handle, frames, eff=0, transmit_type=0):
+        return len(frames)
+
+    transmit_many_fd = transmit_many
+
+
+def open_pair():
+    zcan = ZCAN(VirtualZCAN())
+    handle = zcan.OpenDevice(ZCAN_USBCANFD_200U, 0, 0)
+    chns = [zcan.InitCAN(handle, i, ZCAN_CHANNEL_INIT_CONFIG()) for i in range(2)]
+    for chn in chns:
+        zcan.StartCAN(chn)
+    return zcan, handle, chns
+
+
+def collect(zcan, chn, duration):
+    frames = []
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        msgs, count = zcan.receive_wait(chn, end - time.perf_counter())
+        frames += [(msgs[i].frame.can_id, bytes(msgs[i].frame.data[:msgs[i].frame.can_dlc]), msgs[i].timestamp)
+                   for i in range(count)]
+    return frames
+
+
+def test_device_slots_reused():
+    zcan = AutoSendZCAN()
+    sender = CyclicSender(zcan, 1, 0, 2)
+    for _ in range(AUTO_TRANSMIT_MAX * 2):
+        index = sender.add(0x7DF, b'\x02\x3E\x80', 1.0)
+        assert sender.is_on_device(index)
+        sender.cancel(index)
+    assert zcan.entries == {}
+    indexes = [sender.add(0x100 + i, b'\x00', 0.1) for i in range(3)]
+    assert sorted(zcan.entries) == [0, 1, 2]
+    sender.cancel(indexes[1])
+    sender.add(0x200, b'\x01', 0.1)
+    assert zcan.entries[1][0] == 0x200 # 复用释放的条目号
+    sender.stop()
+    assert zcan.cleared == 1 and sender._thread is None
+
+
+def test_fallback_per_message():
+    zcan = AutoSendZCAN(fail_ids=(0x100,))
+    sender = CyclicSender(zcan, 1, 0, 2)
+    first = sender.add(0x100, b'\x00', 0.05)
+    second = sender.add(0x101, b'\x00', 0.05)
+    assert not sender.is_on_device(first) # 只有失败的这一条退回主机侧
+    assert sender.is_on_device(second)
+    assert zcan.entries == {0: (0x101, b'\x00', 50)} # 条目号留给之后的报文
+    sender.stop()
+
+
+def test_slots_exhausted_fall_back_to_host():
+    zcan = AutoSendZCAN()
+    sender = CyclicSender(zcan, 1, 0, 2)
+    indexes = [sender.add(0x100 + i, b'\x00', 1.0) for i in range(AUTO_TRANSMIT_MAX + 1)]
+    assert all(sender.is_on_device(i) for i in indexes[:-1])
+    assert not sender.is_on_device(indexes[-1])
+    sender.stop()
+
+
+def test_update_on_device_and_fallback():
+    zcan = AutoSendZCAN()
+    sender = CyclicSender(zcan, 1, 0, 2)
+    index = sender.add(0x100, b'\x00', 1.0)
+    slot = sender._msgs[index].slot
+    assert sender.update(index, payload=b'\x01', period_s=0.5)
+    assert zcan.entries[slot] == (0x100, b'\x01', 500)
+    zcan.fail_ids.add(0x100)
+    assert sender.update(index, payload=b'\x02') # 设备更新失败，改由主机发送
+    assert not sender.is_on_device(index) and slot not in zcan.entries
+    sender.stop()
+
+
+def test_update_reports_stuck_device_entry():
+    zcan = AutoSendZCAN()
+    sender = CyclicSender(zcan, 1, 0, 2)
+    index = sender.add(0x100, b'\x00', 1.0)
+    zcan.fail_ids.add(0x100)
+    zcan.fail_cancel = True
+    assert sender.update(index, payload=b'\x01') is False
+    sender.stop()
+
+
+def test_host_schedule_period_and_update():
+    zcan, handle, (a, b) = open_pair() # 虚拟后端不支持 auto_send
+    sender = CyclicSender(zcan, handle, 0, a)
+    index = sender.add(0x7DF, b'\x02\x3E\x80', 0.02)
+    assert not sender.is_on_device(index)
+    frames = collect(zcan, b, 0.21)
+    assert 9 <= len(frames) <= 12
+    gaps = [(t1 - t0) / 1000.0 for (_, _, t0), (_, _, t1) in zip(frames, frames[1:])]
+    assert all(15.0 < gap < 25.0 for gap in gaps)
+
+    sender.update(index, payload=b'\x01')
+    frames = collect(zcan, b, 0.1)
+    assert frames and frames[-1][1] == b'\x01'
+
+    sender.cancel(index)
+    collect(zcan, b, 0.03)
+    assert collect(zcan, b, 0.1) == []
+    sender.stop()
+    zcan.CloseDevice(handle)
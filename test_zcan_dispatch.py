@@ -0,0 +1,122 @@
+# test_zcan_dispatch.py
+#
+# RxDispatcher: 按 ID/范围分发给多个订阅者、回调出错隔离、队列溢出、引用计数。
+# 不需要设备:  python -m pytest test_zcan_dispatch.py
+import threading
+import pytest
+from zlgcan import *
+from zcan_virtual import VirtualZCAN
+from zcan_dispatch import get_dispatcher, RANGE_EXPAND_MAX
+
+
+@pytest.fixture
+def channels():
+    zcan = ZCAN(VirtualZCAN())
+    handle = zcan.OpenDevice(ZCAN_USBCANFD_200U, 0, 0)
+    chns = [zcan.InitCAN(handle, i, ZCAN_CHANNEL_INIT_CONFIG()) for i in range(2)]
+    for chn in chns:
+        zcan.StartCAN(chn)
+    yield zcan, chns[0], chns[1]
+    zcan.CloseDevice(handle)
+
+
+def drain(sub, timeout=0.2):
+    ids = []
+    while True:
+        msg = sub.get(timeout)
+        if msg is None:
+            return ids
+        ids.append(msg.frame.can_id)
+        timeout = 0.05
+
+
+def test_fan_out(channels):
+    zcan, tx, rx = channels
+    dispatcher = get_dispatcher(zcan, rx)
+    a = dispatcher.subscribe(ids=[0x7E8])
+    b = dispatcher.subscribe(ids=[0x7E8, 0x7E9])
+    c = dispatcher.subscribe(ranges=[(0x100, 0x1FF)])
+    big = dispatcher.subscribe(ranges=[(0x10000, 0x10000 + RANGE_EXPAND_MAX * 2)])
+    monitor = dispatcher.subscribe()
+    zcan.transmit_many(tx, [(0x7E8, b'\x01'), (0x7E9, b'\x02'), (0x150, b'\x03'), (0x300, b'\x04')])
+    zcan.transmit_many(tx, [(0x10005, b'\x05')], eff=1)
+    assert drain(a) == [0x7E8]
+    assert drain(b) == [0x7E8, 0x7E9]
+    assert drain(c) == [0x150]
+    assert drain(big) == [0x10005]
+    assert drain(monitor) == [0x7E8, 0x7E9, 0x150, 0x300, 0x10005]
+    dispatcher.release()
+
+
+def test_unsubscribe_and_copies(channels):
+    zcan, tx, rx = channels
+    dispatcher = get_dispatcher(zcan, rx)
+    a = dispatcher.subscribe(ids=[0x100])
+    b = dispatcher.subscribe(ids=[0x100])
+    zcan.transmit_many(tx, [(0x100, b'\x11')])
+    msg = a.get(0.5)
+    zcan.transmit_many(tx, [(0x100, b'\x22')] * 100) # 覆盖接收缓冲区
+    assert msg.frame.data[0] == 0x11 # 订阅者拿到的是副本
+    assert len(drain(a)) == 100
+    b.close()
+    zcan.transmit_many(tx, [(0x100, b'\x33')])
+    assert a.get(0.5).frame.data[0] == 0x33
+    rest = b.get_many(200, 0.05)
+    assert len(rest) == 101 and rest[-1].frame.data[0] == 0x22 # 取消订阅后不再收到
+    dispatcher.release()
+
+
+def test_queue_overflow_drops_oldest(channels):
+    zcan, tx, rx = channels
+    dispatcher = get_dispatcher(zcan, rx)
+    sub = dispatcher.subscribe(ids=[0x100], maxsize=4)
+    zcan.transmit_many(tx, [(0x100, bytes((i,))) for i in range(10)])
+    while sub.dropped < 6:
+        threading.Event().wait(0.01)
+    assert [msg.frame.data[0] for msg in sub.get_many(10, 0.1)] == [6, 7, 8, 9]
+    dispatcher.release()
+
+
+def test_callback_error_isolated(channels):
+    zcan, tx, rx = channels
+    dispatcher = get_dispatcher(zcan, rx)
+    got = []
+    def broken(msg):
+        raise RuntimeError("boom")
+    bad = dispatcher.subscribe(ids=[0x100], callback=broken)
+    dispatcher.subscribe(ids=[0x100], callback=lambda msg: got.append(msg.frame.data[0]))
+    queue = dispatcher.subscribe(ids=[0x100])
+    zcan.transmit_many(tx, [(0x100, b'\x01'), (0x100, b'\x02')])
+    assert drain(queue) == [0x100, 0x100]
+    assert got == [1, 2]
+    assert bad.errors == 2
+    dispatcher.release()
+
+
+def test_shared_and_fd_mismatch(channels):
+    zcan, tx, rx = channels
+    first = get_dispatcher(zcan, rx)
+    assert get_dispatcher(zcan, rx) is first
+    with pytest.raises(ValueError):
+        get_dispatcher(zcan, rx, fd=True)
+    first.release()
+    first.release()
+
+
+def test_release_keeps_other_users(channels):
+    zcan, tx, rx = channels
+    monitor = get_dispatcher(zcan, rx)  # 例如监视界面
+    mon_sub = monitor.subscribe()
+    flash = get_dispatcher(zcan, rx)    # 刷写任务
+    flash_sub = flash.subscribe(ids=[0x7E8])
+    flash_sub.close()
+    flash.release()                     # 刷写结束
+    zcan.transmit_many(tx, [(0x123, b'\x00')])
+    assert drain(mon_sub) == [0x123]    # 监视照常接收
+    assert get_dispatcher(zcan, rx) is monitor
+    monitor.release()
+    monitor.release()
+    assert not monitor._threads
+    assert get_dispatcher(zcan, rx) is not monitor # 全部释放后重新创建
+    get_dispatcher(zcan, rx).release()
+    get_dispatcher(zcan, rx).release()
@@ -0,0 +1,33 @@
+# test_zcan_log.py
+#
+# setup_logging: 默认不开启事件缓冲区，DEBUG 不生成 LogRecord；开启时缓冲区保留事件、失败时 dump。
+# 不需要设备:  python -m pytest test_zcan_log.py
+import io
+import logging
+import pytest
+from zcan_log import setup_logging, hexdump
+
+
+@pytest.fixture
+def root():
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield root
+    root.handlers[:] = handlers
+    root.setLevel(level)
+
+
+def test_default_keeps_debug_disabled(root):
+    assert setup_logging(logging.INFO) is None
+    assert not logging.getLogger("isotp").isEnabledFor(logging.DEBUG)
+
+
+def test_event_buffer(root):
+    events = setup_logging(logging.INFO, event_buffer=3)
+    log = logging.getLogger("isotp")
+    for i in range(5):
+        log.debug("帧 %d: %s", i, hexdump(bytes((i,)) * 2))
+    assert [args[0] for _, _, _, _, args in events.events()] == [2, 3, 4]
+    out = io.StringIO()
+    events.dump(out)
+    assert "帧 4: 04 04" in out.getvalue()
@@ -0,0 +1,146 @@
+# test_zcan_virtual.py
+#
+# 虚拟后端 (zcan_virtual): 通道间收发、仿真节点、范围滤波、队列发送模拟、后端选择。
+# 不需要设备:  python -m pytest test_zcan_virtual.py
+import time
+import pytest
+from zlgcan import *
+from zcan_virtual import VirtualZCAN, VirtualBus, VIRTUAL_TX_QUEUE_SIZE
+
+
+def open_channels(backend, count=2):
+    zcan = ZCAN(backend)
+    handle = zcan.OpenDevice(ZCAN_USBCANFD_200U, 0, 0)
+    chns = []
+    for i in range(count):
+        chn = zcan.InitCAN(handle, i, ZCAN_CHANNEL_INIT_CONFIG())
+        zcan.StartCAN(chn)
+        chns.append(chn)
+    return zcan, handle, chns
+
+
+def received(zcan, chn, wait_ms=0):
+    msgs, count = zcan.Receive(chn, 16, wait_ms)
+    return [(msgs[i].frame.can_id, bytes(msgs[i].frame.data[:msgs[i].frame.can_dlc])) for i in range(count)]
+
+
+def test_loopback_between_channels():
+    zcan, handle, (a, b) = open_channels(VirtualZCAN())
+    assert zcan.transmit_many(a, [(0x123, b'\x01\x02'), (0x124, b'\x03')]) == 2
+    assert received(zcan, b) == [(0x123, b'\x01\x02'), (0x124, b'\x03')]
+    assert received(zcan, a) == [] # 发送通道自己不回环
+    zcan.CloseDevice(handle)
+
+
+def test_canfd_frames():
+    zcan, handle, (a, b) = open_channels(VirtualZCAN())
+    payload = bytes(range(64))
+    assert zcan.transmit_many_fd(a, [(0x7E0, payload)]) == 1
+    msgs, count = zcan.ReceiveFD(b, 4, 0)
+    assert count == 1
+    assert msgs[0].frame.len == 64 and bytes(msgs[0].frame.data) == payload
+    assert zcan.GetReceiveNum(b, ZCAN_TYPE_CAN) == 0 # CAN 与 CAN-FD 分开缓存
+    zcan.CloseDevice(handle)
+
+
+def test_latency_and_blocking_receive():
+    zcan, handle, (a, b) = open_channels(VirtualZCAN(latency=0.05))
+    zcan.transmit_many(a, [(0x100, b'\xAA')])
+    assert zcan.GetReceiveNum(b, ZCAN_TYPE_CAN) == 0
+    start = time.perf_counter()
+    msgs, count = zcan.receive_wait(b, 1.0)
+    assert count == 1
+    assert 0.03 < time.perf_counter() - start < 0.5
+    msgs, count = zcan.receive_wait(b, 0.02)
+    assert count == 0 # 超时
+    zcan.CloseDevice(handle)
+
+
+def test_attached_node_replies():
+    backend = VirtualZCAN()
+    seen = []
+    def node(bus, frame):
+        seen.append(frame.can_id)
+        if frame.can_id == 0x7E0:
+            bus.send(0x7E8, frame.data[::-1])
+    backend.bus.attach(node)
+    zcan, handle, (a,) = open_channels(backend, 1)
+    zcan.transmit_many(a, [(0x7E0, b'\x01\x02\x03')])
+    assert received(zcan, a, 100) == [(0x7E8, b'\x03\x02\x01')]
+    assert seen == [0x7E0, 0x7E8]
+    zcan.CloseDevice(handle)
+
+
+def test_separate_buses():
+    bus = VirtualBus()
+    backend = VirtualZCAN()
+    backend.connect(0, 1, bus) # 通道 1 在另一条总线上
+    zcan, handle, (a, b) = open_channels(backend)
+    zcan.transmit_many(a, [(0x100, b'\x00')])
+    assert received(zcan, b) == []
+    zcan.CloseDevice(handle)
+
+
+def test_range_filter_after_ack():
+    backend = VirtualZCAN()
+    zcan, handle, (a, b) = open_channels(backend)
+    path = "1/filter_%s"
+    zcan.ZCAN_SetValue(handle, path % "clear", "0")
+    zcan.ZCAN_SetValue(handle, path % "mode", "0")
+    zcan.ZCAN_SetValue(handle, path % "start", "0x7E8")
+    zcan.ZCAN_SetValue(handle, path % "end", "0x7EF")
+    zcan.transmit_many(a, [(0x100, b'\x01')])
+    assert received(zcan, b) == [(0x100, b'\x01')] # filter_ack 之前不生效
+    zcan.ZCAN_SetValue(handle, path % "ack", "0")
+    zcan.transmit_many(a, [(0x100, b'\x02'), (0x7E9, b'\x03'), (0x7F0, b'\x04')])
+    assert received(zcan, b) == [(0x7E9, b'\x03')]
+    zcan.ZCAN_SetValue(handle, path % "clear", "0")
+    zcan.ZCAN_SetValue(handle, path % "ack", "0")
+    zcan.transmit_many(a, [(0x100, b'\x05')])
+    assert received(zcan, b) == [(0x100, b'\x05')]
+    zcan.CloseDevice(handle)
+
+
+def test_auto_send_unsupported():
+    zcan, handle, (a, b) = open_channels(VirtualZCAN())
+    assert zcan.set_auto_transmit(handle, 0, 0, 0x100, b'\x00', 10) != ZCAN_STATUS_OK
+    zcan.CloseDevice(handle)
+
+
+def test_tx_queue_spacing():
+    zcan, handle, (a, b) = open_channels(VirtualZCAN())
+    assert zcan.set_tx_queue_mode(handle, 0) == ZCAN_STATUS_OK
+    assert zcan.tx_queue_status(handle, 0) == (0, VIRTUAL_TX_QUEUE_SIZE)
+    msgs = build_transmit_data([(0x100, bytes((i,))) for i in range(5)])
+    set_tx_delay(msgs, 10)
+    assert zcan.Transmit(a, msgs, len(msgs)) == 5
+    queued, free = zcan.tx_queue_status(handle, 0)
+    assert queued >= 4 and queued + free == VIRTUAL_TX_QUEUE_SIZE
+    stamps = []
+    deadline = time.time() + 1.0
+    while len(stamps) < 5 and time.time() < deadline:
+        out, count = zcan.receive_wait(b, 0.1)
+        stamps += [out[i].timestamp for i in range(count)]
+    assert len(stamps) == 5
+    gaps = [(t1 - t0) / 1000.0 for t0, t1 in zip(stamps, stamps[1:])]
+    assert all(9.0 <= gap <= 11.0 for gap in gaps) # 时间戳为 us，帧间隔 10 ms
+    zcan.CloseDevice(handle)
+
+
+def test_tx_queue_full():
+    zcan, handle, (a, b) = open_channels(VirtualZCAN())
+    zcan.set_tx_queue_mode(handle, 0)
+    msgs = build_transmit_data([(0x100, b'\x00')] * (VIRTUAL_TX_QUEUE_SIZE + 10))
+    set_tx_delay(msgs, 100)
+    # 第一帧立即发出，不占队列
+    assert VIRTUAL_TX_QUEUE_SIZE <= zcan.Transmit(a, msgs, len(msgs)) <= VIRTUAL_TX_QUEUE_SIZE + 1
+    assert zcan.tx_queue_free(handle, 0) == 0
+    zcan.CloseDevice(handle)
+
+
+def test_backend_selection(monkeypatch):
+    monkeypatch.setenv("ZCAN_BACKEND", "virtual")
+    assert isinstance(ZCAN().backend, VirtualZCAN)
+    assert isinstance(ZCAN("virtual").backend, VirtualZCAN)
+    with pytest.raises(ValueError):
+        ZCAN("zlgcan")
@@ -1,10 +1,17 @@
 # uds_flasher_final.py
+import argparse
+import logging
 import time
 import struct
 import binascii
 import os
+from collections import namedtuple
 from zlgcan import * 
-from isotp import IsoTpLayer 
+from isotp import IsoTpLayer, as_buffers
+from zcan_dispatch import get_dispatcher
+from zcan_log import setup_logging, hexdump, EVENT_BUFFER_SIZE
+
+log = logging.getLogger("uds")
 
 # ==============================================================================
 # 1. 全局配置 
@@ -19,209 +26,457 @@ RX_ID = 0x7E8
 
 FIRMWARE_FILE = "Application.bin"
 
+# CAN-FD 配置 (需 USBCANFD 类设备，MCU 端 ISO-TP 也需按 TX_DL=64 实现)
+CAN_FD = False
+CANFD_ABIT_BAUD = "1000000" # 仲裁域波特率
+CANFD_DBIT_BAUD = "5000000" # 数据域波特率 (BRS)
+CANFD_TX_DL = 64
+
+# 设备队列发送: MCU 要求整毫秒 STmin 时由适配器固件按帧间隔发送 CF (设备不支持时自动退回主机计时)
+# 目前只在虚拟后端验证过，在实际设备上验证之前默认关闭
+DEVICE_TX_QUEUE = False
+
 # 块大小配置
+# 每块数据长度按 0x74 肯定响应中的 maxNumberOfBlockLength 协商 (见 negotiate_block_size)，
+# 下面的 MAX_BLOCK_SIZE 只在 ECU 没有给出有效值时使用:
 # MCU 定义缓冲区为 4096 (ISOTP_MAX_BUF_SIZE)
 # 减去 2 字节协议头 (SID + BlockSeq) = 4094
 # 为了 Flash 写入对齐 (4字节)，我们使用 4092
 MAX_BLOCK_SIZE = 4092 
+BLOCK_SIZE_OVERRIDE = None # 强制使用的块数据长度 (字节)，None 时按 ECU 协商
+BLOCK_SIZE_CAP = 1024 * 1024 # 协商结果的上限，防止 ECU 回复异常值 (ISO-TP 层支持 32 位 FF_DL)
+BLOCK_ALIGN = 4 # 块数据长度对齐 (配合 MCU 的 Flash 写入粒度)
+
+# ECU 时间参数 (秒): 流程中不再固定延时，以探测 ECU 是否就绪为准，剩余的等待按 ECU 配置
+#   reset_delay:    App 回复 10 02 后到第一次探测 Bootloader 的时间
+#   boot_timeout:   等待 Bootloader 就绪的最长时间
+#   probe_interval: 每次探测 (10 02) 等待响应的时间，也是探测间隔
+#   step_delay:     App 阶段相邻请求之间的延时
+#   block_delay:    相邻 TransferData 块之间的延时 (收到 0x76 即可发下一块的 ECU 为 0)
+#   await_reset:    True 时先等到 App 停止响应 (探测没有响应或回复 7F)，之后的 50 02 才算 Bootloader 就绪。
+#                   App 同样会回复 10 02，reset_delay 短于 App 实际复位所需时间时必须打开
+#                   (Bootloader 必须在 reset_delay + probe_interval 之后才启动完成，否则等不到复位)
+# default 以探测为准: 跳转后很快开始探测，Bootloader 一就绪就继续；
+# legacy 保留原来跳转后固定等待 2 秒的做法，只用于探测时序有问题的 ECU
+EcuTiming = namedtuple("EcuTiming", "reset_delay boot_timeout probe_interval step_delay block_delay await_reset")
+ECU_TIMING_PROFILES = {
+    "default":   EcuTiming(reset_delay=0.02, boot_timeout=5.0, probe_interval=0.05, step_delay=0.0, block_delay=0.0,
+                           await_reset=True),
+    "slow_boot": EcuTiming(reset_delay=0.1, boot_timeout=10.0, probe_interval=0.1, step_delay=0.01, block_delay=0.005,
+                           await_reset=True),
+    "legacy":    EcuTiming(reset_delay=2.0, boot_timeout=5.0, probe_interval=0.05, step_delay=0.0, block_delay=0.0,
+                           await_reset=False),
+}
+ECU_PROFILE = "default"
+
+# 刷写前检查: App 通过 22 服务报告已安装程序的 [长度 4B][CRC32 4B] (小端，与 34 请求相同)，
+# 与本地固件一致时跳过擦除和下载；ECU 不支持该 DID 时照常刷写。FORCE_FLASH 或 --force 强制刷写
+APP_FINGERPRINT_DID = 0xF1A0
+FINGERPRINT_TIMEOUT = 0.5
+FORCE_FLASH = False
 
 # ==============================================================================
 # 2. UDS 客户端封装
 # ==============================================================================
 class UdsClient:
-    def __init__(self, isotp_layer):
+    def __init__(self, isotp_layer, logger=log):
         self.tp = isotp_layer
+        self.log = logger
 
     def request(self, req_data, desc="", timeout=3.0):
         """
         发送 UDS 请求并等待肯定响应
-        :param req_data: 请求数据列表 [SID, Param1...]
+        :param req_data: 请求数据 [SID, Param1...]: list、bytes 类对象，
+                         或分散/聚集 tuple (例如 (b'\x36\x01', image[offset : offset + n]))，数据不会被复制拼接
         :param timeout: 等待超时时间 (秒)
         """
-        sid = req_data[0]
-        print(f"\n[UDS] >>> 请求 {desc} ({hex(sid)}) Data: {[hex(x) for x in req_data[1:]]}")
+        parts, length = as_buffers(req_data)
+        sid = parts[0][0]
+        self.log.debug(">>> 请求 %s (0x%02X) Len=%d Data: %s", desc, sid, length, hexdump(parts[0][:16]))
         
         # 1. 发送 (ISO-TP 层自动处理分包)
         if not self.tp.send(req_data):
-            print(f"[Error] 发送失败")
+            self.log.error("%s (0x%02X) 发送失败", desc, sid)
             return False, []
 
-        # 2. 等待响应 (轮询 ISO-TP 接收)
-        start_time = time.time()
+        # 2. 等待响应 (ISO-TP 层负责多帧重组和流控)
+        #    帧交给设备发送队列时 send() 会提前返回，P2 从队列中的帧发完开始计时
+        deadline = time.time() + self.tp.tx_pending_s() + timeout
         
-        while time.time() - start_time < timeout:
-            # 这里直接操作 zcan 接收，实际项目中建议封装在 isotp.recv()
-            num = self.tp.zcan.GetReceiveNum(self.tp.chn, ZCAN_TYPE_CAN)
-            if num > 0:
-                msgs, cnt = self.tp.zcan.Receive(self.tp.chn, num)
-                for i in range(cnt):
-                    msg = msgs[i].frame
-                    # 简单过滤 ID
-                    if msg.can_id == self.tp.rx_id:
-                        # 简单解析 ISO-TP 单帧 (SF)
-                        # (MCU 的响应通常很短，几乎都是 SF，这里简化处理)
-                        # 严谨做法应该完善 isotp.py 的接收重组逻辑
-                        if (msg.data[0] & 0xF0) == 0x00:
-                            length = msg.data[0] & 0x0F
-                            resp = list(msg.data[1 : 1+length])
-                            
-                            # A. 肯定响应 (SID + 0x40)
-                            if resp[0] == (sid + 0x40):
-                                print(f"[UDS] <<< 肯定响应: {[hex(x) for x in resp]}")
-                                return True, resp
-                                
-                            # B. 否定响应 (0x7F)
-                            elif resp[0] == 0x7F:
-                                # 特殊处理 Pending (0x78) - 忙等待
-                                if resp[2] == 0x78:
-                                    print("[UDS] ... MCU 正在处理 (Pending) ...")
-                                    start_time = time.time() # 重置超时，继续等
-                                else:
-                                    print(f"[Error] 否定响应 NRC: 0x{resp[2]:02X}")
-                                    # 如果有附加数据 (例如 CRC 错误时的调试值)，打印出来
-                                    if len(resp) > 3:
-                                        print(f"      附加调试数据: {[hex(x) for x in resp[3:]]}")
-                                    return False, resp
-            
-            time.sleep(0.005) # 释放 CPU
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            resp = self.tp.recv(remaining)
+            if not resp:
+                continue
+            resp = list(resp)
+
+            # A. 肯定响应 (SID + 0x40)
+            if resp[0] == (sid + 0x40):
+                self.log.debug("<<< 肯定响应: %s", hexdump(resp))
+                return True, resp
+                
+            # B. 否定响应 (0x7F)
+            elif resp[0] == 0x7F and len(resp) >= 3:
+                # 特殊处理 Pending (0x78) - 忙等待
+                if resp[2] == 0x78:
+                    self.log.debug("... MCU 正在处理 (Pending)")
+                    deadline = time.time() + timeout # 重置超时，继续等
+                else:
+                    # 附加数据 (例如 CRC 错误时的调试值) 一并输出
+                    self.log.error("%s (0x%02X) 否定响应 NRC: 0x%02X 附加数据: %s", desc, sid, resp[2], hexdump(resp[3:]))
+                    return False, resp
         
-        print(f"[Error] 等待响应超时 ({timeout}s)")
+        self.log.error("%s (0x%02X) 等待响应超时 (%.1fs)", desc, sid, timeout)
         return False, []
 
+    def probe(self, req_data, timeout):
+        """
+        探测请求: 发送请求，等待 timeout 内的最终响应 (跳过 NRC 0x78)
+        ECU 复位期间没有响应、不支持该服务都是正常情况，只记录 DEBUG 日志
+        :return: 肯定或否定响应 (list)，没有响应返回 None
+        """
+        sid = as_buffers(req_data)[0][0][0]
+        self.tp.clear()
+        if not self.tp.send(req_data):
+            return None
+        deadline = time.time() + self.tp.tx_pending_s() + timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                self.log.debug("探测 0x%02X 没有响应", sid)
+                return None
+            resp = self.tp.recv(remaining)
+            if resp is None:
+                continue
+            resp = list(resp)
+            self.log.debug("探测 0x%02X 收到 %s", sid, hexdump(resp))
+            if resp[0] == sid + 0x40:
+                return resp
+            if resp[0] == 0x7F and len(resp) >= 3 and resp[1] == sid and resp[2] != 0x78:
+                return resp
+
+
+def parse_max_block_length(resp):
+    """
+    0x74 肯定响应: [0x74, lengthFormatIdentifier, maxNumberOfBlockLength...]
+    lengthFormatIdentifier 高 4 位为 maxNumberOfBlockLength 的字节数 (大端)
+    :return: maxNumberOfBlockLength (含 SID 和 blockSequenceCounter 两字节)，格式不对返回 None
+    """
+    if len(resp) < 2 or resp[0] != 0x74:
+        return None
+    n = resp[1] >> 4
+    if n < 1 or n > 8 or len(resp) < 2 + n:
+        return None
+    return int.from_bytes(bytes(resp[2 : 2 + n]), "big")
+
+
+def negotiate_block_size(resp, override=None, cap=BLOCK_SIZE_CAP, align=BLOCK_ALIGN):
+    """
+    由 0x74 响应得到每个 0x36 请求携带的数据长度: maxNumberOfBlockLength - 2，向下对齐到 align，不超过 cap
+    :param override: 不为 None 时直接使用 (同样对齐并受 cap 限制)
+    :return: 数据长度 (字节)；ECU 没有给出有效值时返回 MAX_BLOCK_SIZE
+    """
+    if override is not None:
+        size = override
+    else:
+        max_len = parse_max_block_length(resp)
+        if max_len is None:
+            log.warning("0x74 响应中没有有效的 maxNumberOfBlockLength，使用默认块大小 %d", MAX_BLOCK_SIZE)
+            return MAX_BLOCK_SIZE
+        size = max_len - 2
+    size = min(size, cap) // align * align
+    if size <= 0:
+        log.warning("块大小无效 (%d)，使用默认块大小 %d", size, MAX_BLOCK_SIZE)
+        return MAX_BLOCK_SIZE
+    return size
+
+
+def wait_bootloader(uds, timing, logger=log, jumped=True):
+    """
+    App 回复 10 02 后复位进入 Bootloader: 等待 reset_delay 后反复发送 10 02 探测，
+    Bootloader 一回复肯定响应就继续，不再固定等待
+    timing.await_reset 时，App 还在运行时回复的 50 02 不算: 先要看到一次没有响应或否定响应 (App 已复位)
+    :param jumped: App 确认了跳转请求 (ECU 已在 Bootloader 时为 False，不等待复位)
+    :return: 就绪返回 True，boot_timeout 内一直没有响应返回 False
+    """
+    time.sleep(timing.reset_delay)
+    start = time.time()
+    attempts = 0
+    reset_seen = not (jumped and timing.await_reset)
+    while time.time() - start < timing.boot_timeout:
+        attempts += 1
+        sent = time.time()
+        resp = uds.probe([0x10, 0x02], timing.probe_interval)
+        if resp is not None and resp[0] == 0x50 and reset_seen:
+            logger.info(">>> Bootloader 已就绪 (%.3fs, 探测 %d 次)", timing.reset_delay + time.time() - start, attempts)
+            return True
+        if resp is None or resp[0] != 0x50:
+            reset_seen = True
+        else:
+            # App 还没有复位 (它又一次确认了跳转)，继续等它停止响应
+            logger.debug("探测收到 50 02，App 尚未复位")
+        # 很快收到的响应 (否定响应、App 的 50 02) 之后等满 probe_interval 再探测，不连续发请求
+        remaining = timing.probe_interval - (time.time() - sent)
+        if remaining > 0:
+            time.sleep(remaining)
+    return False
+
+def read_app_fingerprint(uds, logger=log):
+    """
+    读取 ECU 上已安装 App 的指纹 (22 F1 A0)
+    :return: (长度, CRC32)；ECU 没有响应、不支持或格式不对时返回 None
+    """
+    # 不是所有 ECU 都支持该 DID，用探测请求读取，没有响应或否定响应不记为错误
+    did = [APP_FINGERPRINT_DID >> 8, APP_FINGERPRINT_DID & 0xFF]
+    resp = uds.probe([0x22] + did, FINGERPRINT_TIMEOUT)
+    if resp is None:
+        logger.info(">>> ECU 未响应指纹读取 (DID 0x%04X)，继续刷写", APP_FINGERPRINT_DID)
+        return None
+    if resp[0] != 0x62 or len(resp) < 11 or resp[1:3] != did:
+        logger.info(">>> ECU 不支持指纹读取 (DID 0x%04X, 响应 %s)，继续刷写", APP_FINGERPRINT_DID, hexdump(resp))
+        return None
+    return struct.unpack('<II', bytes(resp[3:11]))
+
+
+def app_is_current(uds, fw_data, total_crc, logger=log):
+    """ECU 上已安装的 App 与本地固件 (长度和 CRC) 一致时返回 True"""
+    fingerprint = read_app_fingerprint(uds, logger)
+    if fingerprint is None:
+        return False
+    size, crc = fingerprint
+    logger.info(">>> 已安装程序: %d Bytes, CRC 0x%08X", size, crc)
+    return (size, crc) == (len(fw_data), total_crc)
+
 # ==============================================================================
 # 3. 主流程 (严格匹配 MCU 状态机)
 # ==============================================================================
-def main_flash_process():
-    # --- A. 初始化硬件 ---
-    zcan = ZCAN()
-    handle = zcan.OpenDevice(DEVICE_TYPE, DEVICE_INDEX, 0)
-    if handle == INVALID_DEVICE_HANDLE:
-        print("打开设备失败")
-        return
+def load_firmware(path=FIRMWARE_FILE):
+    """读取固件，4 字节对齐 (填充 0xFF)，返回 (固件 bytes, CRC32)"""
+    with open(path, 'rb') as f:
+        fw_data = f.read()
+    
+    # 4字节填充 (为了配合 MCU 的 32位 CRC 校验和 Flash 写入)
+    if len(fw_data) % 4 != 0:
+        fw_data += b'\xFF' * (4 - (len(fw_data) % 4))
+    
+    # 计算 CRC (标准 PKZIP 算法, 对应 MCU V7 软件算法)
+    total_crc = binascii.crc32(fw_data) & 0xFFFFFFFF
+    return fw_data, total_crc
 
-    print("--- CAN 初始化 ---")
-    zcan.ZCAN_SetValue(handle, "0/canfd_abit_baud_rate", "1000000")
+
+def open_uds_channel(zcan, handle, chn_index, rx_ids, fd=CAN_FD):
+    """
+    设置波特率，按响应 ID 滤波后启动通道
+    :param rx_ids: 该通道上各 ECU 的响应 ID
+    :return: (chn_handle, device_queue)，device_queue 为 (handle, chn_index)，设备不支持队列发送时为 None
+    """
+    zcan.ZCAN_SetValue(handle, "%d/canfd_abit_baud_rate" % chn_index, CANFD_ABIT_BAUD if fd else "1000000")
     chn_cfg = ZCAN_CHANNEL_INIT_CONFIG()
-    chn_cfg.can_type = ZCAN_TYPE_CAN
-    chn_cfg.config.can.mode = 0
-    chn_handle = zcan.InitCAN(handle, CHANNEL_INDEX, chn_cfg)
+    if fd:
+        zcan.ZCAN_SetValue(handle, "%d/canfd_dbit_baud_rate" % chn_index, CANFD_DBIT_BAUD)
+        chn_cfg.can_type = ZCAN_TYPE_CANFD
+        chn_cfg.config.canfd.mode = 0
+    else:
+        chn_cfg.can_type = ZCAN_TYPE_CAN
+        chn_cfg.config.can.mode = 0
+    # 只接收 MCU 响应 ID: SJA1000 类设备用 acc_code/acc_mask，USBCANFD 类用范围滤波，
+    # 两者都不支持时由 ZCAN 在主机侧过滤
+    rx_filter = ChannelFilter(ids=rx_ids)
+    rx_filter.apply_to_init_config(chn_cfg)
+    chn_handle = zcan.InitCAN(handle, chn_index, chn_cfg)
+    zcan.set_channel_filter(handle, chn_index, chn_handle, rx_filter)
+    device_queue = None
+    if DEVICE_TX_QUEUE and zcan.set_tx_queue_mode(handle, chn_index) == ZCAN_STATUS_OK \
+            and zcan.tx_queue_free(handle, chn_index) is not None:
+        device_queue = (handle, chn_index)
     zcan.StartCAN(chn_handle)
+    return chn_handle, device_queue
 
-    # --- B. 初始化协议栈 ---
-    tp = IsoTpLayer(zcan, chn_handle, TX_ID, RX_ID)
-    uds = UdsClient(tp)
 
-    try:
-        # =================================================================
-        # 阶段 1: App 跳转 (App Logic)
-        # 逻辑依据: App_main.txt 
-        # 必须顺序: 10 03 -> 31 01 -> 10 02
-        # =================================================================
-        print("\n=== 阶段 1: App 跳转 Bootloader ===")
-        
-        # 1.1 进入扩展会话
-        ok, _ = uds.request([0x10, 0x03], "App: Enter Extended Session")
-        # 注意: 如果已经是在 Bootloader，这里可能会失败或回复不同，但我们假设是从 App 开始
-        if not ok:
-            print(">>> 提示: 可能是 MCU 已经在 Bootloader，尝试直接继续...")
-        
-        time.sleep(0.1)
+def enter_bootloader(uds, timing=None, logger=log):
+    """
+    阶段 1: App 跳转 (10 03 -> 31 01 -> 10 02)，然后探测到 Bootloader 就绪为止
+    ECU 已经在 Bootloader 时 App 请求失败也会继续；Bootloader 没有响应时抛出 Exception
+    """
+    timing = timing or ECU_TIMING_PROFILES[ECU_PROFILE]
 
-        # 1.2 预编程检查
-        ok, _ = uds.request([0x31, 0x01, 0xFF, 0x00], "App: Pre-Prog Check")
-        # 如果这里失败，说明没进扩展会话或者 ID 不对，必须终止
-        
-        time.sleep(0.1)
+    # =================================================================
+    # 阶段 1: App 跳转 (App Logic)
+    # 逻辑依据: App_main.txt 
+    # 必须顺序: 10 03 -> 31 01 -> 10 02
+    # =================================================================
+    logger.info("=== 阶段 1: App 跳转 Bootloader ===")
+    
+    # 1.1 进入扩展会话
+    ok, _ = uds.request([0x10, 0x03], "App: Enter Extended Session")
+    # 注意: 如果已经是在 Bootloader，这里可能会失败或回复不同，但我们假设是从 App 开始
+    if not ok:
+        logger.info(">>> 提示: 可能是 MCU 已经在 Bootloader，尝试直接继续...")
+    
+    if timing.step_delay:
+        time.sleep(timing.step_delay)
 
-        # 1.3 请求编程会话 (触发复位)
-        ok, _ = uds.request([0x10, 0x02], "App: Enter Prog Session (Jump)")
-        if ok:
-            print(">>> MCU 正在复位，等待 2 秒让 Bootloader 启动...")
-            time.sleep(2.0) 
-        else:
-            print(">>> 跳转请求失败 (或已在 Bootloader)")
+    # 1.2 预编程检查
+    ok, _ = uds.request([0x31, 0x01, 0xFF, 0x00], "App: Pre-Prog Check")
+    # 如果这里失败，说明没进扩展会话或者 ID 不对，必须终止
+    
+    if timing.step_delay:
+        time.sleep(timing.step_delay)
 
-        # =================================================================
-        # 阶段 2: 固件下载 (Bootloader Logic)
-        # 逻辑依据: Boot_main.txt
-        # 必须顺序: 10 02 -> 34 -> 31 -> 36(Loop) -> 37
-        # =================================================================
-        print("\n=== 阶段 2: 固件下载 ===")
+    # 1.3 请求编程会话 (触发复位)
+    ok, _ = uds.request([0x10, 0x02], "App: Enter Prog Session (Jump)")
+    if ok:
+        logger.info(">>> MCU 正在复位，探测 Bootloader...")
+    else:
+        logger.info(">>> 跳转请求失败 (或已在 Bootloader)")
 
-        # --- 准备固件数据 ---
-        print(f"读取文件: {FIRMWARE_FILE}")
-        with open(FIRMWARE_FILE, 'rb') as f:
-            fw_data = f.read()
+    # 握手 (确认 Bootloader 在线): 探测到 10 02 肯定响应即继续
+    if not wait_bootloader(uds, timing, logger, jumped=ok): raise Exception("无法连接到 Bootloader")
+
+
+def start_download(uds, fw_data, total_crc, block_size=BLOCK_SIZE_OVERRIDE, logger=log):
+    """请求下载 (34) 并擦除 Flash (31)，返回协商后的块数据长度；失败时抛出 Exception"""
+    total_len = len(fw_data)
+
+    # 请求下载 (34)
+    # 格式: 34 [Size 4B] [CRC 4B] (小端)
+    req_34 = [0x34] + list(struct.pack('<I', total_len)) + list(struct.pack('<I', total_crc))
+    ok, resp_74 = uds.request(req_34, "Request Download (34)")
+    if not ok: raise Exception("请求下载失败")
+    block_size = negotiate_block_size(resp_74, block_size)
+    logger.info("块大小: %d 字节 (共 %d 块)", block_size, -(-total_len // block_size))
+
+    # 擦除 Flash (31)
+    # 格式: 31 01 FF 00
+    # 超时: 给 10 秒，因为 MCU 会发 Pending，但我们要允许它慢
+    ok, _ = uds.request([0x31, 0x01, 0xFF, 0x00], "Erase Flash (31)", timeout=10.0)
+    if not ok: raise Exception("擦除失败")
+    return block_size
+
+
+def transfer_blocks(uds, fw_data, block_size, timing=None, progress=None, logger=log):
+    """传输数据 (36 循环)，每块等到 0x76 再发下一块；失败时抛出 Exception"""
+    timing = timing or ECU_TIMING_PROFILES[ECU_PROFILE]
+    total_len = len(fw_data)
+    fw_image = memoryview(fw_data) # TransferData 直接引用镜像切片，不复制
+
+    logger.info(">>> 开始传输数据...")
+    offset = 0
+    block_seq = 1
+    
+    while offset < total_len:
+        # 计算当前块大小
+        size = min(block_size, total_len - offset)
         
-        # 4字节填充 (为了配合 MCU 的 32位 CRC 校验和 Flash 写入)
-        if len(fw_data) % 4 != 0:
-            fw_data += b'\xFF' * (4 - (len(fw_data) % 4))
+        # 构造: 36 [Seq] [Data...]，头和镜像切片分开传给 ISO-TP，分段时直接写入帧内存
+        # 这里的 block_seq 需要 & 0xFF，虽然 Python 自动处理，但显式写更好
+        req_36 = (bytes((0x36, block_seq & 0xFF)), fw_image[offset : offset + size])
         
-        total_len = len(fw_data)
-        # 计算 CRC (标准 PKZIP 算法, 对应 MCU V7 软件算法)
-        total_crc = binascii.crc32(fw_data) & 0xFFFFFFFF
+        logger.debug("Block %d: Offset=%d, Len=%d", block_seq, offset, size)
         
-        print(f"固件大小: {total_len} Bytes")
-        print(f"固件 CRC: 0x{total_crc:08X}")
-
-        # 2.1 握手 (确认 Bootloader 在线)
-        ok, _ = uds.request([0x10, 0x02], "Boot: Handshake (10 02)")
-        if not ok: raise Exception("无法连接到 Bootloader")
-
-        # 2.2 请求下载 (34)
-        # 格式: 34 [Size 4B] [CRC 4B] (小端)
-        req_34 = [0x34] + list(struct.pack('<I', total_len)) + list(struct.pack('<I', total_crc))
-        ok, _ = uds.request(req_34, "Request Download (34)")
-        if not ok: raise Exception("请求下载失败")
-
-        # 2.3 擦除 Flash (31)
-        # 格式: 31 01 FF 00
-        # 超时: 给 10 秒，因为 MCU 会发 Pending，但我们要允许它慢
-        ok, _ = uds.request([0x31, 0x01, 0xFF, 0x00], "Erase Flash (31)", timeout=10.0)
-        if not ok: raise Exception("擦除失败")
-
-        # 2.4 传输数据 (36 Loop)
-        print("\n>>> 开始传输数据...")
-        offset = 0
-        block_seq = 1
+        # 发送并等待响应 (76)
+        # ISO-TP 层会自动拆包成 FF/CF 发送，并处理 MCU 的流控
+        ok, _ = uds.request(req_36, f"Transfer Data")
+        if not ok: raise Exception(f"Block {block_seq} 写入失败")
         
-        while offset < total_len:
-            # 计算当前块大小
-            size = min(MAX_BLOCK_SIZE, total_len - offset)
-            block_data = fw_data[offset : offset + size]
-            
-            # 构造: 36 [Seq] [Data...]
-            # 这里的 block_seq 需要 & 0xFF，虽然 Python 自动处理，但显式写更好
-            req_36 = [0x36, block_seq & 0xFF] + list(block_data)
-            
-            print(f"Block {block_seq}: Offset={offset}, Len={size}")
-            
-            # 发送并等待响应 (76)
-            # ISO-TP 层会自动拆包成 FF/CF 发送，并处理 MCU 的流控
-            ok, _ = uds.request(req_36, f"Transfer Data")
-            if not ok: raise Exception(f"Block {block_seq} 写入失败")
-            
-            # 稍微延时，给 MCU 一点喘息时间重置状态机 (虽然 STmin 已经控制了，但双重保险)
-            time.sleep(0.05)
-            
-            offset += size
-            block_seq += 1
-
-        # 2.5 请求退出并校验 (37)
-        print("\n>>> 传输完成，请求校验...")
-        ok, _ = uds.request([0x37], "Request Exit (Verify CRC)")
+        # 收到 0x76 即说明 MCU 已写完本块，立即发下一块；个别 ECU 需要额外间隔时由配置给出
+        if timing.block_delay:
+            time.sleep(timing.block_delay)
         
-        if ok:
-            print("\n=== [SUCCESS] 刷写成功！MCU 正在重启... ===")
-        else:
-            # 如果 MCU 返回了附带 CRC 的否定响应，这里会打印出来
-            raise Exception("CRC 校验失败")
+        offset += size
+        block_seq += 1
+        if progress is not None:
+            progress(offset, total_len)
+
+
+def verify_download(uds, logger=log):
+    """请求退出并校验 (37)，MCU 校验 CRC 通过返回 True"""
+    logger.info(">>> 传输完成，请求校验...")
+    # 如果 MCU 返回了附带 CRC 的否定响应，UdsClient 会把附加数据记录下来
+    ok, _ = uds.request([0x37], "Request Exit (Verify CRC)")
+    return ok
+
+
+def flash_ecu(uds, fw_data, total_crc, timing=None, block_size=BLOCK_SIZE_OVERRIDE, progress=None, logger=log,
+              force=FORCE_FLASH):
+    """
+    对一个 ECU 执行完整刷写流程 (App 跳转 + 固件下载)，失败时抛出 Exception
+    ECU 上已是相同固件时跳过，返回 False；刷写成功返回 True
+    :param fw_data: load_firmware() 得到的固件，只读 (多个刷写任务可以共享同一份)
+    :param timing: EcuTiming，None 时使用 ECU_TIMING_PROFILES[ECU_PROFILE]
+    :param block_size: 强制的块数据长度，None 时按 0x74 响应协商
+    :param progress: progress(已写入字节, 总字节)，每块写入成功后调用
+    :param logger: 日志对象 (并行刷写时为带 ECU 前缀的 PrefixAdapter)
+    :param force: True 时不检查已安装的程序，总是刷写
+    """
+    if not force and app_is_current(uds, fw_data, total_crc, logger):
+        logger.info("=== [SKIP] ECU 已是相同固件，跳过刷写 ===")
+        return False
+
+    enter_bootloader(uds, timing, logger)
+
+    # =================================================================
+    # 阶段 2: 固件下载 (Bootloader Logic)
+    # 逻辑依据: Boot_main.txt
+    # 必须顺序: 10 02 -> 34 -> 31 -> 36(Loop) -> 37
+    # =================================================================
+    logger.info("=== 阶段 2: 固件下载 ===")
+    block_size = start_download(uds, fw_data, total_crc, block_size, logger)
+    transfer_blocks(uds, fw_data, block_size, timing, progress, logger)
+    if not verify_download(uds, logger):
+        raise Exception("CRC 校验失败")
+    logger.info("=== [SUCCESS] 刷写成功！MCU 正在重启... ===")
+    return True
+
+
+def main_flash_process(events=None, timing=None, block_size=BLOCK_SIZE_OVERRIDE, force=FORCE_FLASH):
+    """
+    :param events: TransferEventBuffer，失败时输出其中最近的传输事件
+    :param force: True 时不检查 ECU 上已安装的程序，总是刷写
+    :param timing: EcuTiming，None 时使用 ECU_TIMING_PROFILES[ECU_PROFILE]
+    :param block_size: 强制的块数据长度，None 时按 0x74 响应协商
+    """
+    # --- A. 初始化硬件 ---
+    zcan = ZCAN()
+    handle = zcan.OpenDevice(DEVICE_TYPE, DEVICE_INDEX, 0)
+    if handle == INVALID_DEVICE_HANDLE:
+        log.error("打开设备失败")
+        return
+
+    log.info("--- CAN 初始化 ---")
+    chn_handle, device_queue = open_uds_channel(zcan, handle, CHANNEL_INDEX, [RX_ID])
+
+    # --- B. 初始化协议栈 ---
+    # 通道接收统一由分发器读取，ISO-TP 只订阅 RX_ID
+    dispatcher = get_dispatcher(zcan, chn_handle, fd=CAN_FD)
+    tp = IsoTpLayer(zcan, chn_handle, TX_ID, RX_ID, fd=CAN_FD, tx_dl=CANFD_TX_DL, dispatcher=dispatcher,
+                    device_queue=device_queue)
+    uds = UdsClient(tp)
+
+    try:
+        # --- 准备固件数据 ---
+        log.info("读取文件: %s", FIRMWARE_FILE)
+        fw_data, total_crc = load_firmware(FIRMWARE_FILE)
+        log.info("固件大小: %d Bytes", len(fw_data))
+        log.info("固件 CRC: 0x%08X", total_crc)
+
+        flash_ecu(uds, fw_data, total_crc, timing, block_size, force=force)
 
     except Exception as e:
-        print(f"\n[FATAL ERROR] 流程终止: {e}")
+        log.error("[FATAL ERROR] 流程终止: %s", e)
+        if events is not None:
+            events.dump()
     
     finally:
+        dispatcher.release()
         zcan.CloseDevice(handle)
 
 if __name__ == "__main__":
-    main_flash_process()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="UDS 固件刷写")
+    parser.add_argument("--force", action="store_true", help="不检查 ECU 上已安装的程序，总是刷写")
+    parser.add_argument("--trace", action="store_true", help="在内存中记录传输事件，失败时输出 (降低传输速度)")
+    args = parser.parse_args()
+    events = setup_logging(logging.INFO, EVENT_BUFFER_SIZE if args.trace else 0)
+    main_flash_process(events, force=FORCE_FLASH or args.force)
\ No newline at end of file
@@ -0,0 +1,92 @@
+# -*- coding:utf-8 -*-
+#  uds_async.py
+#
+#  asyncio 版 UDS 客户端 (基于 AsyncIsoTpLayer)，按 ISO 14229-2 的 P2/P2* 处理响应超时:
+#  发出请求后在 P2 内等待响应，收到 NRC 0x78 (responsePending) 后改为每次等待 P2*，
+#  DiagnosticSessionControl (0x10) 的肯定响应中带有 ECU 的 P2/P2* 时自动采用。
+#
+#      tp = AsyncIsoTpLayer(zcan, chn_handle, 0x7E0, 0x7E8)
+#      uds = AsyncUdsClient(tp)
+#      ok, resp = await uds.request([0x10, 0x02], "进入编程会话")
+#
+import asyncio
+import logging
+from isotp import as_buffers
+from isotp_async import AsyncIsoTpLayer
+
+log = logging.getLogger(__name__)
+
+UDS_P2_SERVER      = 0.05 # P2_server_max 默认值 (秒)
+UDS_P2_STAR_SERVER = 5.0  # P2*_server_max 默认值 (秒)
+UDS_TIMING_MARGIN  = 0.1  # 客户端在 ECU 时间参数上增加的余量 (总线 + 适配器 + 主机延迟)
+
+UDS_NRC_RESPONSE_PENDING = 0x78
+
+
+class AsyncUdsClient(object):
+    def __init__(self, tp, p2=UDS_P2_SERVER, p2_star=UDS_P2_STAR_SERVER, margin=UDS_TIMING_MARGIN):
+        """
+        :param tp: AsyncIsoTpLayer
+        :param p2: ECU 的 P2_server_max (秒)
+        :param p2_star: ECU 的 P2*_server_max (秒)
+        :param margin: 客户端等待时间 = 服务端参数 + margin
+        """
+        self.tp = tp
+        self.p2 = p2
+        self.p2_star = p2_star
+        self.margin = margin
+
+    @property
+    def p2_client(self):
+        return self.p2 + self.margin
+
+    @property
+    def p2_star_client(self):
+        return self.p2_star + self.margin
+
+    def _update_timing(self, resp):
+        """0x50 肯定响应: [0x50, 会话, P2 高, P2 低 (1ms), P2* 高, P2* 低 (10ms)]"""
+        if len(resp) >= 6:
+            self.p2 = ((resp[2] << 8) | resp[3]) / 1000.0
+            self.p2_star = ((resp[4] << 8) | resp[5]) / 100.0
+
+    async def request(self, req_data, desc="", timeout=None):
+        """
+        发送 UDS 请求并等待响应 (协程)
+        :param req_data: 请求数据 [SID, Param1...] (list、bytes 类对象或分散/聚集 tuple，见 as_buffers())
+        :param timeout: 等待第一个响应的时间 (秒)，None 时为 P2 (客户端)；0x78 之后总是 P2*
+        :return: (True, 肯定响应 list) / (False, 否定响应 list) / (False, []) 发送失败或超时
+        """
+        sid = as_buffers(req_data)[0][0][0]
+        tp = self.tp
+        tp.clear()
+        if not await tp.send(req_data):
+            log.error("%s (0x%02X) 发送失败", desc, sid)
+            return False, []
+
+        # 超时从发出请求起算 (其它报文不延长等待)，只有 NRC 0x78 重新计时
+        loop = asyncio.get_running_loop()
+        wait = self.p2_client if timeout is None else timeout
+        deadline = loop.time() + wait
+        while True:
+            resp = await tp.recv(deadline - loop.time())
+            if resp is None:
+                log.error("%s (0x%02X) 等待响应超时 (%.3fs)", desc, sid, wait)
+                return False, []
+            resp = list(resp)
+
+            # A. 肯定响应 (SID + 0x40)
+            if resp[0] == sid + 0x40:
+                if sid == 0x10:
+                    self._update_timing(resp)
+                return True, resp
+
+            # B. 否定响应 (0x7F, SID, NRC)
+            if resp[0] == 0x7F and len(resp) >= 3 and resp[1] == sid:
+                if resp[2] == UDS_NRC_RESPONSE_PENDING:
+                    wait = self.p2_star_client
+                    deadline = loop.time() + wait
+                    continue
+                log.error("%s (0x%02X) 否定响应 NRC: 0x%02X", desc, sid, resp[2])
+                return False, resp
+            # 其它报文 (不是本请求的响应) 忽略，继续等待
@@ -0,0 +1,247 @@
+# -*- coding:utf-8 -*-
+#  uds_broadcast.py
+#
+#  同一条总线上一批相同模块的广播刷写:
+#  1. 各 ECU 物理寻址并行执行 App 跳转、34 请求下载、31 擦除 (块长度取各 ECU 协商结果的最小值)
+#  2. 从第 1 步成功的 ECU 中选出 leader (31 01 FF 01 01，其余 ECU 31 01 FF 01 00)，
+#     36 数据块只在广播 ID 上发送一次，所有 ECU 同时接收；
+#     ISO-TP 流控和 0x76 响应由 leader 回复，其余 ECU 静默接收
+#  3. 每个 ECU 物理寻址单独 37 校验 CRC，只对校验失败的 ECU 物理寻址重新下载
+#  N 个 ECU 时数据传输只占一份总线时间；已是相同固件的 ECU 在第 1 步之前跳过 (--force 强制刷写)。
+#  没有 ECU 接受 leader 或广播中断时，所有 ECU 改为物理寻址下载 (不占重新下载次数)。
+#  需要 Bootloader 支持在广播 ID 上接收 36 且只有 leader 应答，见 zcan_sim_ecu.SimBootloaderEcu。
+#
+#      python uds_broadcast.py [--force] [--trace]
+#
+import argparse
+import logging
+import time
+from zlgcan import *
+from isotp import IsoTpLayer
+from isotp_sessions import IsoTpSessionManager
+from zcan_dispatch import get_dispatcher
+from zcan_log import setup_logging, PrefixAdapter, EVENT_BUFFER_SIZE
+from uds_IAP import (UdsClient, load_firmware, open_uds_channel, app_is_current, enter_bootloader,
+                     start_download, transfer_blocks, verify_download, DEVICE_TYPE, DEVICE_INDEX, CHANNEL_INDEX,
+                     FIRMWARE_FILE, CAN_FD, CANFD_TX_DL, BLOCK_SIZE_OVERRIDE, FORCE_FLASH)
+from uds_flash_station import FlashTarget, FlashJob, log_summary
+
+log = logging.getLogger("broadcast")
+
+BROADCAST_ID = 0x7F0 # 广播下载 ID (Bootloader 在该 ID 上接收 36)
+LEADER_RID = 0xFF01  # 设置广播 leader 的例程 (31 01 FF 01 <1: leader / 0: 静默接收>)
+RETRY_MAX = 2        # 下载后校验失败的 ECU 物理寻址重新下载的次数
+
+# 一批相同模块: (请求 ID, 响应 ID)，第一个优先作为 leader
+FLEET = [(0x7E0 + i, 0x7E8 + i) for i in range(4)]
+
+
+class BroadcastFlasher(object):
+    """
+    一个通道上的广播刷写
+        flasher = BroadcastFlasher(zcan, chn_handle, FLEET)
+        jobs = flasher.run(fw_data, total_crc)
+        flasher.close()
+    """
+    def __init__(self, zcan_lib, chn_handle, ecus, broadcast_id=BROADCAST_ID, leader=None, dispatcher=None,
+                 device_queue=None, fd=CAN_FD, timing=None, block_size=BLOCK_SIZE_OVERRIDE, retries=RETRY_MAX,
+                 device_type=DEVICE_TYPE, device_index=DEVICE_INDEX, channel=CHANNEL_INDEX, force=FORCE_FLASH):
+        """
+        :param ecus: [(tx_id, rx_id), ...]
+        :param leader: 优先作为 leader 的 ECU 的 tx_id，None 时为 ecus 中的第一个；
+                       该 ECU 没有就绪时按 ecus 顺序从就绪的 ECU 中选
+        :param dispatcher: 通道分发器，None 时使用 get_dispatcher() 并在 close() 时释放
+        :param device_queue: (device_handle, chn_index)，通道已开启队列发送模式时给出 (见 open_uds_channel)
+        :param retries: 下载后 CRC 校验失败的 ECU 物理寻址重新下载的次数
+        :param force: True 时不检查 ECU 上已安装的程序，总是刷写
+        device_type/device_index/channel 只用于结果记录
+        """
+        self.zcan = zcan_lib
+        self.chn = chn_handle
+        self.broadcast_id = broadcast_id
+        self.leader = leader if leader is not None else ecus[0][0]
+        self.order = [tx_id for tx_id, _ in ecus]
+        self.fd = fd
+        self.timing = timing
+        self.block_size = block_size
+        self.retries = retries
+        self.force = force
+        self._own_dispatcher = dispatcher is None
+        self.dispatcher = dispatcher if dispatcher is not None else get_dispatcher(zcan_lib, chn_handle, fd)
+        self.device_queue = device_queue
+        self.mgr = IsoTpSessionManager(zcan_lib, chn_handle, fd=fd, dispatcher=self.dispatcher,
+                                       tx_dl=CANFD_TX_DL, device_queue=device_queue)
+        self.jobs = {} # {tx_id: FlashJob}
+        self.loggers = {}
+        for tx_id, rx_id in ecus:
+            self.mgr.add_session(tx_id, rx_id)
+            job = FlashJob(FlashTarget(device_type, device_index, channel, tx_id, rx_id))
+            self.jobs[tx_id] = job
+            self.loggers[tx_id] = PrefixAdapter(logging.getLogger("uds"), job.name)
+
+    def close(self):
+        self.mgr.close()
+        if self._own_dispatcher:
+            self.dispatcher.release()
+
+    def _uds(self, tp):
+        return UdsClient(tp, self.loggers[tp.tx_id])
+
+    # --- 各阶段 ---------------------------------------------------------------
+    def _prepare(self, tp, fw_data, total_crc):
+        """App 跳转 + 请求下载 + 擦除，返回协商的块长度；已是相同固件时返回 None"""
+        uds = self._uds(tp)
+        if not self.force and app_is_current(uds, fw_data, total_crc, uds.log):
+            uds.log.info("=== [SKIP] ECU 已是相同固件，跳过刷写 ===")
+            self.jobs[tp.tx_id].finish(skipped=True)
+            return None
+        enter_bootloader(uds, self.timing, uds.log)
+        return start_download(uds, fw_data, total_crc, self.block_size, uds.log)
+
+    def _verify(self, tp):
+        tp.clear() # 广播期间 leader 的响应也进了物理会话的队列
+        return verify_download(self._uds(tp), self.loggers[tp.tx_id])
+
+    def _reflash(self, tp, fw_data, total_crc, block_size=None):
+        """物理寻址下载 (已在 Bootloader 中)；block_size 为 None 时重新请求下载和擦除"""
+        uds = self._uds(tp)
+        job = self.jobs[tp.tx_id]
+        if block_size is None:
+            block_size = start_download(uds, fw_data, total_crc, self.block_size, uds.log)
+        transfer_blocks(uds, fw_data, block_size, self.timing, job.progress, uds.log)
+        return verify_download(uds, uds.log)
+
+    def _physical(self, tx_ids, fw_data, total_crc, block_sizes=None):
+        """物理寻址并行下载 tx_ids，返回校验失败的 tx_id 列表"""
+        block_sizes = block_sizes or {}
+        results = self.mgr.run_parallel(
+            lambda tp: self._reflash(tp, fw_data, total_crc, block_sizes.get(tp.tx_id)), tx_ids)
+        for tx_id, result in results.items():
+            if isinstance(result, Exception):
+                self.loggers[tx_id].error("物理寻址下载失败: %s", result)
+            elif result:
+                self.jobs[tx_id].finish()
+        return [tx_id for tx_id in tx_ids if not self.jobs[tx_id].ok]
+
+    def _set_leader(self, tx_id, enable):
+        uds = self._uds(self.mgr.session(tx_id))
+        ok, _ = uds.request([0x31, 0x01, LEADER_RID >> 8, LEADER_RID & 0xFF, 1 if enable else 0],
+                            "Set Broadcast Leader" if enable else "Clear Broadcast Leader")
+        return ok
+
+    def _elect_leader(self, tx_ids):
+        """从就绪的 ECU 中选出 leader (优先 self.leader)，其余 ECU 设为静默接收；没有 ECU 接受时返回 None"""
+        candidates = sorted(tx_ids, key=lambda tx_id: (tx_id != self.leader, self.order.index(tx_id)))
+        for leader in candidates:
+            if self._set_leader(leader, True):
+                break
+        else:
+            return None
+        for tx_id in tx_ids:
+            if tx_id != leader and not self._set_leader(tx_id, False):
+                # 可能同时回复流控，不能参加广播
+                self._set_leader(leader, False)
+                return None
+        return leader
+
+    def _broadcast(self, fw_data, block_size, tx_ids, leader):
+        """在广播 ID 上发送全部数据块，流控和响应来自 leader；返回是否全部发送成功"""
+        leader_rx = self.mgr.session(leader).rx_id
+        tp = IsoTpLayer(self.zcan, self.chn, self.broadcast_id, leader_rx, fd=self.fd, tx_dl=CANFD_TX_DL,
+                        dispatcher=self.dispatcher, device_queue=self.device_queue)
+        logger = PrefixAdapter(logging.getLogger("uds"), "broadcast 0x%X" % self.broadcast_id)
+        jobs = [self.jobs[tx_id] for tx_id in tx_ids]
+        def progress(written, total):
+            for job in jobs:
+                job.progress(written, total)
+        try:
+            transfer_blocks(UdsClient(tp, logger), fw_data, block_size, self.timing, progress, logger)
+            return True
+        except Exception as e:
+            logger.error("广播下载中断: %s", e)
+            return False
+        finally:
+            tp.close()
+
+    def run(self, fw_data, total_crc):
+        """返回 FlashJob 列表 (与 ecus 顺序相同)"""
+        for job in self.jobs.values():
+            job.start_time = time.perf_counter()
+            job.total = len(fw_data)
+            job.state = "running"
+
+        # 1. 并行检查已安装的程序，进入 Bootloader、请求下载、擦除
+        ready = {}
+        for tx_id, result in self.mgr.run_parallel(lambda tp: self._prepare(tp, fw_data, total_crc)).items():
+            if isinstance(result, Exception):
+                self.loggers[tx_id].error("准备下载失败: %s", result)
+                self.jobs[tx_id].finish(str(result))
+            elif result is not None:
+                ready[tx_id] = result
+
+        # 2. 从就绪的 ECU 中选出 leader，广播传输
+        pending = [tx_id for tx_id in self.order if tx_id in ready]
+        leader = self._elect_leader(pending) if pending else None
+        downloaded = False
+        if leader is not None:
+            block_size = min(ready.values())
+            log.info("广播下载: ID 0x%X, leader 0x%X, %d 个 ECU, 块大小 %d 字节",
+                     self.broadcast_id, leader, len(pending), block_size)
+            downloaded = self._broadcast(fw_data, block_size, pending, leader)
+        if downloaded:
+            # 3. 逐个物理校验
+            verified = self.mgr.run_parallel(self._verify, pending)
+            for tx_id in pending:
+                if verified[tx_id] is True:
+                    self.jobs[tx_id].finish()
+            pending = [tx_id for tx_id in pending if verified[tx_id] is not True]
+        elif pending:
+            # 没有 leader 或广播中断: 物理寻址下载，不占重新下载次数
+            log.warning("广播下载不可用，改为物理寻址下载: %s", ", ".join("0x%X" % tx_id for tx_id in pending))
+            sizes = ready if leader is None else None # 广播中断时 ECU 的下载状态未知，重新请求下载
+            pending = self._physical(pending, fw_data, total_crc, sizes)
+
+        # 4. 校验失败的 ECU 物理寻址重新下载
+        for attempt in range(self.retries):
+            if not pending:
+                break
+            log.info("物理寻址重新下载 (%d/%d): %s", attempt + 1, self.retries,
+                     ", ".join("0x%X" % tx_id for tx_id in pending))
+            pending = self._physical(pending, fw_data, total_crc)
+        for tx_id in pending:
+            self.jobs[tx_id].finish("CRC 校验失败")
+        return list(self.jobs.values())
+
+
+def main(ecus=FLEET, firmware=FIRMWARE_FILE, zcan=None, force=FORCE_FLASH, trace=False):
+    events = setup_logging(logging.INFO, EVENT_BUFFER_SIZE if trace else 0)
+    fw_data, total_crc = load_firmware(firmware)
+    log.info("固件: %s, %d Bytes, CRC 0x%08X, %d 个 ECU", firmware, len(fw_data), total_crc, len(ecus))
+    zcan = zcan if zcan is not None else ZCAN()
+    handle = zcan.OpenDevice(DEVICE_TYPE, DEVICE_INDEX, 0)
+    if handle == INVALID_DEVICE_HANDLE:
+        log.error("打开设备失败")
+        return False
+    chn_handle, device_queue = open_uds_channel(zcan, handle, CHANNEL_INDEX, [rx_id for _, rx_id in ecus])
+    dispatcher = get_dispatcher(zcan, chn_handle, fd=CAN_FD)
+    flasher = BroadcastFlasher(zcan, chn_handle, ecus, dispatcher=dispatcher, device_queue=device_queue,
+                               force=force)
+    start = time.perf_counter()
+    try:
+        jobs = flasher.run(fw_data, total_crc)
+    finally:
+        flasher.close()
+        dispatcher.release()
+        zcan.CloseDevice(handle)
+    log_summary(jobs, time.perf_counter() - start)
+    if not all(job.ok for job in jobs) and events is not None:
+        events.dump()
+    return all(job.ok for job in jobs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="广播刷写一批相同模块")
+    parser.add_argument("--force", action="store_true", help="不检查 ECU 上已安装的程序，总是刷写")
+    parser.add_argument("--trace", action="store_true", help="在内存中记录传输事件，失败时输出 (降低传输速度)")
+    args = parser.parse_args()
+    main(force=FORCE_FLASH or args.force, trace=args.trace)
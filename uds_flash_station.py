@@ -0,0 +1,184 @@
+# -*- coding:utf-8 -*-
+#  uds_flash_station.py
+#
+#  产线工位多 ECU 并行刷写: 每个 (设备, 通道, ECU) 一个刷写任务，所有任务在线程中同时执行。
+#  固件只读取、计算 CRC 一次，以只读 bytes 在任务间共享 (TransferData 直接引用 memoryview 切片)；
+#  每个通道一个接收分发器，驱动调用期间 ctypes 释放 GIL，各通道的收发互不阻塞。
+#  每个任务有自己的进度、耗时和结果记录，全部结束后输出汇总；已是相同固件的 ECU 跳过 (--force 强制刷写)。
+#
+#      python uds_flash_station.py [--force] [--trace]
+#
+import argparse
+import logging
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from zlgcan import *
+from isotp import IsoTpLayer
+from zcan_dispatch import get_dispatcher
+from zcan_log import setup_logging, PrefixAdapter, EVENT_BUFFER_SIZE
+from uds_IAP import (UdsClient, load_firmware, open_uds_channel, flash_ecu,
+                     FIRMWARE_FILE, CAN_FD, CANFD_TX_DL, BLOCK_SIZE_OVERRIDE, FORCE_FLASH)
+
+log = logging.getLogger("station")
+
+# 一个刷写目标: 设备类型/索引、通道、ECU 的请求/响应 ID
+FlashTarget = namedtuple("FlashTarget", "device_type device_index channel tx_id rx_id")
+
+# 工位配置: 两台 USBCANFD-200U，每台 2 个通道，每个通道一个 ECU
+STATION_TARGETS = [
+    FlashTarget(ZCAN_USBCANFD_200U, 0, 0, 0x7E0, 0x7E8),
+    FlashTarget(ZCAN_USBCANFD_200U, 0, 1, 0x7E0, 0x7E8),
+    FlashTarget(ZCAN_USBCANFD_200U, 1, 0, 0x7E0, 0x7E8),
+    FlashTarget(ZCAN_USBCANFD_200U, 1, 1, 0x7E0, 0x7E8),
+]
+
+
+class FlashJob(object):
+    """一个刷写任务的进度、耗时和结果"""
+    def __init__(self, target):
+        self.target = target
+        self.name = "dev%d/ch%d/0x%X" % (target.device_index, target.channel, target.tx_id)
+        self.state = "pending" # pending / running / ok / skipped / failed
+        self.written = 0
+        self.total = 0
+        self.start_time = None
+        self.elapsed = None
+        self.error = None
+        self.lock = threading.Lock()
+
+    @property
+    def ok(self):
+        return self.state in ("ok", "skipped")
+
+    def progress(self, written, total):
+        with self.lock:
+            self.written = written
+            self.total = total
+
+    def finish(self, error=None, skipped=False):
+        """:param skipped: ECU 已是相同固件，没有刷写"""
+        self.elapsed = time.perf_counter() - self.start_time if self.start_time is not None else 0.0
+        self.error = error
+        self.state = "failed" if error is not None else "skipped" if skipped else "ok"
+
+
+class FlashStation(object):
+    """
+    打开目标涉及的全部设备和通道 (每个只打开一次)，并行执行刷写任务
+        station = FlashStation(STATION_TARGETS)
+        jobs = station.run(fw_data, total_crc)
+        station.close()
+    """
+    def __init__(self, targets, zcan=None, fd=CAN_FD, timing=None, block_size=BLOCK_SIZE_OVERRIDE, force=FORCE_FLASH):
+        self.targets = list(targets)
+        self.zcan = zcan if zcan is not None else ZCAN()
+        self.fd = fd
+        self.timing = timing
+        self.block_size = block_size
+        self.force = force
+        self._devices = {}  # (device_type, device_index) -> device handle
+        self._channels = {} # (device_type, device_index, channel) -> (chn_handle, device_queue, dispatcher)
+
+    def _device_key(self, target):
+        return (getattr(target.device_type, "value", target.device_type), target.device_index)
+
+    def open(self):
+        """打开设备、初始化通道 (按该通道上全部 ECU 的响应 ID 滤波)；打不开的设备上的任务在 run() 中记为失败"""
+        rx_ids = {}
+        for target in self.targets:
+            rx_ids.setdefault(self._device_key(target) + (target.channel,), []).append(target.rx_id)
+        for target in self.targets:
+            key = self._device_key(target)
+            if key not in self._devices:
+                handle = self.zcan.OpenDevice(target.device_type, target.device_index, 0)
+                self._devices[key] = handle
+                if handle == INVALID_DEVICE_HANDLE:
+                    log.error("打开设备失败: 类型 %d 索引 %d", key[0], key[1])
+            handle = self._devices[key]
+            chn_key = key + (target.channel,)
+            if handle == INVALID_DEVICE_HANDLE or chn_key in self._channels:
+                continue
+            chn_handle, device_queue = open_uds_channel(self.zcan, handle, target.channel, rx_ids[chn_key], self.fd)
+            dispatcher = get_dispatcher(self.zcan, chn_handle, fd=self.fd)
+            self._channels[chn_key] = (chn_handle, device_queue, dispatcher)
+        return self
+
+    def close(self):
+        for _, _, dispatcher in self._channels.values():
+            dispatcher.release()
+        for handle in self._devices.values():
+            if handle != INVALID_DEVICE_HANDLE:
+                self.zcan.CloseDevice(handle)
+        self._channels.clear()
+        self._devices.clear()
+
+    def _run_job(self, job, fw_data, total_crc):
+        channel = self._channels.get(self._device_key(job.target) + (job.target.channel,))
+        job.start_time = time.perf_counter()
+        job.total = len(fw_data)
+        if channel is None:
+            job.finish("设备或通道未打开")
+            return job
+        chn_handle, device_queue, dispatcher = channel
+        logger = PrefixAdapter(logging.getLogger("uds"), job.name)
+        tp = IsoTpLayer(self.zcan, chn_handle, job.target.tx_id, job.target.rx_id, fd=self.fd, tx_dl=CANFD_TX_DL,
+                        dispatcher=dispatcher, device_queue=device_queue)
+        job.state = "running"
+        try:
+            flashed = flash_ecu(UdsClient(tp, logger), fw_data, total_crc, self.timing, self.block_size,
+                                progress=job.progress, logger=logger, force=self.force)
+            job.finish(skipped=not flashed)
+        except Exception as e:
+            logger.error("刷写失败: %s", e)
+            job.finish(str(e))
+        finally:
+            tp.close()
+        return job
+
+    def run(self, fw_data, total_crc):
+        """每个目标一个线程并行刷写，返回 FlashJob 列表 (与 targets 顺序相同)"""
+        if not self._channels and not self._devices:
+            self.open()
+        jobs = [FlashJob(target) for target in self.targets]
+        with ThreadPoolExecutor(max_workers=max(1, len(jobs))) as pool:
+            for future in [pool.submit(self._run_job, job, fw_data, total_crc) for job in jobs]:
+                future.result()
+        return jobs
+
+
+def log_summary(jobs, wall_time):
+    """输出各任务的结果、耗时和吞吐量"""
+    log.info("%-22s %-7s %9s %10s %9s  %s", "ECU", "结果", "耗时(s)", "字节", "KB/s", "错误")
+    for job in jobs:
+        rate = job.written / 1024.0 / job.elapsed if job.elapsed else 0.0
+        log.info("%-22s %-7s %9.2f %10d %9.1f  %s", job.name, job.state, job.elapsed or 0.0,
+                 job.written, rate, job.error or "")
+    passed = sum(1 for job in jobs if job.ok)
+    skipped = sum(1 for job in jobs if job.state == "skipped")
+    log.info("成功 %d / %d (其中 %d 个已是相同固件)，总耗时 %.2fs", passed, len(jobs), skipped, wall_time)
+
+
+def main(targets=STATION_TARGETS, firmware=FIRMWARE_FILE, zcan=None, force=FORCE_FLASH, trace=False):
+    events = setup_logging(logging.INFO, EVENT_BUFFER_SIZE if trace else 0)
+    fw_data, total_crc = load_firmware(firmware)
+    log.info("固件: %s, %d Bytes, CRC 0x%08X, %d 个刷写目标", firmware, len(fw_data), total_crc, len(targets))
+    station = FlashStation(targets, zcan, force=force)
+    start = time.perf_counter()
+    try:
+        jobs = station.open().run(fw_data, total_crc)
+    finally:
+        station.close()
+    log_summary(jobs, time.perf_counter() - start)
+    if not all(job.ok for job in jobs) and events is not None:
+        events.dump()
+    return all(job.ok for job in jobs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="多 ECU 并行刷写")
+    parser.add_argument("--force", action="store_true", help="不检查 ECU 上已安装的程序，总是刷写")
+    parser.add_argument("--trace", action="store_true", help="在内存中记录传输事件，失败时输出 (降低传输速度)")
+    args = parser.parse_args()
+    main(force=FORCE_FLASH or args.force, trace=args.trace)
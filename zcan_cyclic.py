@@ -0,0 +1,210 @@
+# -*- coding:utf-8 -*-
+#  zcan_cyclic.py
+#
+#  周期报文 (TesterPresent、网络管理帧等) 的注册/更新/取消。
+#  优先交给设备固件定时发送 (ZCAN auto_send)，设备不支持、条目已满或设置失败时该报文退回主机侧调度线程，
+#  主机侧按绝对截止时间调度 (不累积漂移)，并在截止前短暂自旋以降低抖动。
+#
+import heapq
+import logging
+import threading
+import time
+from zlgcan import *
+
+log = logging.getLogger(__name__)
+
+AUTO_TRANSMIT_MAX = 32    # 设备每通道定时发送条目数
+HOST_SPIN_S = 0.001       # 主机侧调度在截止时间前自旋等待的时长
+
+
+def sleep_until(deadline, spin_s = HOST_SPIN_S):
+    """等到 time.perf_counter() >= deadline: 先 sleep 到截止前 spin_s，再自旋"""
+    remaining = deadline - time.perf_counter()
+    if remaining > spin_s:
+        time.sleep(remaining - spin_s)
+    while time.perf_counter() < deadline:
+        pass
+
+
+class _CyclicMsg(object):
+    def __init__(self, index, can_id, payload, period_s, eff, is_fd):
+        self.index = index
+        self.can_id = can_id
+        self.payload = bytes(payload)
+        self.period_s = period_s
+        self.eff = eff
+        self.is_fd = is_fd
+        self.slot = None    # 设备定时发送条目号，None 表示由主机侧发送
+        self.generation = 0 # 主机侧: 更新/取消后旧的调度项作废
+        self.sent = 0
+
+    @property
+    def on_device(self):
+        return self.slot is not None
+
+
+class CyclicSender(object):
+    """
+    一个通道上的周期报文管理器
+        sender = CyclicSender(zcan, dev_handle, 0, chn_handle)
+        idx = sender.add(0x7DF, b'\\x02\\x3E\\x80', 2.0)   # TesterPresent, 2s
+        sender.update(idx, period_s=1.0)
+        sender.cancel(idx)
+        sender.stop()
+    """
+    def __init__(self, zcan, device_handle, chn_index, chn_handle, use_device = True, spin_s = HOST_SPIN_S):
+        self.zcan = zcan
+        self.device_handle = device_handle
+        self.chn_index = chn_index
+        self.chn_handle = chn_handle
+        self.use_device = use_device
+        self.spin_s = spin_s
+        self._msgs = {}
+        self._next_index = 0
+        self._free_slots = list(range(AUTO_TRANSMIT_MAX)) # 空闲的设备条目号 (小顶堆)
+        self._cond = threading.Condition()
+        self._heap = []       # [(deadline, generation, index)]
+        self._thread = None
+        self._running = False
+
+    # --- 公共接口 -------------------------------------------------------------
+    def add(self, can_id, payload, period_s, eff = 0, is_fd = False):
+        """注册周期报文，返回条目编号 (用于 update/cancel)"""
+        with self._cond:
+            index = self._next_index
+            self._next_index += 1
+            msg = _CyclicMsg(index, can_id, payload, period_s, eff, is_fd)
+            self._msgs[index] = msg
+        self._start(msg)
+        return index
+
+    def update(self, index, payload = None, period_s = None):
+        """
+        更新报文内容和/或周期；设备侧更新失败时取消设备条目，改由主机侧发送
+        :return: True 新的内容/周期已生效；False 设备条目既没有更新也无法取消 (旧报文可能仍在发送)
+        """
+        msg = self._msgs[index]
+        with self._cond:
+            if payload is not None:
+                msg.payload = bytes(payload)
+            if period_s is not None:
+                msg.period_s = period_s
+        if msg.on_device:
+            if self._device_set(msg):
+                return True
+            log.warning("设备定时发送条目 %d (ID 0x%X) 更新失败，改由主机发送", msg.slot, msg.can_id)
+            if not self._device_release(msg):
+                log.error("设备定时发送条目无法取消，旧的报文可能仍在发送")
+                return False
+        self._host_schedule(msg, time.perf_counter())
+        return True
+
+    def cancel(self, index):
+        msg = self._msgs.pop(index, None)
+        if msg is None:
+            return
+        if msg.on_device:
+            if not self._device_release(msg):
+                log.error("设备定时发送条目 (ID 0x%X) 取消失败", msg.can_id)
+        else:
+            with self._cond:
+                msg.generation += 1
+                self._cond.notify()
+
+    def stop(self):
+        """取消全部周期报文并停止主机侧调度线程"""
+        if any(msg.on_device for msg in self._msgs.values()):
+            self.zcan.clear_auto_transmit(self.device_handle, self.chn_index)
+        self._msgs.clear()
+        self._free_slots = list(range(AUTO_TRANSMIT_MAX))
+        with self._cond:
+            self._running = False
+            self._heap = []
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def is_on_device(self, index):
+        return self._msgs[index].on_device
+
+    def sent_count(self, index):
+        """主机侧已发送次数 (设备侧发送的次数无法获取，返回 None)"""
+        msg = self._msgs[index]
+        return None if msg.on_device else msg.sent
+
+    # --- 设备侧 ---------------------------------------------------------------
+    def _device_set(self, msg, slot = None):
+        slot = msg.slot if slot is None else slot
+        ret = self.zcan.set_auto_transmit(self.device_handle, self.chn_index, slot, msg.can_id,
+                                          msg.payload, int(round(msg.period_s * 1000)), msg.eff, msg.is_fd)
+        if ret == ZCAN_STATUS_OK:
+            ret = self.zcan.apply_auto_transmit(self.device_handle, self.chn_index)
+        return ret == ZCAN_STATUS_OK
+
+    def _device_release(self, msg):
+        """取消设备条目并归还条目号，返回是否取消成功 (失败时条目号不再使用)"""
+        slot = msg.slot
+        msg.slot = None
+        ok = (self.zcan.cancel_auto_transmit(self.device_handle, self.chn_index, slot, msg.is_fd) == ZCAN_STATUS_OK
+              and self.zcan.apply_auto_transmit(self.device_handle, self.chn_index) == ZCAN_STATUS_OK)
+        if ok:
+            with self._cond:
+                heapq.heappush(self._free_slots, slot)
+        return ok
+
+    def _start(self, msg):
+        with self._cond:
+            slot = heapq.heappop(self._free_slots) if self.use_device and self._free_slots else None
+        if slot is not None:
+            if self._device_set(msg, slot):
+                msg.slot = slot
+                return
+            # 只有这一条退回主机侧，条目号留给之后的报文
+            with self._cond:
+                heapq.heappush(self._free_slots, slot)
+        self._host_schedule(msg, time.perf_counter())
+
+    # --- 主机侧 ---------------------------------------------------------------
+    def _host_schedule(self, msg, first_deadline):
+        with self._cond:
+            msg.generation += 1
+            heapq.heappush(self._heap, (first_deadline, msg.generation, msg.index))
+            if self._thread is None:
+                self._running = True
+                self._thread = threading.Thread(target = self._run, daemon = True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and not self._heap:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                deadline, generation, index = self._heap[0]
+                remaining = deadline - time.perf_counter()
+                if remaining > self.spin_s:
+                    # 先睡到截止前，期间有新的/更新的条目会被唤醒重新检查
+                    self._cond.wait(remaining - self.spin_s)
+                    continue
+                heapq.heappop(self._heap)
+                msg = self._msgs.get(index)
+                if msg is None or msg.generation != generation:
+                    continue
+            sleep_until(deadline, self.spin_s)
+            if msg.is_fd:
+                self.zcan.transmit_many_fd(self.chn_handle, ((msg.can_id, msg.payload),), msg.eff)
+            else:
+                self.zcan.transmit_many(self.chn_handle, ((msg.can_id, msg.payload),), msg.eff)
+            msg.sent += 1
+            with self._cond:
+                if msg.generation != generation:
+                    continue
+                # 按绝对时间推进，落后超过一个周期时跳过错过的周期
+                deadline += msg.period_s
+                now = time.perf_counter()
+                if deadline < now:
+                    deadline += ((now - deadline) // msg.period_s + 1) * msg.period_s
+                heapq.heappush(self._heap, (deadline, generation, index))
@@ -0,0 +1,226 @@
+# -*- coding:utf-8 -*-
+#  zcan_dispatch.py
+#
+#  通道接收分发器: 每个通道只有一个接收线程调用 ZCAN.Receive/ReceiveFD，
+#  按 CAN ID (或 ID 范围) 把报文分发到各订阅者的有界队列或回调，
+#  这样总线监视 (GUI) 和刷写任务 (ISO-TP/UDS) 可以同时运行而互不抢帧。
+#
+#      dispatcher = get_dispatcher(zcan, chn_handle)    # 引用计数 +1
+#      sub = dispatcher.subscribe(ids=[0x7E8])          # 队列方式
+#      msg = sub.get(1.0)                               # ZCAN_Receive_Data 副本或 None
+#      dispatcher.subscribe(callback=on_frame)          # 不指定 ID: 接收全部报文
+#      dispatcher.release()                             # 最后一个使用者释放时才停止接收线程
+#
+import logging
+import threading
+import weakref
+from collections import deque
+from zlgcan import *
+
+log = logging.getLogger(__name__)
+
+DISPATCH_WAIT_S  = 0.05 # 接收线程单次阻塞等待的最长时间 (决定 stop() 的响应速度)
+RX_QUEUE_SIZE    = 4096 # 订阅队列默认容量，满了丢弃最旧的报文
+RANGE_EXPAND_MAX = FILTER_ID_SET_MAX # 不超过该大小的 ID 范围展开到查找表中
+
+
+class RxSubscription(object):
+    """
+    一个订阅: 有 callback 时在接收线程中直接调用 callback(msg)，否则放入有界队列
+    msg 为 ZCAN_Receive_Data / ZCAN_ReceiveFD_Data 的独立副本，可以长期保存
+    """
+    def __init__(self, dispatcher, ids, ranges, callback, maxsize):
+        self.dispatcher = dispatcher
+        self.ids = tuple(ids)
+        self.ranges = tuple(ranges)
+        self.callback = callback
+        self.dropped = 0 # 队列满被丢弃的报文数
+        self.errors = 0  # callback 抛出异常的次数
+        self._queue = deque(maxlen = maxsize)
+        self._cond = threading.Condition()
+
+    def _deliver(self, msg):
+        if self.callback is not None:
+            try:
+                self.callback(msg)
+            except Exception:
+                # 一个订阅者出错不能停掉接收线程，其它订阅者照常收帧
+                self.errors += 1
+                if self.errors == 1:
+                    log.exception("订阅回调出错 (CAN ID 0x%X)，之后的错误只计数", msg.frame.can_id)
+                else:
+                    log.debug("订阅回调出错 %d 次", self.errors, exc_info=True)
+            return
+        with self._cond:
+            if len(self._queue) == self._queue.maxlen:
+                self.dropped += 1
+            self._queue.append(msg)
+            self._cond.notify()
+
+    def get(self, timeout = None):
+        """取一帧，超时返回 None (timeout=None 一直等待)"""
+        with self._cond:
+            if not self._queue:
+                self._cond.wait_for(lambda: self._queue, timeout)
+            return self._queue.popleft() if self._queue else None
+
+    def get_many(self, max_num, timeout = None):
+        """取最多 max_num 帧 (list)，超时返回空列表"""
+        with self._cond:
+            if not self._queue:
+                self._cond.wait_for(lambda: self._queue, timeout)
+            queue = self._queue
+            return [queue.popleft() for _ in range(min(max_num, len(queue)))]
+
+    def clear(self):
+        with self._cond:
+            self._queue.clear()
+
+    def close(self):
+        self.dispatcher.unsubscribe(self)
+
+
+class RxDispatcher(object):
+    """
+    通道接收分发器
+    查找表 _by_id 为 {can_id: (订阅者...)}，每帧一次字典查找；
+    不指定 ID 的订阅者 (监视) 合并进每个表项，未登记的 ID 直接分发给它们。
+    查找表在订阅变化时整体重建后替换，接收线程读取时不需要加锁。
+    """
+    def __init__(self, zcan, chn_handle, fd = False, batch = RX_WAIT_BATCH, wait_s = DISPATCH_WAIT_S):
+        self.zcan = zcan
+        self.chn_handle = chn_handle
+        self.fd = fd
+        self.batch = batch
+        self.wait_s = wait_s
+        self._subs = []
+        self._lock = threading.Lock()
+        self._by_id = {}
+        self._wildcard = ()
+        self._big_ranges = ()
+        self._threads = []
+        self._running = False
+        self._refs = 0 # get_dispatcher() 取得、尚未 release() 的使用者数
+
+    def subscribe(self, ids = (), ranges = (), callback = None, maxsize = RX_QUEUE_SIZE):
+        """
+        订阅报文
+        :param ids: CAN ID 列表
+        :param ranges: [(first, last), ...] ID 范围 (含两端)
+        :param callback: 回调函数 callback(msg)，在接收线程中调用，应尽快返回
+        :param maxsize: 队列容量 (无 callback 时)
+        ids 和 ranges 都为空时接收全部报文
+        """
+        sub = RxSubscription(self, ids, ranges, callback, maxsize)
+        with self._lock:
+            self._subs.append(sub)
+            self._rebuild()
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            if sub in self._subs:
+                self._subs.remove(sub)
+                self._rebuild()
+
+    def _rebuild(self):
+        wildcard = tuple(sub for sub in self._subs if not sub.ids and not sub.ranges)
+        by_id = {}
+        big_ranges = []
+        for sub in self._subs:
+            for can_id in sub.ids:
+                by_id.setdefault(can_id, []).append(sub)
+            for first, last in sub.ranges:
+                if last - first < RANGE_EXPAND_MAX:
+                    for can_id in range(first, last + 1):
+                        by_id.setdefault(can_id, []).append(sub)
+                else:
+                    big_ranges.append((first, last, sub))
+        self._by_id = {can_id: tuple(subs) + wildcard for can_id, subs in by_id.items()}
+        self._wildcard = wildcard
+        self._big_ranges = tuple(big_ranges)
+
+    # --- 接收线程 -------------------------------------------------------------
+    def start(self):
+        if self._running:
+            return self
+        self._running = True
+        can_types = (ZCAN_TYPE_CAN, ZCAN_TYPE_CANFD) if self.fd else (ZCAN_TYPE_CAN,)
+        for can_type in can_types:
+            thread = threading.Thread(target = self._run, args = (can_type,), daemon = True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def release(self):
+        """
+        使用者用完分发器 (与 get_dispatcher 成对调用)；最后一个使用者释放时停止接收线程，
+        其它使用者 (例如监视界面) 还在时接收照常进行
+        """
+        with _dispatchers_lock:
+            self._refs -= 1
+            if self._refs > 0:
+                return
+            _forget_locked(self)
+        self.stop()
+
+    def stop(self):
+        """立即停止接收线程，影响该通道的全部订阅者 (一般应使用 release())"""
+        self._running = False
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        _forget(self)
+
+    def _run(self, can_type):
+        while self._running:
+            msgs, cnt = self.zcan.receive_wait(self.chn_handle, self.wait_s, self.batch, can_type)
+            if cnt:
+                self._dispatch(msgs, cnt)
+
+    def _dispatch(self, msgs, cnt):
+        by_id = self._by_id
+        wildcard = self._wildcard
+        big_ranges = self._big_ranges
+        msg_type = msgs._type_
+        for i in range(cnt):
+            msg = msgs[i]
+            can_id = msg.frame.can_id
+            subs = by_id.get(can_id, wildcard)
+            if big_ranges:
+                subs = subs + tuple(sub for first, last, sub in big_ranges if first <= can_id <= last)
+            if not subs:
+                continue
+            # 接收缓冲区下次 Receive 会被覆盖，交给订阅者的是副本
+            copy = msg_type.from_buffer_copy(msg)
+            for sub in subs:
+                sub._deliver(copy)
+
+
+# 每个 (ZCAN, 通道) 只有一个分发器
+_dispatchers = weakref.WeakKeyDictionary()
+_dispatchers_lock = threading.Lock()
+
+def get_dispatcher(zcan, chn_handle, fd = False):
+    """
+    取得 (必要时创建并启动) 通道的分发器，引用计数加一；用完后调用 dispatcher.release()
+    通道已有分发器但 fd 不同时抛出 ValueError (同一通道不能有两个接收线程读取 CAN 报文)
+    """
+    with _dispatchers_lock:
+        per_zcan = _dispatchers.setdefault(zcan, {})
+        dispatcher = per_zcan.get(chn_handle)
+        if dispatcher is None:
+            dispatcher = per_zcan[chn_handle] = RxDispatcher(zcan, chn_handle, fd)
+        elif dispatcher.fd != fd:
+            raise ValueError(f"channel dispatcher already created with fd={dispatcher.fd}, requested fd={fd}")
+        dispatcher._refs += 1
+        return dispatcher.start()
+
+def _forget(dispatcher):
+    with _dispatchers_lock:
+        _forget_locked(dispatcher)
+
+def _forget_locked(dispatcher):
+    per_zcan = _dispatchers.get(dispatcher.zcan)
+    if per_zcan and per_zcan.get(dispatcher.chn_handle) is dispatcher:
+        del per_zcan[dispatcher.chn_handle]
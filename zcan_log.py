@@ -0,0 +1,97 @@
+# -*- coding:utf-8 -*-
+#  zcan_log.py
+#
+#  诊断日志: 各模块使用 logging.getLogger(__name__)，消息用 %-参数延迟格式化，
+#  级别未开启时不做任何字符串格式化。
+#  可选的事件环形缓冲区 (TransferEventBuffer) 在内存中保留最近的 LogRecord (不格式化)，
+#  刷写失败时再 dump() 出来，平时控制台只输出 INFO 及以上。
+#  缓冲区需要 DEBUG 级别，每条 log.debug 都会生成 LogRecord，所以只在排查问题时开启
+#  (刷写脚本的 --trace 参数)，默认不开启。
+#
+#      events = setup_logging(logging.INFO, event_buffer=EVENT_BUFFER_SIZE if args.trace else 0)
+#      ...
+#      events.dump()      # 失败时输出最近的 DEBUG 事件
+#
+import logging
+import sys
+from collections import deque
+
+EVENT_BUFFER_SIZE = 2000 # 环形缓冲区保留的事件数
+HEXDUMP_MAX       = 64   # hexdump 最多显示的字节数
+
+
+class TransferEventBuffer(logging.Handler):
+    """环形缓冲区: 保存最近 capacity 条 LogRecord，消息在 dump() 时才格式化"""
+    def __init__(self, capacity=EVENT_BUFFER_SIZE, level=logging.DEBUG):
+        logging.Handler.__init__(self, level)
+        self.records = deque(maxlen=capacity)
+        self.setFormatter(logging.Formatter("%(relativeCreated)10.1f ms %(levelname)-7s %(name)s: %(message)s"))
+
+    def emit(self, record):
+        self.records.append(record)
+
+    def events(self):
+        """结构化事件: [(时间戳, logger 名, 级别, 消息模板, 参数), ...]"""
+        return [(r.created, r.name, r.levelname, r.msg, r.args) for r in list(self.records)]
+
+    def dump(self, stream=None):
+        """把缓冲区中的事件格式化输出 (默认 stderr)"""
+        stream = stream or sys.stderr
+        records = list(self.records)
+        stream.write(f"--- 最近 {len(records)} 条传输事件 ---\n")
+        for record in records:
+            stream.write(self.format(record) + "\n")
+        stream.flush()
+
+    def clear(self):
+        self.records.clear()
+
+
+class _HexBytes(object):
+    __slots__ = ("data", "limit")
+
+    def __init__(self, data, limit):
+        self.data = data
+        self.limit = limit
+
+    def __str__(self):
+        text = bytes(self.data[:self.limit]).hex(" ").upper()
+        if len(self.data) > self.limit:
+            text += f" ... ({len(self.data)} 字节)"
+        return text
+
+
+def hexdump(data, limit=HEXDUMP_MAX):
+    """延迟格式化的十六进制显示: log.debug("Data: %s", hexdump(data))，只有输出时才转换"""
+    return _HexBytes(data, limit)
+
+
+class PrefixAdapter(logging.LoggerAdapter):
+    """给消息加上前缀 (例如并行刷写时的 ECU 名称)；级别未开启时同样不做格式化"""
+    def __init__(self, logger, prefix):
+        logging.LoggerAdapter.__init__(self, logger, prefix)
+
+    def process(self, msg, kwargs):
+        return "[%s] %s" % (self.extra, msg), kwargs
+
+
+def setup_logging(level=logging.INFO, event_buffer=0, fmt="%(message)s"):
+    """
+    脚本入口调用: 控制台输出 level 及以上的日志
+    :param event_buffer: > 0 时另外在内存中保留最近 event_buffer 条 DEBUG 及以上的事件
+                         (根 logger 降为 DEBUG，传输热路径上的 log.debug 不再是空操作)
+    :return: TransferEventBuffer 或 None
+    """
+    root = logging.getLogger()
+    console = logging.StreamHandler()
+    console.setLevel(level)
+    console.setFormatter(logging.Formatter(fmt))
+    root.addHandler(console)
+    buffer = None
+    if event_buffer:
+        buffer = TransferEventBuffer(event_buffer)
+        root.addHandler(buffer)
+        root.setLevel(logging.DEBUG)
+    else:
+        root.setLevel(level)
+    return buffer
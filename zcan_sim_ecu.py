@@ -0,0 +1,234 @@
+# -*- coding:utf-8 -*-
+#  zcan_sim_ecu.py
+#
+#  仿真 ECU (App + Bootloader)，挂接到 zcan_virtual.VirtualBus 上，在没有硬件的环境下
+#  测试 uds_IAP.py / uds_flash_station.py / uds_broadcast.py 的刷写流程。
+#
+#  - App: 10 02 回复 50 02 后 (reset_latency 秒后) 复位，boot_delay 秒内不响应任何报文，之后进入 Bootloader；
+#    22 F1 A0 回复已安装程序的 [长度][CRC32] (小端)，37 校验通过后复位回到 App 并安装新程序
+#  - Bootloader: 34 (回复 maxNumberOfBlockLength) -> 31 擦除 (先回 NRC 0x78) -> 36 循环 -> 37 校验 CRC
+#  - 可选广播 ID (broadcast_id): 36 数据块可以发到广播 ID，所有 ECU 同时接收；
+#    只有 leader 回复流控和 0x76，其余 ECU 静默接收，丢帧或序号错误时记下失败，37 回复 NRC 0x72；
+#    Bootloader 中 31 01 FF 01 <1/0> 设置/取消本 ECU 为 leader (uds_broadcast.LEADER_RID)
+#  - 只支持经典 CAN (8 字节帧)
+#
+#      bus = VirtualBus(latency=0.0002, bitrate=500000)
+#      bus.attach(SimBootloaderEcu(0x7E0, 0x7E8, broadcast_id=0x7F0))
+#      bus.attach(SimBootloaderEcu(0x7E1, 0x7E9, broadcast_id=0x7F0))
+#
+import binascii
+import logging
+import struct
+import threading
+from uds_IAP import APP_FINGERPRINT_DID
+from uds_broadcast import LEADER_RID
+from isotp import IsoTpReassembler, ISOTP_FRAME_SF, ISOTP_FRAME_FF, ISOTP_FRAME_CF, ISOTP_FRAME_FC
+
+log = logging.getLogger(__name__)
+
+SIM_PADDING = 0xCC # 仿真 ECU 发送帧的填充字节
+
+
+class SimBootloaderEcu(object):
+    def __init__(self, rx_id, tx_id, functional_id=0x7DF, broadcast_id=None, leader=False,
+                 boot_delay=0.3, erase_time=0.2, max_block_length=4094, start_in_boot=False,
+                 rx_bs=8, drop_broadcast_cf=None, app_image=None, reset_latency=0.0):
+        """
+        :param rx_id: 物理请求 ID (ECU 接收)
+        :param tx_id: 响应 ID (ECU 发送)
+        :param broadcast_id: 广播下载 ID，None 时不接收广播
+        :param leader: 广播下载时由本 ECU 回复流控和 0x76 (初始值，上位机可用 31 01 FF 01 修改)
+        :param boot_delay: 10 02 之后复位到 Bootloader 就绪的时间 (秒)
+        :param erase_time: 擦除耗时 (秒)，期间回复 NRC 0x78
+        :param max_block_length: 0x74 响应中的 maxNumberOfBlockLength (含 SID 和序号)
+        :param rx_bs: 回复给上位机的 BlockSize
+        :param drop_broadcast_cf: 故障注入: 丢弃第 n 个广播连续帧 (只丢一次)
+        :param app_image: 已安装的 App (bytes)，None 时 App 不支持读取指纹
+        :param reset_latency: App 回复 50 02 之后继续正常响应的时间 (秒)，之后才开始复位
+        """
+        self.rx_id = rx_id
+        self.tx_id = tx_id
+        self.functional_id = functional_id
+        self.broadcast_id = broadcast_id
+        self.leader = leader
+        self.boot_delay = boot_delay
+        self.reset_latency = reset_latency
+        self.erase_time = erase_time
+        self.max_block_length = max_block_length
+        self.drop_broadcast_cf = drop_broadcast_cf
+        self.state = "boot" if start_in_boot else "app" # app / reset / boot
+        self.app_image = app_image
+        self.image = bytearray()
+        self.expect = None         # 34 请求中的 (长度, CRC)
+        self.block_seq = 1
+        self.broadcast_failed = False
+        self.requests = []         # 收到的请求 (状态, SID)，测试时检查流程
+        self._rx = IsoTpReassembler(rx_bs=rx_bs)
+        self._bcast_rx = IsoTpReassembler(rx_bs=rx_bs)
+        self._bcast_cf_count = 0
+        self._pending = b''        # 多帧响应中还没发出的数据 (等上位机流控)
+        self._sn = 1
+        self._lock = threading.RLock()
+
+    # --- 总线节点回调 ---------------------------------------------------------
+    def __call__(self, bus, frame):
+        can_id = frame.can_id
+        if can_id != self.rx_id and can_id != self.functional_id and can_id != self.broadcast_id:
+            return
+        with self._lock:
+            if self.state == "reset":
+                return
+            data = bytes(frame.data)
+            if can_id == self.broadcast_id:
+                self._on_broadcast(bus, data)
+                return
+            if (data[0] & 0xF0) == ISOTP_FRAME_FC:
+                if can_id == self.rx_id:
+                    self._send_pending(bus)
+                return
+            if can_id == self.functional_id and (data[0] & 0xF0) != ISOTP_FRAME_SF:
+                return # 功能寻址只接收单帧
+            payload, fc, error = self._rx.feed(data)
+            if fc is not None:
+                self._send_frame(bus, fc)
+            if error is not None:
+                log.debug("[0x%X] 接收错误: %s", self.rx_id, error)
+            if payload is not None:
+                self.requests.append((self.state, payload[0]))
+                self.handle(bus, payload)
+
+    def _on_broadcast(self, bus, data):
+        """广播 ID 上的报文: 只接收 Bootloader 的 36，leader 负责流控和响应"""
+        if self.state != "boot":
+            return
+        pci = data[0] & 0xF0
+        if pci == ISOTP_FRAME_CF:
+            self._bcast_cf_count += 1
+            if self._bcast_cf_count == self.drop_broadcast_cf:
+                log.debug("[0x%X] 故障注入: 丢弃广播连续帧 %d", self.rx_id, self._bcast_cf_count)
+                self.drop_broadcast_cf = None
+                return
+        elif pci == ISOTP_FRAME_FC:
+            return
+        lost = self._bcast_rx.in_progress and pci in (ISOTP_FRAME_SF, ISOTP_FRAME_FF)
+        payload, fc, error = self._bcast_rx.feed(data)
+        if fc is not None and self.leader:
+            self._send_frame(bus, fc)
+        if error is not None or lost:
+            log.debug("[0x%X] 广播接收出错: %s", self.rx_id, error or "报文不完整")
+            self.broadcast_failed = True
+        if payload is None:
+            return
+        if payload[0] != 0x36:
+            return
+        self.requests.append(("broadcast", payload[0]))
+        resp = self._transfer_data(payload)
+        if self.leader:
+            self._respond(bus, resp)
+
+    # --- 发送 -----------------------------------------------------------------
+    def _send_frame(self, bus, data):
+        bus.send(self.tx_id, bytes(data).ljust(8, bytes((SIM_PADDING,))))
+
+    def _respond(self, bus, payload):
+        """单帧直接发送；多帧先发首帧，其余等上位机流控后发送"""
+        if len(payload) <= 7:
+            self._send_frame(bus, bytes((len(payload),)) + payload)
+            return
+        self._send_frame(bus, bytes((ISOTP_FRAME_FF | (len(payload) >> 8), len(payload) & 0xFF)) + payload[:6])
+        self._pending = payload[6:]
+        self._sn = 1
+
+    def _send_pending(self, bus):
+        while self._pending:
+            self._send_frame(bus, bytes((ISOTP_FRAME_CF | self._sn,)) + self._pending[:7])
+            self._pending = self._pending[7:]
+            self._sn = (self._sn + 1) & 0x0F
+
+    def _respond_later(self, bus, delay, payload):
+        def respond():
+            with self._lock:
+                self._respond(bus, payload)
+        threading.Timer(delay, respond).start()
+
+    def _reset(self, delay, state="boot"):
+        """复位: delay 秒内不响应，之后进入 state (boot / app)"""
+        self.state = "reset"
+        def boot():
+            with self._lock:
+                self.state = state
+                self._rx.reset()
+                self._bcast_rx.reset()
+        threading.Timer(delay, boot).start()
+
+    def _reset_later(self, latency, delay):
+        def reset():
+            with self._lock:
+                if self.state == "app":
+                    self._reset(delay)
+        threading.Timer(latency, reset).start()
+
+    # --- UDS 服务 -------------------------------------------------------------
+    def handle(self, bus, req):
+        sid = req[0]
+        if sid == 0x10 and len(req) >= 2:
+            self._respond(bus, bytes((0x50, req[1], 0x00, 0x32, 0x01, 0xF4)))
+            if self.state == "app" and req[1] == 0x02 and self.reset_latency > 0:
+                self._reset_later(self.reset_latency, self.boot_delay)
+            elif self.state == "app" and req[1] == 0x02:
+                self._reset(self.boot_delay)
+        elif (sid == 0x31 and self.state == "boot" and len(req) >= 5
+                and req[1:4] == bytes((0x01, LEADER_RID >> 8, LEADER_RID & 0xFF))):
+            self.leader = bool(req[4])
+            self._respond(bus, bytes((0x71,)) + req[1:4])
+        elif sid == 0x31 and len(req) >= 4:
+            if self.state == "app":
+                self._respond(bus, bytes((0x71,)) + req[1:4]) # 预编程检查
+            else:
+                self._respond(bus, bytes((0x7F, 0x31, 0x78)))
+                self._respond_later(bus, self.erase_time, bytes((0x71,)) + req[1:4])
+        elif sid == 0x22 and self.state == "app" and self.app_image is not None:
+            did = bytes((APP_FINGERPRINT_DID >> 8, APP_FINGERPRINT_DID & 0xFF))
+            if req[1:3] == did:
+                crc = binascii.crc32(self.app_image) & 0xFFFFFFFF
+                self._respond(bus, b'\x62' + did + struct.pack('<II', len(self.app_image), crc))
+            else:
+                self._respond(bus, bytes((0x7F, 0x22, 0x31))) # DID 不支持
+        elif self.state != "boot":
+            self._respond(bus, bytes((0x7F, sid, 0x7F))) # 当前会话不支持
+        elif sid == 0x34 and len(req) >= 9:
+            self.expect = struct.unpack('<II', req[1:9])
+            self.image = bytearray()
+            self.block_seq = 1
+            self.broadcast_failed = False
+            self._bcast_cf_count = 0
+            n = self.max_block_length
+            self._respond(bus, bytes((0x74, 0x20, n >> 8, n & 0xFF)))
+        elif sid == 0x36:
+            self._respond(bus, self._transfer_data(req))
+        elif sid == 0x37:
+            crc = binascii.crc32(self.image) & 0xFFFFFFFF
+            if (not self.broadcast_failed and self.expect is not None
+                    and (len(self.image), crc) == self.expect):
+                self._respond(bus, b'\x77')
+                self.app_image = bytes(self.image)
+                self._reset(self.boot_delay, "app")
+            else:
+                self._respond(bus, bytes((0x7F, 0x37, 0x72)) + struct.pack('>I', crc))
+        else:
+            self._respond(bus, bytes((0x7F, sid, 0x11)))
+
+    def _transfer_data(self, req):
+        """写入一个 36 数据块，返回响应"""
+        if self.expect is None:
+            self.broadcast_failed = True
+            return bytes((0x7F, 0x36, 0x24)) # 请求顺序错误
+        if len(req) < 2 or req[1] != self.block_seq & 0xFF:
+            self.broadcast_failed = True
+            return bytes((0x7F, 0x36, 0x73))
+        if len(req) > self.max_block_length:
+            self.broadcast_failed = True
+            return bytes((0x7F, 0x36, 0x71))
+        self.image += req[2:]
+        self.block_seq += 1
+        return bytes((0x76, req[1]))
@@ -0,0 +1,391 @@
+# -*- coding:utf-8 -*-
+#  zcan_virtual.py
+#
+#  纯 Python 的虚拟 ZCAN 后端，用于在没有 zlgcan.dll / 硬件的环境 (Linux CI、基准测试) 下
+#  运行 isotp.py、uds_IAP.py、IAP_Tool.py 等脚本。
+#
+#  用法:
+#      zcan = ZCAN(VirtualZCAN(latency=0.0002))   或设置环境变量 ZCAN_BACKEND=virtual
+#
+#  - 同一 VirtualBus 上已启动的通道互相可见 (一个通道发出的帧被其它所有通道接收，自己不回环)
+#  - latency: 发送到接收方可见之间的固定延迟 (秒)
+#  - bitrate: 可选，按帧长模拟总线占用时间，帧在总线上串行发送
+#  - 时间戳为硬件风格的微秒计数 (相对总线创建时刻)
+#  - 可以通过 VirtualBus.attach() 挂接仿真节点 (ECU)，节点收到帧后可以调用 VirtualBus.send() 回复
+#
+import collections
+import threading
+import time
+from zlgcan import *
+from zlgcan import _TX_FLAGS_OFFSET
+
+# 标准帧 (11bit ID) 在不计位填充时的大致位数: SOF..EOF + IFS
+_CAN_FRAME_OVERHEAD_BITS = 47
+
+# 虚拟设备不支持的属性 (设备定时发送)，上层应退回主机侧实现
+_UNSUPPORTED_VALUES = ("auto_send", "auto_send_canfd", "apply_auto_send", "clear_auto_send")
+
+# 队列发送模式下设备发送队列的容量 (帧)
+VIRTUAL_TX_QUEUE_SIZE = 64
+
+VirtualFrame = collections.namedtuple("VirtualFrame", "can_id data eff rtr is_fd brs timestamp")
+
+
+def _value(v):
+    """ctypes 数值对象或 int 统一转为 int"""
+    return getattr(v, "value", v)
+
+
+def _path(path):
+    return path.decode("utf-8") if isinstance(path, bytes) else path
+
+
+class _VirtualChannel(object):
+    def __init__(self, device, index, bus):
+        self.device = device
+        self.index = index
+        self.bus = bus
+        self.started = False
+        # 每个元素: (ready_time, VirtualFrame)
+        self.rx = {False: collections.deque(), True: collections.deque()}
+        # 队列发送: 已排队帧的发出时刻，以及队列中最后一帧发出后的最早空闲时刻
+        self.tx_queue = collections.deque()
+        self.tx_busy_until = 0.0
+
+    def queue_mode(self):
+        return _path(self.device["values"].get("%d/set_send_mode" % self.index, "0")) == "1"
+
+    def tx_queue_free(self, now):
+        queue = self.tx_queue
+        while queue and queue[0] <= now:
+            queue.popleft()
+        return VIRTUAL_TX_QUEUE_SIZE - len(queue)
+
+    def accepts(self, can_id, eff):
+        """按 filter_ack 生效的范围滤波判断是否接收，未设置滤波时全部接收"""
+        ranges = self.device["filters"].get(self.index)
+        if not ranges:
+            return True
+        for mode, start, end in ranges:
+            if mode == eff and start <= can_id <= end:
+                return True
+        return False
+
+
+class VirtualBus(object):
+    """一条虚拟 CAN 总线"""
+    def __init__(self, latency = 0.0, bitrate = None):
+        self.latency = latency
+        self.bitrate = bitrate
+        self._cond = threading.Condition(threading.RLock())
+        self._channels = []
+        self._nodes = []
+        self._epoch = time.perf_counter()
+        self._bus_free_at = 0.0
+
+    def timestamp(self, t = None):
+        """硬件风格时间戳 (us)"""
+        if t is None:
+            t = time.perf_counter()
+        return int((t - self._epoch) * 1000000)
+
+    def attach(self, node):
+        """
+        挂接仿真节点，node(bus, frame) 在每一帧被发送到总线时调用 (在发送方线程中)，
+        可在回调里调用 bus.send() 回复
+        """
+        self._nodes.append(node)
+
+    def detach(self, node):
+        self._nodes.remove(node)
+
+    def _frame_time(self, data_len, is_fd):
+        if not self.bitrate:
+            return 0.0
+        return (_CAN_FRAME_OVERHEAD_BITS + data_len * 8) / float(self.bitrate)
+
+    def send(self, can_id, data, eff = 0, rtr = 0, is_fd = False, brs = 0, src = None, delay = 0.0):
+        """
+        把一帧放到总线上: 其它已启动的通道在 latency (+delay) 之后可以收到
+        :param src: 发送通道 (不回环给自己)；仿真节点发送时为 None
+        """
+        data = bytes(data)
+        with self._cond:
+            now = time.perf_counter()
+            start = max(now + delay, self._bus_free_at)
+            self._bus_free_at = start + self._frame_time(len(data), is_fd)
+            ready = self._bus_free_at + self.latency
+            frame = VirtualFrame(can_id, data, eff, rtr, is_fd, brs, self.timestamp(ready))
+            for chn in self._channels:
+                if chn is not src and chn.started and chn.accepts(can_id, eff):
+                    chn.rx[is_fd].append((ready, frame))
+            self._cond.notify_all()
+            nodes = list(self._nodes)
+        for node in nodes:
+            node(self, frame)
+        return frame
+
+    def _ready_count(self, chn, is_fd, now):
+        count = 0
+        for ready, _ in chn.rx[is_fd]:
+            if ready > now:
+                break
+            count += 1
+        return count
+
+    def _wait_ready(self, chn, is_fd, wait_ms):
+        """在锁内调用: 等到至少一帧可见或超时，返回当前时间"""
+        deadline = None if wait_ms < 0 else time.perf_counter() + wait_ms / 1000.0
+        while True:
+            now = time.perf_counter()
+            queue = chn.rx[is_fd]
+            if queue and queue[0][0] <= now:
+                return now
+            if deadline is not None and now >= deadline:
+                return now
+            wake = []
+            if queue:
+                wake.append(queue[0][0])
+            if deadline is not None:
+                wake.append(deadline)
+            self._cond.wait(min(wake) - now if wake else None)
+
+
+class VirtualZCAN(ZCANBackend):
+    """
+    虚拟 ZCAN 后端: 每个设备的通道数由 channels 指定，默认全部挂在同一条总线上，
+    可用 connect() 把某个通道接到别的总线
+    """
+    def __init__(self, latency = 0.0, bitrate = None, channels = 2, bus = None):
+        self.bus = bus if bus is not None else VirtualBus(latency, bitrate)
+        self.channel_count = channels
+        self._lock = threading.Lock()
+        self._next_handle = 0x1000
+        self._devices = {}      # device handle -> {"type", "index", "values", "channels"}
+        self._channels = {}     # channel handle -> _VirtualChannel
+        self._bus_map = {}      # (device_index, channel_index) -> VirtualBus
+
+    def connect(self, device_index, channel_index, bus):
+        """指定某个设备通道所在的总线 (需在 InitCAN 之前调用)"""
+        self._bus_map[(device_index, channel_index)] = bus
+
+    def _alloc_handle(self):
+        with self._lock:
+            self._next_handle += 1
+            return self._next_handle
+
+    def _channel(self, chn_handle):
+        return self._channels.get(_value(chn_handle))
+
+    # --- 设备 ---------------------------------------------------------------
+    def ZCAN_OpenDevice(self, device_type, device_index, reserved):
+        handle = self._alloc_handle()
+        self._devices[handle] = {"type": _value(device_type), "index": _value(device_index),
+                                 "values": {}, "channels": {},
+                                 "filters": {}, "filter_pending": {}}
+        return handle
+
+    def ZCAN_CloseDevice(self, device_handle):
+        device = self._devices.pop(_value(device_handle), None)
+        if device is None:
+            return ZCAN_STATUS_ERR
+        for chn_handle in list(device["channels"].values()):
+            self.ZCAN_ResetCAN(chn_handle)
+            self._channels.pop(chn_handle, None)
+        return ZCAN_STATUS_OK
+
+    def ZCAN_GetDeviceInf(self, device_handle, info):
+        if _value(device_handle) not in self._devices:
+            return ZCAN_STATUS_ERR
+        info.hw_Version = info.fw_Version = info.dr_Version = info.in_Version = 0x0100
+        info.can_Num = self.channel_count
+        hw_type = b"VIRTUAL"
+        memmove(addressof(info.str_hw_Type), hw_type, len(hw_type))
+        return ZCAN_STATUS_OK
+
+    def ZCAN_IsDeviceOnLine(self, device_handle):
+        return ZCAN_STATUS_ONLINE if _value(device_handle) in self._devices else ZCAN_STATUS_OFFLINE
+
+    def ZCAN_SetValue(self, device_handle, path, value):
+        device = self._devices.get(_value(device_handle))
+        if device is None:
+            return ZCAN_STATUS_ERR
+        path = _path(path)
+        if path.partition("/")[2] in _UNSUPPORTED_VALUES:
+            return ZCAN_STATUS_ERR
+        device["values"][path] = value
+        chn, _, key = path.partition("/")
+        if key == "clear_delay_send_queue" and chn.isdigit():
+            # 已经放到虚拟总线上的帧无法撤回，这里只清空排队计数
+            handle = device["channels"].get(int(chn))
+            if handle is not None:
+                self._channels[handle].tx_queue.clear()
+        self._set_filter_value(device, path, value)
+        return ZCAN_STATUS_OK
+
+    def _set_filter_value(self, device, path, value):
+        """模拟 USBCANFD 的范围滤波: filter_clear/mode/start/end 只改待生效的设置，filter_ack 之后才生效"""
+        chn, _, key = path.partition("/")
+        if not chn.isdigit() or not key.startswith("filter_"):
+            return
+        chn = int(chn)
+        value = _path(value)
+        pending = device["filter_pending"].setdefault(chn, [])
+        if key == "filter_clear":
+            pending[:] = []
+        elif key == "filter_mode":
+            pending.append([int(value), 0, 0])
+        elif key == "filter_start" and pending:
+            pending[-1][1] = int(value, 0)
+        elif key == "filter_end" and pending:
+            pending[-1][2] = int(value, 0)
+        elif key == "filter_ack":
+            device["filters"][chn] = [tuple(r) for r in pending]
+
+    def ZCAN_GetValue(self, device_handle, path):
+        """支持 <chn>/get_device_available_tx_count/1，返回 int 结果的地址"""
+        device = self._devices.get(_value(device_handle))
+        if device is None:
+            return None
+        chn, _, key = _path(path).partition("/")
+        if key != "get_device_available_tx_count/1" or not chn.isdigit():
+            return None
+        handle = device["channels"].get(int(chn))
+        if handle is None:
+            return None
+        result = device.setdefault("get_value_result", c_int())
+        result.value = self._channels[handle].tx_queue_free(time.perf_counter())
+        return addressof(result)
+
+    def GetValue(self, device_handle, path):
+        """读取之前 ZCAN_SetValue 写入的值 (仿真用)"""
+        device = self._devices.get(_value(device_handle))
+        return None if device is None else device["values"].get(_path(path))
+
+    # --- 通道 ---------------------------------------------------------------
+    def ZCAN_InitCAN(self, device_handle, can_index, init_config):
+        device = self._devices.get(_value(device_handle))
+        can_index = _value(can_index)
+        if device is None or can_index >= self.channel_count:
+            return INVALID_CHANNEL_HANDLE
+        old = device["channels"].get(can_index)
+        if old is not None:
+            self.ZCAN_ResetCAN(old)
+            self._channels.pop(old, None)
+        bus = self._bus_map.get((device["index"], can_index), self.bus)
+        handle = self._alloc_handle()
+        self._channels[handle] = _VirtualChannel(device, can_index, bus)
+        device["channels"][can_index] = handle
+        return handle
+
+    def ZCAN_StartCAN(self, chn_handle):
+        chn = self._channel(chn_handle)
+        if chn is None:
+            return ZCAN_STATUS_ERR
+        with chn.bus._cond:
+            if not chn.started:
+                chn.started = True
+                chn.bus._channels.append(chn)
+        return ZCAN_STATUS_OK
+
+    def ZCAN_ResetCAN(self, chn_handle):
+        chn = self._channel(chn_handle)
+        if chn is None:
+            return ZCAN_STATUS_ERR
+        with chn.bus._cond:
+            if chn.started:
+                chn.started = False
+                chn.bus._channels.remove(chn)
+            chn.rx[False].clear()
+            chn.rx[True].clear()
+            chn.bus._cond.notify_all()
+        return ZCAN_STATUS_OK
+
+    def ZCAN_ClearBuffer(self, chn_handle):
+        chn = self._channel(chn_handle)
+        if chn is None:
+            return ZCAN_STATUS_ERR
+        with chn.bus._cond:
+            chn.rx[False].clear()
+            chn.rx[True].clear()
+        return ZCAN_STATUS_OK
+
+    def ZCAN_ReadChannelErrInfo(self, chn_handle, err_info):
+        return ZCAN_STATUS_OK if self._channel(chn_handle) is not None else ZCAN_STATUS_ERR
+
+    def ZCAN_ReadChannelStatus(self, chn_handle, status):
+        return ZCAN_STATUS_OK if self._channel(chn_handle) is not None else ZCAN_STATUS_ERR
+
+    def ZCAN_GetReceiveNum(self, chn_handle, can_type):
+        chn = self._channel(chn_handle)
+        if chn is None:
+            return 0
+        with chn.bus._cond:
+            return chn.bus._ready_count(chn, _value(can_type) == ZCAN_TYPE_CANFD.value, time.perf_counter())
+
+    # --- 收发 ---------------------------------------------------------------
+    def _transmit(self, chn_handle, msgs, num, data_type, is_fd):
+        chn = self._channel(chn_handle)
+        if chn is None or not chn.started:
+            return 0
+        num = _value(num)
+        frames = (data_type * num).from_address(addressof(msgs))
+        queue_mode = chn.queue_mode()
+        for i, msg in enumerate(frames):
+            f = msg.frame
+            length = f.len if is_fd else f.can_dlc
+            delay = 0.0
+            flags, delay_lo, delay_hi = (c_ubyte * 3).from_address(addressof(msg) + _TX_FLAGS_OFFSET)
+            if queue_mode and flags & TX_DELAY_SEND_FLAG:
+                # 队列发送: 按前一帧的帧间隔排队，队列满时只接收前 i 帧
+                now = time.perf_counter()
+                if chn.tx_queue_free(now) <= 0:
+                    return i
+                at = max(now, chn.tx_busy_until)
+                chn.tx_queue.append(at)
+                chn.tx_busy_until = at + (delay_lo | delay_hi << 8) / 1000.0
+                delay = at - now
+            chn.bus.send(f.can_id, bytes(f.data[:length]), f.eff, f.rtr, is_fd,
+                         f.brs if is_fd else 0, src = chn, delay = delay)
+        return num
+
+    def _receive(self, chn_handle, msgs, num, wait_time, data_type, is_fd):
+        chn = self._channel(chn_handle)
+        if chn is None:
+            return 0
+        num = _value(num)
+        out = (data_type * num).from_address(addressof(msgs))
+        bus = chn.bus
+        with bus._cond:
+            now = bus._wait_ready(chn, is_fd, _value(wait_time))
+            queue = chn.rx[is_fd]
+            count = 0
+            while count < num and queue and queue[0][0] <= now:
+                _, frame = queue.popleft()
+                msg = out[count]
+                memset(addressof(msg), 0, sizeof(msg))
+                f = msg.frame
+                f.can_id = frame.can_id
+                f.eff = frame.eff
+                f.rtr = frame.rtr
+                if is_fd:
+                    f.len = len(frame.data)
+                    f.brs = frame.brs
+                else:
+                    f.can_dlc = len(frame.data)
+                memmove(addressof(f.data), frame.data, len(frame.data))
+                msg.timestamp = frame.timestamp
+                count += 1
+            return count
+
+    def ZCAN_Transmit(self, chn_handle, msgs, num):
+        return self._transmit(chn_handle, msgs, num, ZCAN_Transmit_Data, False)
+
+    def ZCAN_TransmitFD(self, chn_handle, msgs, num):
+        return self._transmit(chn_handle, msgs, num, ZCAN_TransmitFD_Data, True)
+
+    def ZCAN_Receive(self, chn_handle, msgs, num, wait_time):
+        return self._receive(chn_handle, msgs, num, wait_time, ZCAN_Receive_Data, False)
+
+    def ZCAN_ReceiveFD(self, chn_handle, msgs, num, wait_time):
+        return self._receive(chn_handle, msgs, num, wait_time, ZCAN_ReceiveFD_Data, True)
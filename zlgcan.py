@@ -18,6 +18,16 @@ from ctypes import *
 import platform
 import ctypes
 import time
+import os
+import bisect
+import logging
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+_log = logging.getLogger(__name__)
 
 ZCAN_DEVICE_TYPE = c_uint
 
@@ -92,6 +102,14 @@ ZCAN_STATUS_UNSUPPORTED = 4
 ZCAN_TYPE_CAN    = c_uint(0)
 ZCAN_TYPE_CANFD  = c_uint(1)
 
+'''
+ Receive buffer pool
+'''
+RX_POOL_MIN_FRAMES = 64
+
+# receive_wait() 默认一次最多取出的帧数
+RX_WAIT_BATCH = 64
+
 '''
  Device information
 '''
@@ -253,26 +271,442 @@ class IProperty(Structure):
                 ("GetValue", c_void_p),
                 ("GetPropertys", c_void_p)]
 
+'''
+ Bulk frame builders
+'''
+# CAN-FD 合法的数据长度 (DLC 9~15 对应 12/16/20/24/32/48/64 字节)
+CANFD_LENGTHS = (0, 1, 2, 3, 4, 5, 6, 7, 8, 12, 16, 20, 24, 32, 48, 64)
+
+_CAN_DATA_OFFSET   = ZCAN_CAN_FRAME.data.offset
+_CANFD_DATA_OFFSET = ZCAN_CANFD_FRAME.data.offset
+
+def canfd_len(length):
+    """把数据长度向上取整到 CAN-FD 合法长度"""
+    for fd_len in CANFD_LENGTHS:
+        if fd_len >= length:
+            return fd_len
+    raise ValueError("CAN-FD payload too long: %d" % length)
+
+def build_transmit_data(frames, eff = 0, transmit_type = 0):
+    """
+    把 [(can_id, payload), ...] 填充到一个连续的 ZCAN_Transmit_Data 数组
+    payload 为 bytes (或可转换为 bytes 的对象)，数据区用 memmove 整块拷贝
+    """
+    frames = list(frames)
+    msgs = (ZCAN_Transmit_Data * len(frames))()
+    base = addressof(msgs)
+    size = sizeof(ZCAN_Transmit_Data)
+    for i, (can_id, payload) in enumerate(frames):
+        if not isinstance(payload, bytes):
+            payload = bytes(payload)
+        length = len(payload)
+        if length > 8:
+            raise ValueError("CAN payload too long: %d" % length)
+        frame = msgs[i].frame
+        frame.can_id  = can_id
+        frame.eff     = eff
+        frame.can_dlc = length
+        msgs[i].transmit_type = transmit_type
+        memmove(base + i * size + _CAN_DATA_OFFSET, payload, length)
+    return msgs
+
+def build_transmit_fd_data(frames, eff = 0, brs = 1, transmit_type = 0):
+    """同 build_transmit_data，生成 ZCAN_TransmitFD_Data 数组，长度不足 CAN-FD 合法长度时补 0"""
+    frames = list(frames)
+    msgs = (ZCAN_TransmitFD_Data * len(frames))()
+    base = addressof(msgs)
+    size = sizeof(ZCAN_TransmitFD_Data)
+    for i, (can_id, payload) in enumerate(frames):
+        if not isinstance(payload, bytes):
+            payload = bytes(payload)
+        length = len(payload)
+        frame = msgs[i].frame
+        frame.can_id = can_id
+        frame.eff    = eff
+        frame.brs    = brs
+        frame.len    = canfd_len(length)
+        msgs[i].transmit_type = transmit_type
+        memmove(base + i * size + _CANFD_DATA_OFFSET, payload, length)
+    return msgs
+
+# 队列发送 (设备按帧间隔发送): CAN 帧 __pad / CAN-FD 帧 flags 的 bit7 置 1，
+# __res0 (低字节)、__res1 (高字节) 为该帧发出后到下一帧的间隔，单位 ms
+TX_DELAY_SEND_FLAG = 0x80
+TX_DELAY_MAX_MS    = 0xFFFF
+_TX_FLAGS_OFFSET   = 5 # 与 ZCAN_CANFD_FRAME 的 brs/esi 位域同一字节
+
+def set_tx_delay(msgs, delay_ms, first = 0, count = None):
+    """
+    给 ZCAN_Transmit_Data / ZCAN_TransmitFD_Data 数组中 msgs[first : first+count] 设置队列发送帧间隔，
+    delay_ms 为 None 时清除标志 (立即发送)。按列跨步写入，不逐帧访问结构体
+    """
+    size = sizeof(msgs._type_)
+    if count is None:
+        count = len(msgs) - first
+    if count <= 0:
+        return
+    mem = memoryview((c_ubyte * (size * len(msgs))).from_buffer(msgs)).cast('B')
+    start = first * size
+    end = start + count * size
+    flags = mem[start + _TX_FLAGS_OFFSET : end : size]
+    if delay_ms is None:
+        mem[start + _TX_FLAGS_OFFSET : end : size] = bytes(b & ~TX_DELAY_SEND_FLAG & 0xFF for b in flags)
+        mem[start + _TX_FLAGS_OFFSET + 1 : end : size] = bytes(count)
+        mem[start + _TX_FLAGS_OFFSET + 2 : end : size] = bytes(count)
+        return
+    if not 0 <= delay_ms <= TX_DELAY_MAX_MS:
+        raise ValueError("tx delay out of range: %r" % (delay_ms,))
+    mem[start + _TX_FLAGS_OFFSET : end : size] = bytes(b | TX_DELAY_SEND_FLAG for b in flags)
+    mem[start + _TX_FLAGS_OFFSET + 1 : end : size] = bytes((delay_ms & 0xFF,)) * count
+    mem[start + _TX_FLAGS_OFFSET + 2 : end : size] = bytes((delay_ms >> 8,)) * count
+
+'''
+ NumPy views of received frames (optional, requires numpy)
+'''
+# can_id 字段在内存中的 32 位原始值: 低 29 位为 ID，高 3 位为 err/rtr/eff 标志
+CAN_ID_MASK  = 0x1FFFFFFF
+CAN_ERR_FLAG = 0x20000000
+CAN_RTR_FLAG = 0x40000000
+CAN_EFF_FLAG = 0x80000000
+
+def _rx_dtype(data_type, data_len):
+    """与 ctypes 接收结构体内存布局一致的 NumPy 结构化 dtype"""
+    frame = data_type.frame.offset
+    return np.dtype({"names":    ["can_id", "dlc", "flags", "data", "timestamp"],
+                     "formats":  ["<u4", "u1", "u1", ("u1", data_len), "<u8"],
+                     "offsets":  [frame, frame + 4, frame + 5,
+                                  frame + ZCAN_CAN_FRAME.data.offset, data_type.timestamp.offset],
+                     "itemsize": sizeof(data_type)})
+
+if np is not None:
+    CAN_RX_DTYPE   = _rx_dtype(ZCAN_Receive_Data, 8)
+    CANFD_RX_DTYPE = _rx_dtype(ZCAN_ReceiveFD_Data, 64)
+
+def frames_as_array(msgs, count = None):
+    """
+    把 ZCAN_Receive_Data / ZCAN_ReceiveFD_Data 数组零拷贝地视为 NumPy 结构化数组
+    字段: can_id (含标志位的原始值，用 CAN_ID_MASK 取 ID), dlc, flags (CAN-FD 为 brs/esi 位), data, timestamp
+    视图与 msgs 共享内存，msgs 被覆盖 (例如下一次 Receive) 后视图内容随之改变
+    """
+    if np is None:
+        raise ImportError("frames_as_array requires numpy")
+    dtype = CANFD_RX_DTYPE if msgs._type_ is ZCAN_ReceiveFD_Data else CAN_RX_DTYPE
+    if count is None:
+        count = len(msgs)
+    return np.frombuffer(msgs, dtype = dtype, count = count)
+
+'''
+ Acceptance filter
+'''
+FILTER_MAX_RANGES = 64     # USBCANFD 系列每通道可下发的范围滤波组数
+FILTER_ID_SET_MAX = 4096   # ID 总数不超过该值时主机侧过滤用集合查找，否则二分查找
+
+class ChannelFilter(object):
+    """
+    通道 ID 过滤器: 由单个 ID 和 ID 范围 (闭区间) 组成，构造时排序合并。
+    不给任何 ID/范围表示接收全部报文。
+    - hw_ranges():     供 USBCANFD 等支持范围滤波的设备使用 (ZCAN.set_channel_filter)
+    - acc_code_mask(): 供 SJA1000 类设备 (USBCAN-I/II) 的 acc_code/acc_mask 使用
+    - match():         主机侧过滤，硬件无法精确表达时兜底
+    """
+    def __init__(self, ids = (), ranges = (), eff = False):
+        spans = sorted([(i, i) for i in ids] + [(min(a, b), max(a, b)) for a, b in ranges])
+        merged = []
+        for start, end in spans:
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        self.ranges = [tuple(r) for r in merged]
+        self.eff = 1 if eff else 0
+        self.id_count = sum(end - start + 1 for start, end in self.ranges)
+        self._starts = [start for start, _ in self.ranges]
+        self._id_set = None
+        if self.id_count <= FILTER_ID_SET_MAX:
+            self._id_set = frozenset(i for start, end in self.ranges for i in range(start, end + 1))
+
+    @property
+    def accept_all(self):
+        return not self.ranges
+
+    def match(self, can_id):
+        if not self.ranges:
+            return True
+        if self._id_set is not None:
+            return can_id in self._id_set
+        i = bisect.bisect_right(self._starts, can_id) - 1
+        return i >= 0 and can_id <= self.ranges[i][1]
+
+    def hw_ranges(self, max_ranges = FILTER_MAX_RANGES):
+        """
+        返回不超过 max_ranges 组的范围列表和是否精确:
+        组数超限时反复合并间隙最小的相邻两组 (结果是原集合的超集)
+        """
+        ranges = list(self.ranges)
+        while len(ranges) > max_ranges:
+            i = min(range(len(ranges) - 1), key = lambda k: ranges[k + 1][0] - ranges[k][1])
+            ranges[i:i + 2] = [(ranges[i][0], ranges[i + 1][1])]
+        return ranges, len(ranges) == len(self.ranges)
+
+    def acc_code_mask(self):
+        """
+        计算 SJA1000 单滤波模式的 (acc_code, acc_mask, exact)，mask 位为 1 表示不关心。
+        覆盖全部 ID 的最小掩码可能是超集，exact 为 False 时需要主机侧过滤
+        """
+        if not self.ranges:
+            return 0, 0xFFFFFFFF, True
+        ref = self.ranges[0][0]
+        dont_care = 0
+        for start, end in self.ranges:
+            dont_care |= (1 << (start ^ end).bit_length()) - 1
+            dont_care |= start ^ ref
+        code = ref & ~dont_care
+        exact = (1 << bin(dont_care).count("1")) == self.id_count
+        # 标准帧 ID 位于 ACR 的 bit31..21，扩展帧位于 bit31..3，其余位不关心
+        shift = 3 if self.eff else 21
+        return code << shift, ((dont_care << shift) | ((1 << shift) - 1)) & 0xFFFFFFFF, exact
+
+    def apply_to_init_config(self, init_config):
+        """把 acc_code/acc_mask 写入通道初始化配置 (InitCAN 之前调用)，返回是否精确"""
+        code, mask, exact = self.acc_code_mask()
+        if init_config.can_type == ZCAN_TYPE_CANFD.value:
+            cfg = init_config.config.canfd
+        else:
+            cfg = init_config.config.can
+        cfg.acc_code = code
+        cfg.acc_mask = mask
+        cfg.filter   = 1 # 单滤波
+        return exact
+
+    def compact(self, msgs, count):
+        """主机侧过滤: 把 msgs 前 count 帧中匹配的帧原地前移，返回保留的帧数"""
+        size = sizeof(msgs._type_)
+        base = addressof(msgs)
+        keep = 0
+        for i in range(count):
+            frame = msgs[i].frame
+            if frame.eff == self.eff and self.match(frame.can_id):
+                if keep != i:
+                    memmove(base + keep * size, base + i * size, size)
+                keep += 1
+        return keep
+
+'''
+ DLL prototypes: export name -> (restype, argtypes)
+ DEVICE_HANDLE / CHANNEL_HANDLE 在 64 位驱动中都是指针，这里统一按 64 位无符号整数传递
+'''
+ZCAN_HANDLE = c_ulonglong
+
+ZCAN_PROTOTYPES = {
+    "ZCAN_OpenDevice":         (ZCAN_HANDLE, [c_uint, c_uint, c_uint]),
+    "ZCAN_CloseDevice":        (c_uint, [ZCAN_HANDLE]),
+    "ZCAN_GetDeviceInf":       (c_uint, [ZCAN_HANDLE, POINTER(ZCAN_DEVICE_INFO)]),
+    "ZCAN_IsDeviceOnLine":     (c_uint, [ZCAN_HANDLE]),
+    "ZCAN_SetValue":           (c_uint, [ZCAN_HANDLE, c_char_p, c_void_p]),
+    "ZCAN_GetValue":           (c_void_p, [ZCAN_HANDLE, c_char_p]),
+    "ZCAN_InitCAN":            (ZCAN_HANDLE, [ZCAN_HANDLE, c_uint, POINTER(ZCAN_CHANNEL_INIT_CONFIG)]),
+    "ZCAN_StartCAN":           (c_uint, [ZCAN_HANDLE]),
+    "ZCAN_ResetCAN":           (c_uint, [ZCAN_HANDLE]),
+    "ZCAN_ClearBuffer":        (c_uint, [ZCAN_HANDLE]),
+    "ZCAN_ReadChannelErrInfo": (c_uint, [ZCAN_HANDLE, POINTER(ZCAN_CHANNEL_ERR_INFO)]),
+    "ZCAN_ReadChannelStatus":  (c_uint, [ZCAN_HANDLE, POINTER(ZCAN_CHANNEL_STATUS)]),
+    "ZCAN_GetReceiveNum":      (c_uint, [ZCAN_HANDLE, c_uint]),
+    "ZCAN_Transmit":           (c_uint, [ZCAN_HANDLE, POINTER(ZCAN_Transmit_Data), c_uint]),
+    "ZCAN_Receive":            (c_uint, [ZCAN_HANDLE, POINTER(ZCAN_Receive_Data), c_uint, c_int]),
+    "ZCAN_TransmitFD":         (c_uint, [ZCAN_HANDLE, POINTER(ZCAN_TransmitFD_Data), c_uint]),
+    "ZCAN_ReceiveFD":          (c_uint, [ZCAN_HANDLE, POINTER(ZCAN_ReceiveFD_Data), c_uint, c_int]),
+    "GetIProperty":            (POINTER(IProperty), [ZCAN_HANDLE]),
+    "ReleaseIProperty":        (c_uint, [POINTER(IProperty)]),
+}
+
+class ZCANBackend(object):
+    """
+    ZCAN 后端接口: 导出与 zlgcan.dll 同名的函数，参数顺序同 ZCAN_PROTOTYPES，
+    ctypes 结构体/数组按对象直接传入 (不是 byref)。
+    默认实现全部返回失败 (0 / 无效句柄)，子类按需覆盖，见 zcan_virtual.VirtualZCAN
+    """
+    def ZCAN_OpenDevice(self, device_type, device_index, reserved):
+        return INVALID_DEVICE_HANDLE
+
+    def ZCAN_CloseDevice(self, device_handle):
+        return ZCAN_STATUS_ERR
+
+    def ZCAN_GetDeviceInf(self, device_handle, info):
+        return ZCAN_STATUS_ERR
+
+    def ZCAN_IsDeviceOnLine(self, device_handle):
+        return ZCAN_STATUS_OFFLINE
+
+    def ZCAN_SetValue(self, device_handle, path, value):
+        return ZCAN_STATUS_ERR
+
+    def ZCAN_GetValue(self, device_handle, path):
+        return None
+
+    def ZCAN_InitCAN(self, device_handle, can_index, init_config):
+        return INVALID_CHANNEL_HANDLE
+
+    def ZCAN_StartCAN(self, chn_handle):
+        return ZCAN_STATUS_ERR
+
+    def ZCAN_ResetCAN(self, chn_handle):
+        return ZCAN_STATUS_ERR
+
+    def ZCAN_ClearBuffer(self, chn_handle):
+        return ZCAN_STATUS_ERR
+
+    def ZCAN_ReadChannelErrInfo(self, chn_handle, err_info):
+        return ZCAN_STATUS_ERR
+
+    def ZCAN_ReadChannelStatus(self, chn_handle, status):
+        return ZCAN_STATUS_ERR
+
+    def ZCAN_GetReceiveNum(self, chn_handle, can_type):
+        return 0
+
+    def ZCAN_Transmit(self, chn_handle, msgs, num):
+        return 0
+
+    def ZCAN_Receive(self, chn_handle, msgs, num, wait_time):
+        return 0
+
+    def ZCAN_TransmitFD(self, chn_handle, msgs, num):
+        return 0
+
+    def ZCAN_ReceiveFD(self, chn_handle, msgs, num, wait_time):
+        return 0
+
+    def GetIProperty(self, device_handle):
+        return None
+
+    def ReleaseIProperty(self, iproperty):
+        return ZCAN_STATUS_ERR
+
 class ZCAN(object):
-    def __init__(self):
-        if platform.system() == "Windows":
+    def __init__(self, backend = None):
+        """
+        :param backend: ZCANBackend 实例 / 已加载的 DLL，或后端名称字符串 ("virtual")；
+                        未指定时读取环境变量 ZCAN_BACKEND，仍未指定则在 Windows 下加载 ./zlgcan.dll
+        """
+        self.__dll = None
+        if backend is None:
+            backend = os.environ.get("ZCAN_BACKEND") or None
+        if isinstance(backend, str):
+            if backend != "virtual":
+                raise ValueError(f"unknown ZCAN backend: {backend!r} (expected 'virtual')")
+            from zcan_virtual import VirtualZCAN
+            backend = VirtualZCAN()
+        if backend is not None:
+            self.__dll = backend
+        elif platform.system() == "Windows":
             self.__dll = windll.LoadLibrary("./zlgcan.dll")
         else:
             print("No support now!")
         if self.__dll == None:
             print("DLL couldn't be loaded!")
+        else:
+            self._bind(self.__dll)
+        # (chn_handle, data type) -> grow-only receive array, see _rx_view()
+        self._rx_pool = {}
+        # (chn_handle, data type, rcv_num) -> 接收池前 rcv_num 帧的视图
+        self._rx_views = {}
+        # chn_handle -> ChannelFilter，硬件无法精确过滤时由接收函数在主机侧过滤
+        self._host_filters = {}
+        # (device_handle, chn_index) -> 观察到的最大发送队列空闲数 (即队列容量)
+        self._tx_queue_size = {}
+
+    def _bind(self, dll):
+        """
+        一次性解析 DLL 导出函数并声明 argtypes/restype，绑定结果缓存为 self._<导出名>，
+        之后每次调用只剩一次外部函数调用，不再重复查找属性和包装句柄
+        """
+        for name, (restype, argtypes) in ZCAN_PROTOTYPES.items():
+            func = getattr(dll, name, None)
+            if func is not None and hasattr(func, "argtypes"):
+                func.restype = restype
+                func.argtypes = argtypes
+            setattr(self, "_" + name, func)
+
+    @property
+    def backend(self):
+        """当前使用的后端 (DLL 或 ZCANBackend 对象)"""
+        return self.__dll
+
+    def _rx_view(self, chn_handle, data_type, rcv_num):
+        """
+        返回通道接收池中前 rcv_num 帧的视图，池不够大时按倍数扩容 (只增不减)
+        视图按 (通道, 类型, 帧数) 缓存，相同参数的调用只剩一次字典查找
+        """
+        view = self._rx_views.get((chn_handle, data_type, rcv_num))
+        if view is not None:
+            return view
+        key = (chn_handle, data_type)
+        pool = self._rx_pool.get(key)
+        if pool is None or len(pool) < rcv_num:
+            size = RX_POOL_MIN_FRAMES if pool is None else len(pool)
+            while size < rcv_num:
+                size *= 2
+            pool = (data_type * size)()
+            self._rx_pool[key] = pool
+            # 旧池上的视图作废
+            for k in [k for k in self._rx_views if k[:2] == key]:
+                del self._rx_views[k]
+        view = (data_type * rcv_num).from_buffer(pool)
+        self._rx_views[(chn_handle, data_type, rcv_num)] = view
+        return view
+
+    def _host_filter(self, chn_handle, msgs, count):
+        flt = self._host_filters.get(chn_handle)
+        return count if flt is None else flt.compact(msgs, count)
+
+    def set_channel_filter(self, device_handle, chn_index, chn_handle, flt):
+        """
+        下发通道过滤器: 通过 ZCAN_SetValue 写入范围滤波 (filter_mode/filter_start/filter_end/filter_ack)，
+        在 InitCAN 之后、StartCAN 之前调用。设备不支持范围滤波或组数不够时，
+        安装主机侧过滤器，由 Receive/ReceiveFD/receive_into 在返回前剔除不匹配的帧
+        :return: True 表示硬件已精确过滤
+        """
+        if flt.accept_all:
+            # filter_clear 同样要 filter_ack 之后才生效
+            self._host_filters.pop(chn_handle, None)
+            return self._clear_hw_filter(device_handle, chn_index)
+
+        ok = self.ZCAN_SetValue(device_handle, "%d/filter_clear" % chn_index, "0") == ZCAN_STATUS_OK
+
+        ranges, exact = flt.hw_ranges()
+        for start, end in ranges:
+            if not ok:
+                break
+            ok = (self.ZCAN_SetValue(device_handle, "%d/filter_mode" % chn_index, str(flt.eff)) == ZCAN_STATUS_OK and
+                  self.ZCAN_SetValue(device_handle, "%d/filter_start" % chn_index, hex(start)) == ZCAN_STATUS_OK and
+                  self.ZCAN_SetValue(device_handle, "%d/filter_end" % chn_index, hex(end)) == ZCAN_STATUS_OK)
+        if ok:
+            ok = self.ZCAN_SetValue(device_handle, "%d/filter_ack" % chn_index, "0") == ZCAN_STATUS_OK
+
+        if ok and exact:
+            self._host_filters.pop(chn_handle, None)
+            return True
+        if not ok and not self._clear_hw_filter(device_handle, chn_index):
+            # 残留的部分范围会在硬件里丢掉主机侧过滤器需要的帧
+            _log.error("通道 %d 范围滤波写入失败且无法清除，部分报文可能收不到", chn_index)
+        self._host_filters[chn_handle] = flt
+        return False
+
+    def _clear_hw_filter(self, device_handle, chn_index):
+        """清除已写入的范围滤波并生效 (全部接收)，返回是否成功"""
+        return (self.ZCAN_SetValue(device_handle, "%d/filter_clear" % chn_index, "0") == ZCAN_STATUS_OK and
+                self.ZCAN_SetValue(device_handle, "%d/filter_ack" % chn_index, "0") == ZCAN_STATUS_OK)
 
     def OpenDevice(self, device_type, device_index, reserved):
         try:
-            self.__dll.ZCAN_OpenDevice.restype = ctypes.c_longlong
-            return self.__dll.ZCAN_OpenDevice(device_type, device_index, reserved)
+            return self._ZCAN_OpenDevice(device_type, device_index, reserved)
         except:
             print("Exception on OpenDevice!") 
             raise
 
     def CloseDevice(self, device_handle):
         try:
-            return self.__dll.ZCAN_CloseDevice(device_handle)
+            return self._ZCAN_CloseDevice(device_handle)
         except:
             print("Exception on CloseDevice!")
             raise
@@ -280,7 +714,7 @@ class ZCAN(object):
     def GetDeviceInf(self, device_handle):
         try:
             info = ZCAN_DEVICE_INFO()
-            ret = self.__dll.ZCAN_GetDeviceInf(device_handle, byref(info))
+            ret = self._ZCAN_GetDeviceInf(device_handle, info)
             return info if ret == ZCAN_STATUS_OK else None
         except:
             print("Exception on ZCAN_GetDeviceInf")
@@ -288,56 +722,117 @@ class ZCAN(object):
 
     def DeviceOnLine(self, device_handle):
         try:
-            return self.__dll.ZCAN_IsDeviceOnLine(device_handle)
+            return self._ZCAN_IsDeviceOnLine(device_handle)
         except:
             print("Exception on ZCAN_ZCAN_IsDeviceOnLine!")
             raise
     def ZCAN_SetValue(self, chn_handle,path,value):
+        """value 为字符串，或按引用传递的 ctypes 结构体 (如 ZCAN_AUTO_TRANSMIT_OBJ)"""
         try:
-            print(f"ZCAN_SetValue Channel Handle: {chn_handle}")
-            self.__dll.ZCAN_SetValue.restype = ctypes.c_longlong
-
-            # 将 chn_handle 转换为 ctypes 对象，假设它是一个 64 位的整数
-            handle = ctypes.c_ulonglong(chn_handle)
- 
-            print(f"ZCAN_SetValue path: {path}")
-            print(f"ZCAN_SetValue value: {value}")
-            return self.__dll.ZCAN_SetValue(handle,c_char_p(path.encode("utf-8")), c_char_p(value.encode("utf-8")))
+            _log.debug("ZCAN_SetValue handle=%s path=%s value=%s", chn_handle, path, value)
+            value = value.encode("utf-8") if isinstance(value, str) else byref(value)
+            return self._ZCAN_SetValue(chn_handle, path.encode("utf-8"), value)
 
         except:
-            print("Exception on ZCAN_StartCAN!")
+            print("Exception on ZCAN_SetValue!")
             raise   
+    def ZCAN_GetValue(self, device_handle, path):
+        """返回驱动给出的结果地址 (int)，不支持时返回 None"""
+        if self._ZCAN_GetValue is None:
+            return None
+        try:
+            return self._ZCAN_GetValue(device_handle, path.encode("utf-8"))
+        except:
+            print("Exception on ZCAN_GetValue!")
+            raise
+
+    def set_tx_queue_mode(self, device_handle, chn_index, enable = True):
+        """开启/关闭通道的队列发送模式 (帧携带 set_tx_delay 设置的帧间隔，由设备定时发出)"""
+        return self.ZCAN_SetValue(device_handle, "%d/set_send_mode" % chn_index, "1" if enable else "0")
+
+    def tx_queue_free(self, device_handle, chn_index):
+        """设备发送队列的空闲帧数，设备不支持时返回 None"""
+        addr = self.ZCAN_GetValue(device_handle, "%d/get_device_available_tx_count/1" % chn_index)
+        if not addr:
+            return None
+        free = cast(addr, POINTER(c_int)).contents.value
+        key = (device_handle, chn_index)
+        if free > self._tx_queue_size.get(key, 0):
+            self._tx_queue_size[key] = free
+        return free
+
+    def tx_queue_status(self, device_handle, chn_index):
+        """
+        (排队帧数, 空闲帧数)，设备不支持时返回 None
+        队列容量取观察到的最大空闲数，第一次查询应在队列为空时进行
+        """
+        free = self.tx_queue_free(device_handle, chn_index)
+        if free is None:
+            return None
+        return self._tx_queue_size[(device_handle, chn_index)] - free, free
+
+    def clear_tx_queue(self, device_handle, chn_index):
+        """丢弃设备发送队列中尚未发出的帧"""
+        return self.ZCAN_SetValue(device_handle, "%d/clear_delay_send_queue" % chn_index, "0")
+
+    def set_auto_transmit(self, device_handle, chn_index, index, can_id, payload, period_ms,
+                          eff = 0, is_fd = False, brs = 1):
+        """
+        注册/更新一条设备定时发送报文 (由设备固件按 period_ms 周期发送)，
+        index 相同则覆盖原有条目，需调用 apply_auto_transmit 生效
+        """
+        if is_fd:
+            obj = ZCANFD_AUTO_TRANSMIT_OBJ()
+            obj.obj = build_transmit_fd_data(((can_id, payload),), eff, brs)[0]
+            path = "%d/auto_send_canfd" % chn_index
+        else:
+            obj = ZCAN_AUTO_TRANSMIT_OBJ()
+            obj.obj = build_transmit_data(((can_id, payload),), eff)[0]
+            path = "%d/auto_send" % chn_index
+        obj.enable = 1
+        obj.index = index
+        obj.interval = period_ms
+        return self.ZCAN_SetValue(device_handle, path, obj)
+
+    def cancel_auto_transmit(self, device_handle, chn_index, index, is_fd = False):
+        """禁用一条设备定时发送报文，需调用 apply_auto_transmit 生效"""
+        obj = ZCANFD_AUTO_TRANSMIT_OBJ() if is_fd else ZCAN_AUTO_TRANSMIT_OBJ()
+        obj.enable = 0
+        obj.index = index
+        path = "%d/auto_send_canfd" % chn_index if is_fd else "%d/auto_send" % chn_index
+        return self.ZCAN_SetValue(device_handle, path, obj)
+
+    def apply_auto_transmit(self, device_handle, chn_index):
+        return self.ZCAN_SetValue(device_handle, "%d/apply_auto_send" % chn_index, "0")
+
+    def clear_auto_transmit(self, device_handle, chn_index):
+        """停止并清空通道的全部设备定时发送报文"""
+        return self.ZCAN_SetValue(device_handle, "%d/clear_auto_send" % chn_index, "0")
+
     def InitCAN(self, device_handle, can_index, init_config):
         try:
-            self.__dll.ZCAN_InitCAN.restype = ctypes.c_longlong
-            return self.__dll.ZCAN_InitCAN(device_handle, can_index, byref(init_config))
+            return self._ZCAN_InitCAN(device_handle, can_index, init_config)
         except:
             print("Exception on ZCAN_InitCAN!")
             raise
 
     def StartCAN(self, chn_handle):
         try:
-            self.__dll.ZCAN_StartCAN.restype = ctypes.c_longlong
-
-            # 将 chn_handle 转换为 ctypes 对象，假设它是一个 64 位的整数
-            handle = ctypes.c_ulonglong(chn_handle)
-            return self.__dll.ZCAN_StartCAN(handle)
+            return self._ZCAN_StartCAN(chn_handle)
         except:
             print("Exception on ZCAN_StartCAN!")
             raise
 
     def ResetCAN(self, chn_handle):
         try:
-              # 将 chn_handle 转换为 ctypes 对象，假设它是一个 64 位的整数
-            handle = ctypes.c_ulonglong(chn_handle)
-            return self.__dll.ZCAN_ResetCAN(handle)
+            return self._ZCAN_ResetCAN(chn_handle)
         except:
             print("Exception on ZCAN_ResetCAN!")
             raise
 
     def ClearBuffer(self, chn_handle):
         try:
-            return self.__dll.ZCAN_ClearBuffer(chn_handle)
+            return self._ZCAN_ClearBuffer(chn_handle)
         except:
             print("Exception on ZCAN_ClearBuffer!")
             raise
@@ -345,7 +840,7 @@ class ZCAN(object):
     def ReadChannelErrInfo(self, chn_handle):
         try:
             ErrInfo = ZCAN_CHANNEL_ERR_INFO()
-            ret = self.__dll.ZCAN_ReadChannelErrInfo(chn_handle, byref(ErrInfo))
+            ret = self._ZCAN_ReadChannelErrInfo(chn_handle, ErrInfo)
             return ErrInfo if ret == ZCAN_STATUS_OK else None
         except:
             print("Exception on ZCAN_ReadChannelErrInfo!")
@@ -354,7 +849,7 @@ class ZCAN(object):
     def ReadChannelStatus(self, chn_handle):
         try:
             status = ZCAN_CHANNEL_STATUS()
-            ret = self.__dll.ZCAN_ReadChannelStatus(chn_handle, byref(status))
+            ret = self._ZCAN_ReadChannelStatus(chn_handle, status)
             return status if ret == ZCAN_STATUS_OK else None
         except:
             print("Exception on ZCAN_ReadChannelStatus!")
@@ -362,46 +857,107 @@ class ZCAN(object):
 
     def GetReceiveNum(self, chn_handle, can_type = ZCAN_TYPE_CAN):
         try:
-            # 将 chn_handle 转换为 ctypes 对象，假设它是一个 64 位的整数
-            handle = ctypes.c_ulonglong(chn_handle)
-            return self.__dll.ZCAN_GetReceiveNum(handle, can_type)
+            return self._ZCAN_GetReceiveNum(chn_handle, can_type)
         except:
             print("Exception on ZCAN_GetReceiveNum!")
             raise
 
     def Transmit(self, chn_handle, std_msg, len):
         try:
-             # 将 chn_handle 转换为 ctypes 对象，假设它是一个 64 位的整数
-            handle = ctypes.c_ulonglong(chn_handle)
-            return self.__dll.ZCAN_Transmit(handle, byref(std_msg), len)
+            return self._ZCAN_Transmit(chn_handle, std_msg, len)
         except:
             print("Exception on ZCAN_Transmit!")
             raise
 
     def Receive(self, chn_handle, rcv_num, wait_time = c_int(-1)):
+        """
+        接收标准 CAN 报文
+        返回的数组是通道接收池的视图 (同一通道、相同 rcv_num 时每次返回同一个对象)，
+        下一次在同一通道上调用 Receive/receive_wait/receive_array 时会覆盖之前返回的报文，
+        需要保留的报文请自行拷贝
+        """
         try:
-            handle = ctypes.c_ulonglong(chn_handle)
-            rcv_can_msgs = (ZCAN_Receive_Data * rcv_num)()
-            ret = self.__dll.ZCAN_Receive(handle, byref(rcv_can_msgs), rcv_num, wait_time)
+            rcv_can_msgs = self._rx_view(chn_handle, ZCAN_Receive_Data, rcv_num)
+            ret = self._ZCAN_Receive(chn_handle, rcv_can_msgs, rcv_num, wait_time)
+            if ret and self._host_filters:
+                ret = self._host_filter(chn_handle, rcv_can_msgs, ret)
             return rcv_can_msgs, ret
         except:
             print("Exception on ZCAN_Receive!")
             raise
+
+    def receive_wait(self, chn_handle, timeout, rcv_num = RX_WAIT_BATCH, can_type = ZCAN_TYPE_CAN):
+        """
+        阻塞接收: 利用 ZCAN_Receive 的 wait_time 参数，在驱动内等待直到有报文或超时，
+        取代 "GetReceiveNum + sleep" 轮询
+        :param timeout: 最长等待时间 (秒)，<= 0 表示只取当前缓冲区中的报文
+        :return: (接收池视图, 实际帧数)，超时返回帧数 0
+        """
+        wait_ms = int(timeout * 1000 + 0.999) if timeout > 0 else 0
+        if getattr(can_type, "value", can_type) == ZCAN_TYPE_CANFD.value:
+            return self.ReceiveFD(chn_handle, rcv_num, wait_ms)
+        return self.Receive(chn_handle, rcv_num, wait_ms)
+
+    def receive_array(self, chn_handle, rcv_num, wait_time = 0, can_type = ZCAN_TYPE_CAN):
+        """
+        接收报文并以 NumPy 结构化数组返回 (接收池的零拷贝视图，见 frames_as_array)，
+        长度为实际接收帧数，便于对整批报文做向量化的 ID 过滤/统计/取数
+        """
+        if getattr(can_type, "value", can_type) == ZCAN_TYPE_CANFD.value:
+            msgs, ret = self.ReceiveFD(chn_handle, rcv_num, wait_time)
+        else:
+            msgs, ret = self.Receive(chn_handle, rcv_num, wait_time)
+        return frames_as_array(msgs, ret)
+
+    def receive_into(self, chn_handle, buffer, wait_time = c_int(-1)):
+        """
+        接收报文到调用者提供的数组 (ZCAN_Receive_Data 或 ZCAN_ReceiveFD_Data 数组)
+        :return: 实际接收的帧数
+        """
+        try:
+            if buffer._type_ is ZCAN_ReceiveFD_Data:
+                ret = self._ZCAN_ReceiveFD(chn_handle, buffer, len(buffer), wait_time)
+            else:
+                ret = self._ZCAN_Receive(chn_handle, buffer, len(buffer), wait_time)
+            if ret and self._host_filters:
+                ret = self._host_filter(chn_handle, buffer, ret)
+            return ret
+        except:
+            print("Exception on ZCAN_Receive!")
+            raise
     
+    def transmit_many(self, chn_handle, frames, eff = 0, transmit_type = 0):
+        """
+        一次 DLL 调用发送多帧标准 CAN 报文
+        :param frames: [(can_id, payload_bytes), ...]
+        :return: 设备实际接收的帧数
+        """
+        msgs = build_transmit_data(frames, eff, transmit_type)
+        if not len(msgs):
+            return 0
+        return self.Transmit(chn_handle, msgs, len(msgs))
+
+    def transmit_many_fd(self, chn_handle, frames, eff = 0, brs = 1, transmit_type = 0):
+        """一次 DLL 调用发送多帧 CAN-FD 报文，参数/返回值同 transmit_many"""
+        msgs = build_transmit_fd_data(frames, eff, brs, transmit_type)
+        if not len(msgs):
+            return 0
+        return self.TransmitFD(chn_handle, msgs, len(msgs))
+
     def TransmitFD(self, chn_handle, fd_msg, len):
         try:
-             # 将 chn_handle 转换为 ctypes 对象，假设它是一个 64 位的整数
-            handle = ctypes.c_ulonglong(chn_handle)
-            return self.__dll.ZCAN_TransmitFD(handle, byref(fd_msg), len)
+            return self._ZCAN_TransmitFD(chn_handle, fd_msg, len)
         except:
             print("Exception on ZCAN_TransmitFD!")
             raise
     
     def ReceiveFD(self, chn_handle, rcv_num, wait_time = c_int(-1)):
+        """接收 CAN-FD 报文，返回值同 Receive (接收池视图)"""
         try:
-            handle = ctypes.c_ulonglong(chn_handle)
-            rcv_canfd_msgs = (ZCAN_ReceiveFD_Data * rcv_num)()
-            ret = self.__dll.ZCAN_ReceiveFD(handle, byref(rcv_canfd_msgs), rcv_num, wait_time)
+            rcv_canfd_msgs = self._rx_view(chn_handle, ZCAN_ReceiveFD_Data, rcv_num)
+            ret = self._ZCAN_ReceiveFD(chn_handle, rcv_canfd_msgs, rcv_num, wait_time)
+            if ret and self._host_filters:
+                ret = self._host_filter(chn_handle, rcv_canfd_msgs, ret)
             return rcv_canfd_msgs, ret
         except:
             print("Exception on ZCAN_ReceiveFD!")
@@ -409,8 +965,7 @@ class ZCAN(object):
 
     def GetIProperty(self, device_handle):
         try:
-            self.__dll.GetIProperty.restype = POINTER(IProperty)
-            return self.__dll.GetIProperty(device_handle)
+            return self._GetIProperty(device_handle)
         except:
             print("Exception on ZCAN_GetIProperty!")
             raise
@@ -426,21 +981,21 @@ class ZCAN(object):
     def GetValue(self, iproperty, path):
         try:
             func = CFUNCTYPE(c_char_p, c_char_p)(iproperty.contents.GetValue)
-            return func(c_char_p(path.encode))
+            return func(c_char_p(path.encode("utf-8")))
         except:
             print("Exception on IProperty GetValue")
             raise
 
     def ReleaseIProperty(self, iproperty):
         try:
-            return self.__dll.ReleaseIProperty(iproperty)
+            return self._ReleaseIProperty(iproperty)
         except:
             print("Exception on ZCAN_ReleaseIProperty!")
             raise
 ###############################################################################
 ''' 
 '''
-def can_start(zcanlib, device_handle, chn): 
+def can_start(zcanlib, device_handle, chn, flt = None): 
  
 
     zcanlib.ZCAN_SetValue(device_handle,"0/canfd_standard", "0"); #
@@ -459,6 +1014,8 @@ def can_start(zcanlib, device_handle, chn):
     chn_handle = zcanlib.InitCAN(device_handle, chn, chn_init_cfg)
     if chn_handle is None:
         return None
+    if flt is not None:
+        zcanlib.set_channel_filter(device_handle, chn, chn_handle, flt)
     zcanlib.StartCAN(chn_handle)
     return chn_handle
 